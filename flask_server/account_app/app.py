@@ -1,13 +1,14 @@
 import logging
-import sys
 
-from flask import Blueprint, abort, jsonify, render_template
+from flask import Blueprint, abort, jsonify, render_template, request
 from flask_login import current_user
 
-sys.path.append("..")
 from const import UserGroup
 from db import db
-from db.models import Group, User
+from db.models import Device, Group, User
+from db.refdata import registry
+from db.slowlog import slow_queries
+from presence import presence
 from account_app.utils import allows_to, login_required
 
 account_app = Blueprint('account', __name__, template_folder='templates')
@@ -42,8 +43,13 @@ def delete(uid):
     if target.is_administrator:
         return 'Cannot delete Administrator', 403
 
+    # The devices are deleted by the database along with the user
+    mac_addrs = [mac_addr for mac_addr, in
+                 db.session.query(Device.mac_addr).filter(Device.user_id == uid)]
     db.session.delete(target)
     db.session.commit()
+    for mac_addr in mac_addrs:
+        presence.forget(mac_addr)
     return jsonify({'state': 'ok'})
 
 
@@ -58,10 +64,31 @@ def chgrp(uid, gid):
     if target.id == current_user.id:
         return 'Cannot change your own group', 403
 
-    g = Group.query.get(gid)
-    if g is None:
+    if registry.group_name(gid) is None:
         return 'Group id {} not found'.format(gid), 404
 
-    target.group = g
+    target.group_id = gid
     db.session.commit()
     return jsonify({'state': 'ok'})
+
+
+@account_app.route('/account/slow_queries', methods=['GET', 'DELETE'], strict_slashes=False)
+@login_required
+@allows_to([UserGroup.Administrator])
+def slow_query_list():
+    """
+    List the slowest statement shapes of this process, `?order=` 'total_ms' (default),
+    'max_ms' or 'count', `?limit=` 20 by default. DELETE clears them.
+    """
+    if request.method == 'DELETE':
+        slow_queries.clear()
+        return jsonify({'state': 'ok'})
+
+    order = request.args.get('order', 'total_ms')
+    if order not in ('total_ms', 'max_ms', 'count'):
+        return 'Unknown order {}'.format(order), 400
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        'threshold_ms': slow_queries.threshold_ms,
+        'queries': slow_queries.top(limit, order),
+    })
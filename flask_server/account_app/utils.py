@@ -20,7 +20,7 @@ def allows_to(groups=[]):
     def decorator(func):
         def check_group(*args, **kwargs):
             for group in groups:
-                if current_user.group.name == group:
+                if current_user.group_name == group:
                     return func(*args, **kwargs)
             abort(403)
         check_group.__name__ = func.__name__
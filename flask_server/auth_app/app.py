@@ -1,18 +1,16 @@
 import datetime
 import logging
-import sys
 
-import pytz
-from authlib.integrations.requests_client import OAuth2Session
 from flask import Blueprint, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_user, logout_user
 from requests import exceptions as requests_exceptions
 
-sys.path.append("..")
 from const import UserGroup
 from db import db
-from db.models import AccessToken, Group, RefreshToken, User
+from db.models import AccessToken, RefreshToken, User
+from db.refdata import registry
 from oauth2_client import oauth2_client
+from tracing import tracer
 import config
 
 auth_app = Blueprint('auth', __name__, template_folder='templates')
@@ -50,9 +48,11 @@ def auth_callback():
         # Exchange access token with an authorization code with token endpoint
         #
         # Ref: https://docs.authlib.org/en/stable/client/frameworks.html#id1
-        token_response = oauth2_client.nycu.authorize_access_token()
+        with tracer.span('oauth2 authorize_access_token', kind='client'):
+            token_response = oauth2_client.nycu.authorize_access_token()
         # Parse the received ID token
-        user_info = oauth2_client.nycu.parse_id_token(token_response)
+        with tracer.span('oauth2 parse_id_token', kind='client'):
+            user_info = oauth2_client.nycu.parse_id_token(token_response)
         print("token response :")
         print(token_response)
         print("//////////")
@@ -75,10 +75,10 @@ def auth_callback():
             )
             if user_info['group'] == 'Administrator':
                 print("=====Set user group 'Administrator'=====")
-                user_record.group = db.session.query(Group).filter_by(name=UserGroup.Administrator).first()
+                user_record.group_id = registry.group_id(UserGroup.Administrator)
             else:
                 print("=====Set user group 'User'=====")
-                user_record.group = db.session.query(Group).filter_by(name=UserGroup.User).first()
+                user_record.group_id = registry.group_id(UserGroup.User)
             print("=====Set user group successfully=====")
             db.session.add(user_record)
             db.session.commit()
@@ -115,7 +115,7 @@ def auth_callback():
         access_token_record = AccessToken(
             token=token_response.get('access_token'),
             expires_at=(
-                datetime.datetime.utcnow().replace(tzinfo=pytz.UTC)
+                datetime.datetime.now(datetime.timezone.utc)
                 + datetime.timedelta(seconds=token_response.get('expires_in', 0))
             ),
             user=user_record,
@@ -159,9 +159,12 @@ def logout():
     if not access_token_record:
         return redirect(config.ACCOUNT_HOST)
 
-    # Create an OAuth 2.0 client provided Authlib
+    # Create an OAuth 2.0 client provided Authlib, it is only needed here
+    # and slow to import, so it is not imported at startup.
     #
     # Ref: https://tinyurl.com/2rs2594h (OAuth2Session documentation)
+    from authlib.integrations.requests_client import OAuth2Session
+
     oauth2_client = OAuth2Session(
         client_id=config.OAUTH2_CLIENT_ID,
         client_secret=config.OAUTH2_CLIENT_SECRET,
@@ -170,11 +173,13 @@ def logout():
 
     try:
         # Revoke the access token
-        response = oauth2_client.revoke_token(
-            config.OAUTH2_REVOCATION_ENDPOINT,
-            token=access_token_record.token,
-            token_type_hint='access_token'
-        )
+        with tracer.span('oauth2 revoke_token', kind='client',
+                         url=config.OAUTH2_REVOCATION_ENDPOINT):
+            response = oauth2_client.revoke_token(
+                config.OAUTH2_REVOCATION_ENDPOINT,
+                token=access_token_record.token,
+                token_type_hint='access_token'
+            )
         response.raise_for_status()
     except requests_exceptions.Timeout:
         logger.warning('Revoke an access token failed due to request timeout')
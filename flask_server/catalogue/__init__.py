@@ -0,0 +1,5 @@
+from .graph import catalogue
+
+__all__ = [
+    'catalogue',
+]
@@ -0,0 +1,154 @@
+"""
+Benchmark of the catalogue reads, run it with `flask bench-catalogue`.
+
+The rows are inserted into the configured database by a user created for the
+benchmark, and deleted by it.
+"""
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import delete, insert, or_
+
+from catalogue.graph import catalogue
+from db import db
+from db import models
+from modules.deviceparameter import _merged_parameter_query
+from modules.utils import record_parser
+
+__all__ = [
+    'bench_catalogue',
+]
+
+
+def _seed(features, per_model, parameters):
+    tag = uuid.uuid4().hex[:12]
+    user_id = db.session.execute(insert(models.User.__table__).values(
+        username='bench-' + tag, group_id=2)).inserted_primary_key[0]
+    unit_id = db.session.execute(insert(models.Unit.__table__).values(
+        unit_name='bench-' + tag)).inserted_primary_key[0]
+    dm_ids = [db.session.execute(insert(models.DeviceModel.__table__).values(
+                  dm_name='bench-{}-{}'.format(tag, i), dm_type='other'))
+              .inserted_primary_key[0]
+              for i in range(0, features, per_model)]
+    df_ids = [db.session.execute(insert(models.DeviceFeature.__table__).values(
+                  df_name='bench-{}-{}'.format(tag, i), df_type=('idf', 'odf')[i % 2],
+                  param_num=parameters, user_id=user_id))
+              .inserted_primary_key[0]
+              for i in range(features)]
+    mf_ids = [db.session.execute(insert(models.DM_DF.__table__).values(
+                  dm_id=dm_ids[i // per_model], df_id=df_id)).inserted_primary_key[0]
+              for i, df_id in enumerate(df_ids)]
+    # The parameters of the general user, which the graph holds
+    db.session.execute(insert(models.DeviceParameter.__table__), [
+        {'param_type': 'float', 'min': 0, 'max': 0, 'idf_type': 'sample',
+         'normalization': False, 'user_id': 1, 'df_id': df_id, 'dmdf_id': mf_id,
+         'unit_id': unit_id}
+        for df_id, mf_id in zip(df_ids, mf_ids) for _ in range(parameters)
+    ])
+    db.session.commit()
+    return user_id, unit_id, dm_ids
+
+
+def _sql_model_info(dm_id, user_id):
+    """The queries of `op_get_device_model_info` without the catalogue, but the tags."""
+    dm = record_parser(db.session.get(models.DeviceModel, dm_id))
+    dm['df_list'] = []
+    df_records = (db.session.query(models.DeviceFeature, models.DM_DF.id)
+                            .select_from(models.DM_DF)
+                            .join(models.DeviceFeature,
+                                  models.DeviceFeature.id == models.DM_DF.df_id)
+                            .join(models.DeviceParameter,
+                                  models.DeviceParameter.dmdf_id == models.DM_DF.id)
+                            .filter(models.DM_DF.dm_id == dm_id,
+                                    or_(models.DeviceParameter.user_id == user_id,
+                                        models.DeviceParameter.user_id == 1))
+                            .group_by(models.DeviceFeature.id)
+                            .order_by(models.DeviceFeature.df_name)
+                            .all())
+    for df_record, dmdf_id in df_records:
+        df = record_parser(df_record)
+        df['df_parameter'] = [
+            record_parser(row) for row in db.session.execute(_merged_parameter_query(
+                user_id, models.DeviceParameter.dmdf_id == dmdf_id))
+        ]
+        df['tags'] = []
+        dm['df_list'].append(df)
+    return dm
+
+
+def _sql_feature_list(user_id):
+    result = {'idf': [], 'odf': []}
+    for df_record in (db.session.query(models.DeviceFeature)
+                                .filter(models.DeviceFeature.user_id == user_id)
+                                .order_by(models.DeviceFeature.df_name)):
+        result[df_record.df_type].append(record_parser(df_record))
+    return result
+
+
+def _median_ms(fn, args, rounds):
+    times = []
+    for _ in range(rounds):
+        arg = random.choice(args)
+        start = time.perf_counter()
+        fn(*arg)
+        times.append((time.perf_counter() - start) * 1e3)
+    return statistics.median(times)
+
+
+def bench_catalogue(features=10000, per_model=10, parameters=2, rounds=200):
+    """
+    Measure loading the catalogue graph and its memory, and the model info and
+    feature list read from the graph and from the database.
+
+    :return: {'load_ms', 'memory_mb', 'model_info': {'graph_ms', 'sql_ms'},
+              'feature_list': {'graph_ms', 'sql_ms'}}, the medians of the rounds
+    """
+    user_id, unit_id, dm_ids = _seed(features, per_model, parameters)
+    try:
+        with db.engine.connect() as connection:
+            start = time.perf_counter()
+            catalogue.load(connection)
+            load_ms = (time.perf_counter() - start) * 1e3
+            # Once more traced, the tracing slows the load down
+            catalogue.reset()
+            tracemalloc.start()
+            catalogue.load(connection)
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        models_args = [(dm_id, 1) for dm_id in dm_ids]
+        same = all(catalogue.model_info(*args) == _sql_model_info(*args)
+                   for args in models_args[:10])
+        same = same and catalogue.feature_list(user_id) == _sql_feature_list(user_id)
+        result = {
+            'features': features,
+            'models': len(dm_ids),
+            'load_ms': load_ms,
+            'memory_mb': memory / 1e6,
+            'same': same,
+            'model_info': {
+                'graph_ms': _median_ms(catalogue.model_info, models_args, rounds),
+                'sql_ms': _median_ms(_sql_model_info, models_args, rounds),
+            },
+            'feature_list': {
+                'graph_ms': _median_ms(catalogue.feature_list, [(user_id,)], rounds // 10),
+                'sql_ms': _median_ms(_sql_feature_list, [(user_id,)], rounds // 10),
+            },
+        }
+    finally:
+        db.session.rollback()
+        db.session.execute(delete(models.DeviceModel.__table__)
+                           .where(models.DeviceModel.__table__.c.id.in_(dm_ids)))
+        # The user takes its device features
+        db.session.execute(delete(models.User.__table__)
+                           .where(models.User.__table__.c.id == user_id))
+        db.session.execute(delete(models.Unit.__table__)
+                           .where(models.Unit.__table__.c.id == unit_id))
+        db.session.commit()
+        # Loaded again without the rows of the benchmark on its next read
+        catalogue.reset()
+
+    return result
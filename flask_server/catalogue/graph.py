@@ -0,0 +1,370 @@
+"""
+In-memory graph of the catalogue, DeviceModel -> DM_DF -> DeviceFeature -> DeviceParameter.
+
+The graph holds compact read-only records (see `catalogue.records`) instead of
+ORM instances, a model refers to its DM_DF by an `array('l')` of ids:
+
+    _features:      DeviceFeature.id -> FeatureRecord
+    _models:        DeviceModel.id -> ModelRecord (dmdf_ids)
+    _dmdfs:         DM_DF.id -> DmDfRecord (params of the general user)
+    _feature_dmdfs: DeviceFeature.id -> array('l') of DM_DF.id
+    _customized:    DM_DF.id -> frozenset of the user ids with their own parameters
+
+It is updated incrementally after every commit of the mutating ops, the rows they
+flush or bulk update/delete are tracked by session events, then the touched
+models and features are loaded again.
+
+The commits of the other processes are detected by a change token, see
+`db.changes`, the whole graph is loaded again then.
+"""
+import logging
+import threading
+from array import array
+from collections import defaultdict
+
+from sqlalchemy import event, select, union
+from sqlalchemy.orm import Session
+
+from catalogue.records import DmDfRecord, FeatureRecord, ModelRecord, ParameterRecord
+from db import db
+from db.changes import ChangeToken
+from db.models import (DeviceFeature, DeviceModel, DeviceParameter, DeviceParameterDelta,
+                       DM_DF, Function, Unit, User)
+
+__all__ = [
+    'CatalogueGraph',
+    'catalogue',
+]
+
+logger = logging.getLogger(__name__)
+
+F = DeviceFeature.__table__
+M = DeviceModel.__table__
+MF = DM_DF.__table__
+P = DeviceParameter.__table__
+D = DeviceParameterDelta.__table__
+
+# The column which tells what to reload when a row of the model changes
+TRACKED_COLUMNS = {
+    DeviceFeature: ('df', F.c.id),
+    DeviceModel: ('dm', M.c.id),
+    DM_DF: ('dm', MF.c.dm_id),
+    DeviceParameter: ('dmdf', P.c.dmdf_id),
+    DeviceParameterDelta: ('base', D.c.base_id),
+}
+# The deletion of these rows cascades to the catalogue, the whole graph is loaded again
+FULL_RELOAD_MODELS = (User, Unit, Function)
+
+
+def _new_pending():
+    return {'dm': set(), 'df': set(), 'dmdf': set(), 'base': set(), 'full': False}
+
+
+class CatalogueGraph:
+    def __init__(self):
+        self.enabled = False
+
+        self._app = None
+        self._lock = threading.RLock()
+        self._token = ChangeToken(1)
+        self._features = {}
+        self._models = {}
+        self._dmdfs = {}
+        self._feature_dmdfs = defaultdict(lambda: array('l'))
+        self._customized = {}
+        self._feature_lists = {}  # user_id -> tuple of DeviceFeature.id sorted by name
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = bool(app.config.get('CATALOGUE_CACHE'))
+        app.extensions['catalogue'] = self
+        if self.enabled:
+            with app.app_context(), db.engine.connect() as connection:
+                self.load(connection)
+
+    def load(self, connection):
+        """Load the whole graph."""
+        token = self._token.stored(connection)
+
+        params = defaultdict(list)
+        for row in connection.execute(select(P).where(P.c.user_id == 1).order_by(P.c.id)):
+            params[row.dmdf_id].append(ParameterRecord(row._mapping))
+
+        dmdfs = {}
+        model_dmdfs = defaultdict(lambda: array('l'))
+        feature_dmdfs = defaultdict(lambda: array('l'))
+        for row in connection.execute(select(MF).order_by(MF.c.id)):
+            dmdfs[row.id] = DmDfRecord(row._mapping, params=tuple(params.pop(row.id, ())))
+            model_dmdfs[row.dm_id].append(row.id)
+            feature_dmdfs[row.df_id].append(row.id)
+
+        models = {row.id: ModelRecord(row._mapping, dmdf_ids=model_dmdfs[row.id])
+                  for row in connection.execute(select(M))}
+        features = {row.id: FeatureRecord(row._mapping)
+                    for row in connection.execute(select(F))}
+        customized = self._load_customized(connection)
+
+        with self._lock:
+            self._features = features
+            self._models = models
+            self._dmdfs = dmdfs
+            self._feature_dmdfs = feature_dmdfs
+            self._customized = customized
+            self._feature_lists = {}
+            self._token.seen = token
+
+        logger.info('Catalogue loaded: %d models, %d features', len(models), len(features))
+
+    def reset(self):
+        """Load the graph again on its next read, in a forked worker process."""
+        self._lock = threading.RLock()
+        self._token.seen = None
+
+    def model_info(self, dm_id, user_id):
+        """
+        Return the result of `op_get_device_model_info`, but the `tags` of the
+        features are always empty: the schema has no Tag and DM_DF_Tag tables
+        to load them from, `modules.dmdf` refers to models which do not exist.
+
+        Return None if the model is not found, or the user has customized its
+        parameters, the caller queries the database instead.
+        """
+        self._sync()
+        model = self._models.get(dm_id)
+        if model is None:
+            return None
+
+        dmdfs = [self._dmdfs.get(dmdf_id) for dmdf_id in model.dmdf_ids]
+        if user_id != 1 and any(dmdf is not None
+                                and user_id in self._customized.get(dmdf.id, ())
+                                for dmdf in dmdfs):
+            return None
+
+        df_list = {}
+        for dmdf in dmdfs:
+            if dmdf is None or not dmdf.params or dmdf.df_id in df_list:
+                continue
+            feature = self._features.get(dmdf.df_id)
+            if feature is None:
+                continue
+            df = feature.as_dict()
+            df['df_parameter'] = [param.as_dict() for param in dmdf.params]
+            # No tag tables in the schema, see above
+            df['tags'] = []
+            df_list[dmdf.df_id] = df
+
+        dm = model.as_dict()
+        dm['df_list'] = sorted(df_list.values(), key=lambda df: df['df_name'])
+        return dm
+
+    def feature_list(self, user_id):
+        """Return the same result as `op_get_device_feature_list`."""
+        self._sync()
+        df_ids = self._feature_lists.get(user_id)
+        if df_ids is None:
+            with self._lock:
+                records = [feature for feature in self._features.values()
+                           if feature.user_id == user_id]
+                records.sort(key=lambda feature: feature.df_name)
+                df_ids = self._feature_lists[user_id] = tuple(r.id for r in records)
+
+        result = {'idf': [], 'odf': []}
+        for df_id in df_ids:
+            feature = self._features.get(df_id)
+            if feature is not None:
+                result[feature.df_type].append(feature.as_dict())
+        return result
+
+    def _sync(self):
+        # Another process has committed a change of the catalogue
+        connection = db.session.connection()
+        if self._token.is_stale(connection):
+            with self._lock:
+                if self._token.is_stale(connection):
+                    self.load(connection)
+
+    def apply(self, connection, pending):
+        """Load the models and features touched by a commit again."""
+        with self._lock:
+            dm_ids = set(pending['dm'])
+            dmdf_ids = set(pending['dmdf'])
+            if pending['base']:
+                dmdf_ids.update(connection.execute(
+                    select(P.c.dmdf_id).where(P.c.id.in_(pending['base']))).scalars())
+
+            unknown = set()
+            for dmdf_id in dmdf_ids:
+                dmdf = self._dmdfs.get(dmdf_id)
+                if dmdf is None:
+                    unknown.add(dmdf_id)
+                else:
+                    dm_ids.add(dmdf.dm_id)
+            if unknown:
+                dm_ids.update(connection.execute(
+                    select(MF.c.dm_id).where(MF.c.id.in_(unknown))).scalars())
+
+            if pending['df']:
+                self._reload_features(connection, pending['df'])
+                for df_id in pending['df']:
+                    for dmdf_id in self._feature_dmdfs.get(df_id, ()):
+                        if dmdf_id in self._dmdfs:
+                            dm_ids.add(self._dmdfs[dmdf_id].dm_id)
+                dm_ids.update(connection.execute(
+                    select(MF.c.dm_id).where(MF.c.df_id.in_(pending['df']))).scalars())
+
+            if dm_ids:
+                self._reload_models(connection, dm_ids)
+
+    def _reload_features(self, connection, df_ids):
+        rows = connection.execute(select(F).where(F.c.id.in_(df_ids)))
+        features = {row.id: FeatureRecord(row._mapping) for row in rows}
+        for df_id in df_ids:
+            if df_id in features:
+                self._features[df_id] = features[df_id]
+            else:
+                self._features.pop(df_id, None)
+        self._feature_lists = {}
+
+    def _reload_models(self, connection, dm_ids):
+        mf_rows = connection.execute(select(MF).where(MF.c.dm_id.in_(dm_ids))
+                                     .order_by(MF.c.id)).all()
+        dmdf_ids = [row.id for row in mf_rows]
+
+        params = defaultdict(list)
+        rows = connection.execute(select(P)
+                                  .where(P.c.dmdf_id.in_(dmdf_ids), P.c.user_id == 1)
+                                  .order_by(P.c.id))
+        for row in rows:
+            params[row.dmdf_id].append(ParameterRecord(row._mapping))
+        customized = self._load_customized(connection, dmdf_ids)
+
+        # Drop the current DM_DF of the models
+        for dm_id in dm_ids:
+            model = self._models.pop(dm_id, None)
+            if model is None:
+                continue
+            for dmdf_id in model.dmdf_ids:
+                dmdf = self._dmdfs.pop(dmdf_id, None)
+                self._customized.pop(dmdf_id, None)
+                if dmdf is not None and dmdf_id in self._feature_dmdfs.get(dmdf.df_id, ()):
+                    self._feature_dmdfs[dmdf.df_id].remove(dmdf_id)
+
+        model_dmdfs = defaultdict(lambda: array('l'))
+        for row in mf_rows:
+            self._dmdfs[row.id] = DmDfRecord(row._mapping,
+                                             params=tuple(params.pop(row.id, ())))
+            model_dmdfs[row.dm_id].append(row.id)
+            self._feature_dmdfs[row.df_id].append(row.id)
+        self._customized.update(customized)
+
+        for row in connection.execute(select(M).where(M.c.id.in_(dm_ids))):
+            self._models[row.id] = ModelRecord(row._mapping, dmdf_ids=model_dmdfs[row.id])
+
+    @staticmethod
+    def _load_customized(connection, dmdf_ids=None):
+        """Find the users who have their own parameters, copies or deltas, of a DM_DF."""
+        copies = select(P.c.dmdf_id, P.c.user_id).where(P.c.user_id != 1)
+        deltas = select(P.c.dmdf_id, D.c.user_id).join_from(D, P, D.c.base_id == P.c.id)
+        if dmdf_ids is not None:
+            copies = copies.where(P.c.dmdf_id.in_(dmdf_ids))
+            deltas = deltas.where(P.c.dmdf_id.in_(dmdf_ids))
+
+        users = defaultdict(set)
+        for dmdf_id, user_id in connection.execute(union(copies, deltas)):
+            users[dmdf_id].add(user_id)
+        return {dmdf_id: frozenset(user_ids) for dmdf_id, user_ids in users.items()}
+
+
+catalogue = CatalogueGraph()
+
+
+def _pending(session):
+    pending = session.info.get('catalogue')
+    if pending is None:
+        pending = session.info['catalogue'] = _new_pending()
+    return pending
+
+
+def _write_token(session, connection):
+    if not catalogue._token.write(session, connection):
+        _pending(session)['full'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_changes(session, flush_context):
+    if not catalogue.enabled:
+        return
+
+    touched = False
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, FULL_RELOAD_MODELS):
+            if instance in session.deleted:
+                _pending(session)['full'] = touched = True
+            continue
+        tracked = TRACKED_COLUMNS.get(type(instance))
+        if tracked is None:
+            continue
+        kind, column = tracked
+        value = getattr(instance, column.key)
+        if value is not None:
+            _pending(session)[kind].add(value)
+            touched = True
+
+    if touched:
+        _write_token(session, session.connection())
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_changes(orm_execute_state):
+    if not catalogue.enabled:
+        return
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+
+    session = orm_execute_state.session
+    if issubclass(mapper.class_, FULL_RELOAD_MODELS):
+        if orm_execute_state.is_delete:
+            _pending(session)['full'] = True
+            _write_token(session, session.connection())
+        return
+
+    tracked = TRACKED_COLUMNS.get(mapper.class_)
+    if tracked is None:
+        return
+
+    # Find the rows before the statement changes them
+    kind, column = tracked
+    query = select(column)
+    if orm_execute_state.statement.whereclause is not None:
+        query = query.where(orm_execute_state.statement.whereclause)
+    values = session.connection().execute(query).scalars()
+    _pending(session)[kind].update(value for value in values if value is not None)
+    _write_token(session, session.connection())
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_after_commit(session):
+    pending = session.info.pop('catalogue', None)
+    token = catalogue._token.pop(session)
+    if pending is None or not catalogue.enabled:
+        return
+
+    try:
+        with db.engine.connect() as connection:
+            if pending['full']:
+                catalogue.load(connection)
+            else:
+                catalogue.apply(connection, pending)
+                catalogue._token.seen = token
+    except Exception:
+        logger.exception('Update the catalogue failed, it is loaded again on the next read')
+        catalogue._token.seen = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('catalogue', None)
+    catalogue._token.pop(session)
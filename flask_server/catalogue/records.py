@@ -0,0 +1,77 @@
+"""
+Compact read-only records of the catalogue tables.
+
+A record has one slot per column of its table, its `as_dict()` is the same as
+`record_parser` of the ORM instance. The names and enum-like values are interned,
+so the records of 10k features share their strings instead of copying them.
+"""
+import datetime
+import sys
+
+from db.models import DeviceFeature, DeviceModel, DeviceParameter, DM_DF
+
+__all__ = [
+    'DmDfRecord',
+    'FeatureRecord',
+    'ModelRecord',
+    'ParameterRecord',
+]
+
+
+def _columns(model):
+    return tuple(column.name for column in model.__table__.columns)
+
+
+class _Record:
+    __slots__ = ()
+
+    # The column slots, in the order of the table columns
+    _fields = ()
+    # The string columns which are interned
+    _interned = ()
+
+    def __init__(self, row, **extra):
+        for field in self._fields:
+            value = row[field]
+            if field in self._interned and value is not None:
+                value = sys.intern(value)
+            object.__setattr__(self, field, value)
+        for field, value in extra.items():
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is read-only'.format(type(self).__name__))
+
+    def as_dict(self):
+        d = {}
+        for field in self._fields:
+            value = getattr(self, field)
+            if isinstance(value, datetime.datetime):
+                value = str(value)
+            d[field] = value
+        return d
+
+
+class FeatureRecord(_Record):
+    _fields = _columns(DeviceFeature)
+    _interned = ('df_name', 'df_type')
+    __slots__ = _fields
+
+
+class ModelRecord(_Record):
+    _fields = _columns(DeviceModel)
+    _interned = ('dm_name', 'dm_type')
+    # dmdf_ids: array('l') of the DM_DF.id of the model
+    __slots__ = _fields + ('dmdf_ids',)
+
+
+class DmDfRecord(_Record):
+    _fields = _columns(DM_DF)
+    # params: tuple of the general (user_id = 1) ParameterRecord, ordered by id
+    __slots__ = _fields + ('params',)
+
+
+class ParameterRecord(_Record):
+    _fields = _columns(DeviceParameter)
+    _interned = ('param_type', 'idf_type')
+    __slots__ = _fields
@@ -0,0 +1,463 @@
+"""
+Maintenance commands, use them with `flask <command>`.
+"""
+import json
+import logging
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import click
+from flask.cli import with_appcontext
+
+from db import db, fts
+from db.models import DeviceParameter, DeviceParameterDelta
+
+__all__ = [
+    'commands',
+]
+
+logger = logging.getLogger(__name__)
+BASE_DIR = Path(__file__).resolve().parent
+
+
+@click.command('compact-parameters')
+@click.option('--dry-run', is_flag=True, help='Only report what would be migrated.')
+@with_appcontext
+def compact_parameters(dry_run):
+    """
+    Migrate the per-user full copies of DeviceParameter into DeviceParameterDelta.
+
+    A user's copies are matched with the general (user_id = 1) rows of the same
+    DeviceFeature/DM_DF by their order, the groups which can not be matched are skipped.
+    """
+    base_groups = defaultdict(list)
+    user_groups = defaultdict(list)
+    records = db.session.query(DeviceParameter).order_by(DeviceParameter.id)
+    for record in records:
+        if record.user_id == 1:
+            base_groups[(record.df_id, record.dmdf_id)].append(record)
+        else:
+            user_groups[(record.user_id, record.df_id, record.dmdf_id)].append(record)
+
+    migrated = skipped = deltas = 0
+    for (user_id, df_id, dmdf_id), user_records in user_groups.items():
+        base_records = base_groups.get((df_id, dmdf_id), [])
+        if len(base_records) != len(user_records):
+            skipped += len(user_records)
+            continue
+
+        for base, record in zip(base_records, user_records):
+            values = {field: getattr(record, field)
+                      for field in DeviceParameter.OVERRIDABLE_FIELDS}
+            delta = base.delta_from(values)
+            if delta:
+                delta_record = DeviceParameterDelta(base_id=base.id, user_id=user_id)
+                delta_record.apply(delta)
+                db.session.add(delta_record)
+                deltas += 1
+            db.session.delete(record)
+            migrated += 1
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+
+    click.echo('{}migrated {} rows into {} deltas, skipped {} unmatched rows'.format(
+        '[dry run] ' if dry_run else '', migrated, deltas, skipped))
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index():
+    """
+    Create the catalogue full-text search index if it is missing, and repopulate it.
+
+    Needed for a database created before the index was introduced.
+    """
+    with db.engine.begin() as connection:
+        if not fts.install(connection):
+            raise click.ClickException('The database does not support SQLite FTS5')
+        fts.rebuild(connection)
+
+    click.echo('search index rebuilt')
+
+
+@click.command('importtime')
+@click.option('--module', default='server', show_default=True, help='The module to import.')
+@click.option('--limit', default=20, show_default=True,
+              help='The number of modules listed.')
+@click.option('--max-ms', type=float, help='Fail if the import takes longer.')
+def importtime(module, limit, max_ms):
+    """
+    Report the slowest imports of the app, by `python -X importtime`.
+
+    The module is imported by a new interpreter so nothing is cached,
+    the last line is the total import time for CI to track.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        cwd=str(BASE_DIR), capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise click.ClickException('import {} failed:\n{}'.format(module, result.stderr))
+
+    # Each line: "import time: <self us> | <cumulative us> | <indented module name>"
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[0].strip().isdigit():
+            continue  # the header
+        records.append((int(fields[1]), int(fields[0]), fields[2].strip()))
+
+    total = next((cumulative for cumulative, _, name in records if name == module), 0)
+    records.sort(reverse=True)
+    click.echo('{:>12} {:>12}  {}'.format('cumulative', 'self', 'module'))
+    for cumulative, self_time, name in records[:limit]:
+        click.echo('{:>10.1f}ms {:>10.1f}ms  {}'.format(
+            cumulative / 1000, self_time / 1000, name))
+    click.echo('total {:.1f}ms'.format(total / 1000))
+
+    if max_ms is not None and total / 1000 > max_ms:
+        raise click.ClickException('import {} took {:.1f}ms, more than {}ms'.format(
+            module, total / 1000, max_ms))
+
+
+@click.command('bench-catalogue')
+@click.option('--features', default=10000, show_default=True)
+@click.option('--per-model', default=10, show_default=True,
+              help='The device features of each device model.')
+@click.option('--rounds', default=200, show_default=True)
+@with_appcontext
+def bench_catalogue(features, per_model, rounds):
+    """Measure the catalogue graph, its load and memory, and its reads against SQL."""
+    from catalogue.bench import bench_catalogue
+
+    result = bench_catalogue(features=features, per_model=per_model, rounds=rounds)
+    click.echo('{features} features, {models} models'.format(**result))
+    click.echo('load         {load_ms:>8.1f}ms, {memory_mb:.1f}MB'.format(**result))
+    for name in ('model_info', 'feature_list'):
+        click.echo('{:<12} graph {graph_ms:>8.3f}ms  sql {sql_ms:>8.3f}ms'.format(
+            name, **result[name]))
+    if not result['same']:
+        raise click.ClickException('the graph and the database disagree')
+
+
+@click.command('bench-presence')
+@click.option('--devices', default=10000, show_default=True)
+@click.option('--heartbeats', default=200_000, show_default=True)
+@click.option('--windows', default=20, show_default=True,
+              help='The flush windows the heartbeats are spread over.')
+@with_appcontext
+def bench_presence(devices, heartbeats, windows):
+    """Measure the heartbeats/sec of the presence tracker and its flushes."""
+    from presence.bench import bench_presence
+
+    result = bench_presence(devices=devices, heartbeats=heartbeats, windows=windows)
+    click.echo('{heartbeats} heartbeats of {devices} devices in {windows} windows'
+               .format(**result))
+    click.echo('tracker    {:>12,.0f} heartbeats/sec'.format(result['heartbeats_per_sec']))
+    click.echo('flush      {flush_ms:>12.1f}ms per window, {written} rows written'
+               .format(**result))
+    click.echo('UPDATE     {:>12,.0f} heartbeats/sec'.format(result['direct_per_sec']))
+
+
+@click.command('bench-serve')
+@click.option('--workers', default='1,2,4', show_default=True,
+              help='The numbers of worker processes, comma separated.')
+@click.option('--clients', default=16, show_default=True, help='The client threads.')
+@click.option('--requests', default=2000, show_default=True)
+@click.option('--path', default='/account', show_default=True)
+@click.option('--reload', is_flag=True, help='Send SIGHUP in the middle of each run.')
+def bench_serve(workers, clients, requests, path, reload):
+    """Measure the requests/sec of `serve.py` with several numbers of workers."""
+    from serve import bench_serve
+
+    rows = bench_serve(workers=[int(n) for n in workers.split(',')], clients=clients,
+                       requests=requests, path=path, reload=reload)
+    for row in rows:
+        click.echo('{workers} workers: {requests} requests in {elapsed:.2f}s, '
+                   '{throughput:,.0f} requests/sec, p50 {p50_ms:.1f}ms p99 {p99_ms:.1f}ms, '
+                   '{errors} errors'.format(**row))
+
+
+@click.command('bench-search')
+@click.option('--features', default=20000, show_default=True)
+@click.option('--rounds', default=20, show_default=True)
+@with_appcontext
+def bench_search(features, rounds):
+    """Measure the catalogue search by the FTS5 index and by LIKE, and a unit rename."""
+    from db.bench import bench_search
+
+    result = bench_search(features=features, rounds=rounds)
+    click.echo('{} features'.format(result['features']))
+    for name, query in result['queries'].items():
+        click.echo('{:<10} {total:>6} results  fts {fts_ms:>8.2f}ms  like {like_ms:>8.2f}ms'
+                   .format(name, **query))
+    click.echo('rename a unit {rename_unit_ms:.1f}ms, {renamed_features} features '
+               'found by the new name'.format(**result))
+
+
+@click.command('bench-normalization')
+@click.option('--samples', default=1_000_000, show_default=True)
+@click.option('--width', default=4, show_default=True, help='The parameters per sample.')
+@click.option('--batch', default=1024, show_default=True, help='The samples per batch.')
+def bench_normalization(samples, width, batch):
+    """Measure the samples/sec of the vectorized normalization and of the Python loop."""
+    from dataplane.bench import bench_normalization
+
+    result = bench_normalization(samples=samples, width=width, batch=batch)
+    click.echo('{samples} samples x {width} parameters, batch {batch}'.format(**result))
+    click.echo('vectorized {:>14,.0f} samples/sec'.format(result['vectorized']))
+    click.echo('python     {:>14,.0f} samples/sec'.format(result['python']))
+    click.echo('speedup    {:>14.1f}x'.format(result['vectorized'] / result['python']))
+
+
+@click.command('bench-join')
+@click.option('--fan-in', default='2,4,8,16', show_default=True,
+              help='The numbers of joined DF_Objects, comma separated.')
+@click.option('--samples', default=200_000, show_default=True)
+@click.option('--batch', default=256, show_default=True, help='The samples per batch.')
+def bench_join(fan_in, samples, batch):
+    """Measure the throughput and the batch latency of the vectorized join."""
+    from dataplane.bench import bench_join
+
+    fan_ins = [int(n) for n in fan_in.split(',')]
+    click.echo('{:>6} {:>14} {:>14} {:>10} {:>10} {:>10}'.format(
+        'fan-in', 'samples/sec', 'python', 'p50', 'p99', 'memory'))
+    for result in bench_join(fan_ins=fan_ins, samples=samples, batch=batch):
+        click.echo('{fan_in:>6} {vectorized:>14,.0f} {python:>14,.0f} '
+                   '{p50_us:>8.1f}us {p99_us:>8.1f}us {nbytes:>9,}B'.format(**result))
+
+
+@click.command('bench-cascade-delete')
+@click.option('--features', default=1000, show_default=True)
+@click.option('--parameters', default=3, show_default=True,
+              help='The parameters of each device feature.')
+@click.option('--devices', default=1000, show_default=True)
+@click.option('--rounds', default=3, show_default=True)
+@with_appcontext
+def bench_cascade_delete(features, parameters, devices, rounds):
+    """Measure deleting a device model and a user with many child rows."""
+    from db.bench import bench_cascade_delete
+
+    result = bench_cascade_delete(features=features, parameters=parameters,
+                                  devices=devices, rounds=rounds)
+    click.echo('{features} features, {parameters} parameters, {devices} devices'
+               .format(**result))
+    click.echo('delete device model {device_model_ms:>8.1f}ms'.format(**result))
+    click.echo('delete user         {user_ms:>8.1f}ms'.format(**result))
+    click.echo('delete unit in use  {:>8.1f}ms, {}'.format(
+        result['unit_in_use_ms'], 'refused' if result['unit_refused'] else 'NOT refused'))
+
+
+@click.command('bench-functions')
+@click.option('--calls', default=20_000, show_default=True)
+@click.option('--processes', default=2, show_default=True, help='The size of the pool.')
+def bench_functions(calls, processes):
+    """Measure the calls/sec of a user function in process and in the pool."""
+    from dataplane.bench import bench_functions
+
+    results, recovery, metrics = bench_functions(calls=calls, processes=processes)
+    for name, rate in results.items():
+        click.echo('{:<18} {:>12,.0f} calls/sec'.format(name, rate))
+    click.echo('pool restarted {:.2f}s after a timeout'.format(recovery))
+    for fn_name, record in metrics.items():
+        click.echo('{}: {calls} calls, {errors} errors, {timeouts} timeouts'
+                   .format(fn_name, **record))
+
+
+@click.command('simulate')
+@click.option('--project', 'p_id', type=int,
+              help='Simulate the device models of a project in simulation mode.')
+@click.option('--dm', 'dm_names', multiple=True,
+              help='Simulate a device model, repeatable.')
+@click.option('--count', default=100, show_default=True,
+              help='The virtual devices of each device model.')
+@click.option('--rate', default=1.0, show_default=True,
+              help='The samples per second of each feature of each device.')
+@click.option('--seconds', default=10.0, show_default=True, help='How long to run.')
+@click.option('--user', 'username', help='Register the virtual devices to this user.')
+@with_appcontext
+def simulate(p_id, dm_names, count, rate, seconds, username):
+    """
+    Publish the IDF samples of a fleet of virtual devices, to a local broker.
+
+    The devices of a project are registered to its owner with `is_sim`.
+    """
+    from dataplane.simulator import FleetSimulator, LocalBroker, load_models
+    from db.models import DeviceModel, DeviceObject, Project, User
+    from modules.dispatch import call_op
+    from modules.utils import Context
+
+    u_id = None
+    if p_id is not None:
+        project = db.session.get(Project, p_id)
+        if project is None:
+            raise click.ClickException('Project {} not found'.format(p_id))
+        if project.sim != 'on':
+            raise click.ClickException('Project {} is not in simulation mode'.format(p_id))
+        u_id = project.user_id
+        dm_ids = {dm_id for dm_id, in db.session.query(DeviceObject.dm_id)
+                  .filter(DeviceObject.p_id == p_id).distinct()}
+    else:
+        dm_ids = {dm_id for dm_id, in db.session.query(DeviceModel.id)
+                  .filter(DeviceModel.dm_name.in_(dm_names))}
+    if username:
+        user = db.session.query(User).filter(User.username == username).first()
+        if user is None:
+            raise click.ClickException('User {} not found'.format(username))
+        u_id = user.id
+    if not dm_ids:
+        raise click.ClickException('No device model to simulate')
+
+    broker = LocalBroker()
+    simulator = FleetSimulator(broker, rate=rate)
+    devices = []
+    for model in load_models(db.session.connection(), dm_ids).values():
+        devices += simulator.add_fleet(model['dm_name'], model['features'], count)
+    if u_id is not None:
+        call_op(Context(u_id, db.session), 'register_devices', {'devices': devices})
+    click.echo('{} virtual devices, {} samples/sec each feature'.format(len(devices), rate))
+
+    result = simulator.run(seconds)
+    click.echo('{published} messages in {elapsed:.1f}s, {ticks} ticks, '
+               '{late} late'.format(**result))
+    click.echo('{:,.0f} messages/sec'.format(result['published'] / result['elapsed']))
+
+
+@click.command('gateway')
+@with_appcontext
+def gateway():
+    """Serve the GUI requests from the MQTT broker until interrupted."""
+    import asyncio
+
+    from flask import current_app
+
+    import config
+    from db import db
+    from gateway import DbClientRegistry, OpGateway
+    from gateway.transport import MqttTransport
+
+    async def serve():
+        async with MqttTransport(config.MQTT_HOST, int(config.MQTT_PORT),
+                                 username=config.MQTT_USERNAME,
+                                 password=config.MQTT_PASSWORD,
+                                 tls=bool(config.MQTT_TLS)) as transport:
+            clients = DbClientRegistry(db, expire=int(config.GUI_CLIENT_EXPIRE))
+            await OpGateway(current_app._get_current_object(), transport, clients=clients,
+                            workers=int(config.GATEWAY_WORKERS),
+                            max_pending=int(config.GATEWAY_MAX_PENDING),
+                            share_group=config.GATEWAY_SHARE_GROUP or None).run()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command('bench-gateway')
+@click.option('--clients', default=2000, show_default=True,
+              help='The simulated GUI clients.')
+@click.option('--requests', default=5, show_default=True,
+              help='The requests of each client, sent one at a time.')
+@click.option('--workers', default=8, show_default=True)
+@click.option('--flood', default=0, show_default=True,
+              help='The requests published at once by one more client.')
+@click.option('--processes', default=None,
+              help='Compare shared subscription groups of these sizes, e.g. "1,2,4".')
+@click.option('--duplicates', default=0, show_default=True,
+              help='The extra deliveries of every request, as retries.')
+@click.option('--op', default='get_function_list', show_default=True)
+@with_appcontext
+def bench_gateway(clients, requests, workers, flood, processes, duplicates, op):
+    """Measure the gateway with simulated GUI clients on an in-process broker."""
+    from flask import current_app
+
+    from gateway.bench import bench_gateway, bench_scaling
+
+    if processes:
+        rows = bench_scaling([int(n) for n in processes.split(',')], clients=clients,
+                             requests=requests, workers=workers, op=op)
+        for row in rows:
+            click.echo('{processes} processes: {requests} requests in {elapsed:.2f}s, '
+                       '{throughput:,.0f} requests/sec, p50 {p50_ms:.1f}ms '
+                       'p99 {p99_ms:.1f}ms'.format(**row))
+        return
+
+    result = bench_gateway(current_app._get_current_object(), clients=clients,
+                           requests=requests, workers=workers, flood=flood, op=op,
+                           duplicates=duplicates)
+    click.echo('{requests} requests of {clients} clients in {elapsed:.2f}s, '
+               '{throughput:,.0f} requests/sec'.format(**result))
+    click.echo('latency p50 {p50_ms:.1f}ms p99 {p99_ms:.1f}ms'.format(**result))
+    click.echo('metrics {}'.format(result['metrics']))
+    click.echo('replay {}'.format(result['replay']))
+    for phase, histogram in result['timings'].items():
+        click.echo('{:>8} p50 {p50:.3f}ms p90 {p90:.3f}ms p99 {p99:.3f}ms '
+                   'max {max:.3f}ms'.format(phase, **histogram))
+
+
+@click.command('show-traces')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--slowest', default=5, show_default=True,
+              help='The number of traces shown, the slowest first.')
+@click.option('--name', default=None, help='Only the traces whose root span has this name.')
+def show_traces(path, slowest, name):
+    """Print the span trees of the slowest traces of a TRACING_FILE."""
+    from collections import defaultdict
+
+    traces = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            span = json.loads(line)
+            traces[span['trace_id']].append(span)
+
+    roots = []
+    for spans in traces.values():
+        ids = {span['span_id'] for span in spans}
+        for span in spans:
+            if span['parent_id'] not in ids and (name is None or span['name'] == name):
+                roots.append((span, spans))
+    roots.sort(key=lambda root: root[0]['duration_ms'], reverse=True)
+
+    for root, spans in roots[:slowest]:
+        children = defaultdict(list)
+        for span in spans:
+            children[span['parent_id']].append(span)
+
+        def show(span, depth):
+            detail = span['attributes'].get('db.statement') or ''
+            click.echo('{:>10.3f}ms {}{} {}{}'.format(
+                span['duration_ms'], '  ' * depth, span['name'],
+                ' '.join(detail.split())[:80],
+                ' [{}]'.format(span['error']) if span['error'] else ''))
+            for child in sorted(children[span['span_id']], key=lambda c: c['start']):
+                show(child, depth + 1)
+
+        click.echo('trace {}'.format(root['trace_id']))
+        show(root, 0)
+        click.echo()
+
+
+commands = [
+    bench_cascade_delete,
+    bench_catalogue,
+    bench_functions,
+    bench_gateway,
+    bench_join,
+    bench_normalization,
+    bench_presence,
+    bench_search,
+    bench_serve,
+    compact_parameters,
+    gateway,
+    importtime,
+    rebuild_search_index,
+    show_traces,
+    simulate,
+]
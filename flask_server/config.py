@@ -26,6 +26,66 @@ OAUTH2_TOKEN_ENDPOINT = ""
 # OAuth 2.0 Revocation Endpoint
 OAUTH2_REVOCATION_ENDPOINT = ""
 
+# The database URL of the read replica, the read ops are served by it.
+# Leave it empty to read the SQLite database file in read-only mode.
+DATABASE_REPLICA_URL = ""
+
+# The address the production server (serve.py) listens on
+SERVER_BIND = "0.0.0.0:8100"
+# The number of worker processes, leave it empty to use the number of CPU cores
+SERVER_WORKERS = ""
+# The number of threads of each worker process
+SERVER_THREADS = "1"
+
+# A flag indicates if the device model/feature catalogue is served from memory,
+# leave it empty to query the database for every read.
+CATALOGUE_CACHE = ""
+
+# A flag indicates if the mutating ops are serialized by a single writer thread,
+# leave it empty to run them in the calling thread.
+WRITE_QUEUE = ""
+# The maximum number of ops committed together by the writer thread
+WRITE_QUEUE_BATCH_SIZE = "64"
+
+# The responses kept to replay a GUI request delivered again, 0 to disable
+REPLAY_CACHE_SIZE = "4096"
+# The seconds a response is kept
+REPLAY_CACHE_TTL = "300"
+# The maximum bytes of the JSON encoded responses kept
+REPLAY_CACHE_MAX_BYTES = "16777216"
+
+# The milliseconds above which a statement is logged with its query plan,
+# leave it empty to disable, see `/account/slow_queries`
+SLOW_QUERY_MS = ""
+
+# The fraction of the HTTP requests and GUI ops traced, e.g. "0.01", see `tracing`
+TRACING_SAMPLE_RATE = "0"
+# The JSON-lines file the spans are appended to
+TRACING_FILE = ""
+# The OTLP/HTTP endpoint the spans are posted to instead, e.g.
+# "http://localhost:4318/v1/traces"
+TRACING_OTLP_URL = ""
+
+# The MQTT broker the GUI requests are received from, see `flask gateway`
+MQTT_HOST = "localhost"
+MQTT_PORT = "1883"
+MQTT_USERNAME = ""
+MQTT_PASSWORD = ""
+# A flag indicates if TLS is used to connect to the broker
+MQTT_TLS = ""
+# The number of ops the gateway runs at the same time
+GATEWAY_WORKERS = "8"
+# The number of queued requests at which the gateway stops reading from the broker
+GATEWAY_MAX_PENDING = "1024"
+# The shared subscription group of the gateway processes, empty for a single process
+GATEWAY_SHARE_GROUP = ""
+# The MQTT over WebSocket endpoint of the broker the GUI connects to
+MQTT_WS_SCHEME = "ws"
+MQTT_WS_PORT = "8083"
+# The seconds a GUI MQTT client id and its broker password stay valid,
+# the broker authenticates them by `/mqtt/auth` and `/mqtt/acl`
+GUI_CLIENT_EXPIRE = "86400"
+
 
 def read_config(path: str):
     if not path or not os.path.isfile(path):
@@ -39,7 +99,7 @@ def read_config(path: str):
         if name not in mod:
             raise ('variable `%s` unknown', name)
 
-        mod[name] = str(os.getenv(name))
+        mod[name] = str(os.getenv(name, mod[name]))
 
     set_('PROXY_USED')
 
@@ -53,3 +113,36 @@ def read_config(path: str):
     set_('OAUTH2_AUTHORIZATION_ENDPOINT')
     set_('OAUTH2_TOKEN_ENDPOINT')
     set_('OAUTH2_REVOCATION_ENDPOINT')
+
+    set_('DATABASE_REPLICA_URL')
+
+    set_('SERVER_BIND')
+    set_('SERVER_WORKERS')
+    set_('SERVER_THREADS')
+
+    set_('CATALOGUE_CACHE')
+
+    set_('WRITE_QUEUE')
+    set_('WRITE_QUEUE_BATCH_SIZE')
+
+    set_('REPLAY_CACHE_SIZE')
+    set_('REPLAY_CACHE_TTL')
+    set_('REPLAY_CACHE_MAX_BYTES')
+
+    set_('SLOW_QUERY_MS')
+
+    set_('TRACING_SAMPLE_RATE')
+    set_('TRACING_FILE')
+    set_('TRACING_OTLP_URL')
+
+    set_('MQTT_HOST')
+    set_('MQTT_PORT')
+    set_('MQTT_USERNAME')
+    set_('MQTT_PASSWORD')
+    set_('MQTT_TLS')
+    set_('GATEWAY_WORKERS')
+    set_('GATEWAY_MAX_PENDING')
+    set_('GATEWAY_SHARE_GROUP')
+    set_('MQTT_WS_SCHEME')
+    set_('MQTT_WS_PORT')
+    set_('GUI_CLIENT_EXPIRE')
@@ -1,5 +1,8 @@
 from enum import Enum
 
+# ANSI escape code which resets the terminal color
+LOG_COLOR_DEFAULT = '\033[0m'
+
 
 class UserGroup(str, Enum):
     # the values will be inserted into db after 'group' table is created
@@ -0,0 +1,12 @@
+"""
+The data path of the network applications, vectorized with NumPy.
+
+NumPy is only imported by this package, the web server does not need it.
+"""
+from .join import JoinEngine
+from .normalization import NormalizationEngine
+
+__all__ = [
+    'JoinEngine',
+    'NormalizationEngine',
+]
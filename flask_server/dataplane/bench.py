@@ -0,0 +1,186 @@
+"""
+Throughput benchmarks of the data path, run them with `flask bench-<name>`.
+"""
+import time
+
+import numpy as np
+
+from dataplane.functions import FunctionRuntime, FunctionTimeout
+from dataplane.join import JoinEngine
+from dataplane.normalization import NormalizationEngine, transform_sample
+
+__all__ = [
+    'bench_functions',
+    'bench_join',
+    'bench_normalization',
+]
+
+
+def _params(width):
+    """Half sample and half variant parameters, every other one normalized."""
+    return [{'param_i': i,
+             'idf_type': 'variant' if i % 2 else 'sample',
+             'min': -10.0,
+             'max': 10.0,
+             'normalization': i % 4 < 2}
+            for i in range(width)]
+
+
+def bench_normalization(samples=1_000_000, width=4, batch=1024, python_samples=100_000):
+    """
+    Return the samples/sec of `NormalizationEngine` and of the per-sample Python loop.
+
+    The two results are checked to be the same.
+    """
+    params = _params(width)
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-20, 20, size=(samples, width))
+
+    engine = NormalizationEngine(params)
+    out = np.empty((batch, width))
+    start = time.perf_counter()
+    for i in range(0, samples, batch):
+        chunk = data[i:i + batch]
+        engine.transform(chunk, out=out[:len(chunk)])
+    vectorized = samples / (time.perf_counter() - start)
+
+    python_samples = min(python_samples, samples)
+    rows = data[:python_samples].tolist()
+    start = time.perf_counter()
+    previous = None
+    expected = []
+    for row in rows:
+        expected.append(transform_sample(params, row, previous))
+        previous = row
+    python = python_samples / (time.perf_counter() - start)
+
+    engine.reset()
+    result = engine.transform(data[:python_samples])
+    if not np.allclose(result, expected):
+        raise AssertionError('The vectorized result differs from the reference')
+
+    return {
+        'samples': samples,
+        'width': width,
+        'batch': batch,
+        'vectorized': vectorized,
+        'python': python,
+    }
+
+
+def _join_config(fan_in, width):
+    """A join of `fan_in` DF_Objects, the odd inputs are summed by a function."""
+    params = [{'param_i': i} for i in range(width)]
+    return {
+        'idf': [{'dfo_id': i, 'params': params} for i in range(fan_in)],
+        'join': [{'param_i': i, 'dfo_id': i, 'fn_name': 'sum' if i % 2 else None}
+                 for i in range(fan_in)],
+    }
+
+
+def _join_samples(fan_in, samples, width):
+    """The reference: merge the latest sample dicts of the inputs one by one."""
+    joined = []
+    for i in range(len(samples[0])):
+        merged = {}
+        for param_i in range(fan_in):
+            sample = samples[param_i][i]
+            if param_i % 2:
+                merged[param_i] = sum(sample)
+            else:
+                merged.update({(param_i, k): v for k, v in enumerate(sample)})
+        joined.append(list(merged.values()))
+    return joined
+
+
+def bench_join(fan_ins=(2, 4, 8, 16), samples=200_000, width=2, batch=256,
+               python_samples=20_000):
+    """
+    Return the samples/sec and the batch latency of `JoinEngine` for each fan-in.
+
+    :return: [{'fan_in', 'vectorized', 'python', 'p50_us', 'p99_us', 'nbytes'}, ...]
+    """
+    functions = {'sum': lambda block: block.sum(axis=1)}
+    rng = np.random.default_rng(0)
+    results = []
+    for fan_in in fan_ins:
+        data = [rng.uniform(0, 1, size=(samples, width)) for _ in range(fan_in)]
+        engine = JoinEngine(_join_config(fan_in, width), functions, capacity=batch * 4)
+
+        latencies = []
+        total = time.perf_counter()
+        for i in range(0, samples, batch):
+            start = time.perf_counter()
+            for dfo_id in range(fan_in):
+                engine.push(dfo_id, data[dfo_id][i:i + batch])
+            engine.join()
+            latencies.append(time.perf_counter() - start)
+        vectorized = samples / (time.perf_counter() - total)
+
+        rows = [d[:python_samples].tolist() for d in data]
+        start = time.perf_counter()
+        expected = _join_samples(fan_in, rows, width)
+        python = python_samples / (time.perf_counter() - start)
+
+        check = JoinEngine(_join_config(fan_in, width), functions, capacity=python_samples)
+        for dfo_id in range(fan_in):
+            check.push(dfo_id, data[dfo_id][:python_samples])
+        if not np.allclose(check.join(), expected):
+            raise AssertionError('The vectorized result differs from the reference')
+
+        latencies.sort()
+        results.append({
+            'fan_in': fan_in,
+            'vectorized': vectorized,
+            'python': python,
+            'p50_us': latencies[len(latencies) // 2] * 1e6,
+            'p99_us': latencies[int(len(latencies) * .99)] * 1e6,
+            'nbytes': engine.nbytes,
+        })
+    return results
+
+
+MEAN = """
+def run(*args):
+    return sum(args) / len(args)
+"""
+
+HANG = """
+def run(*args):
+    while True:
+        pass
+"""
+
+
+def bench_functions(calls=20_000, batches=(1, 64, 1024), processes=2, timeout=2.0):
+    """
+    Return the calls/sec of a function in the calling process and in the pool,
+    and the seconds the pool takes to recover from a hung function.
+    """
+    runtime = FunctionRuntime(processes=processes, timeout=timeout)
+    runtime.start()
+    args = [(i, i + 1, i + 2) for i in range(calls)]
+    try:
+        results = {}
+        runtime.run('mean', MEAN, args[:1], trusted=True)  # compile it
+        start = time.perf_counter()
+        runtime.run('mean', MEAN, args, trusted=True)
+        results['in-process'] = calls / (time.perf_counter() - start)
+
+        runtime.run('mean', MEAN, args[:1])  # warm the workers
+        for batch in batches:
+            start = time.perf_counter()
+            for i in range(0, calls, batch):
+                runtime.run('mean', MEAN, args[i:i + batch])
+            results['pool, batch {}'.format(batch)] = calls / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            runtime.run('hang', HANG, [()])
+        except FunctionTimeout:
+            pass
+        runtime.run('mean', MEAN, args[:1])
+        recovery = time.perf_counter() - start - timeout
+        return results, recovery, runtime.metrics()
+    finally:
+        runtime.close()
@@ -0,0 +1,261 @@
+"""
+Runtime of the user functions referenced by the Function table.
+
+A function is Python source defining `run(*args)`, e.g.
+
+    def run(*args):
+        return sum(args) / len(args)
+
+The source is compiled once and the code object is cached by the SHA-1 of the
+source, with LRU eviction, so an edited function is a new cache entry and the
+old one ages out.
+
+A trusted function (`Function.is_protect`, shipped with the server) runs in the
+calling process. The other ones run in a warm process pool, a batch of calls
+per task so the IPC is paid once per batch, and each batch has a timeout: a
+function which hangs or crashes its worker only fails its own batch, the pool
+is then terminated and started again. The batches of the other callers which
+were in flight are run again by the new pool, at most `RESUBMIT_LIMIT` times,
+so a caller is blocked for at most `RESUBMIT_LIMIT + 1` timeouts.
+
+The call latency of every function is recorded, see `FunctionRuntime.metrics`.
+"""
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.pool
+import threading
+import time
+from collections import OrderedDict, deque
+
+from modules.utils import CCMError
+
+__all__ = [
+    'FunctionError',
+    'FunctionRuntime',
+    'FunctionTimeout',
+]
+
+logger = logging.getLogger(__name__)
+
+# The compiled functions kept by each process
+CODE_CACHE_SIZE = 256
+# The latencies kept per function for the percentiles
+LATENCY_WINDOW = 1024
+# The times a batch is run again after the pool is terminated by another batch
+RESUBMIT_LIMIT = 2
+
+
+class FunctionError(CCMError):
+    """A user function failed to compile, raised an exception or returned a bad result."""
+
+
+class FunctionTimeout(FunctionError):
+    """A batch of calls did not finish in time, or its worker crashed."""
+
+
+class _CodeCache:
+    def __init__(self, size=CODE_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._functions = OrderedDict()  # source hash -> run
+
+    def get(self, key, source):
+        with self._lock:
+            run = self._functions.get(key)
+            if run is not None:
+                self._functions.move_to_end(key)
+                self.hits += 1
+                return run
+
+        namespace = {}
+        exec(compile(source, '<function {}>'.format(key[:8]), 'exec'), namespace)
+        run = namespace.get('run')
+        if not callable(run):
+            raise FunctionError('The function does not define run()')
+
+        with self._lock:
+            self.misses += 1
+            self._functions[key] = run
+            while len(self._functions) > self.size:
+                self._functions.popitem(last=False)
+        return run
+
+
+# The cache of the pool worker processes
+_worker_cache = _CodeCache()
+
+
+def _run_batch(key, source, batch):
+    """Run in a pool worker: call the function with each args tuple of the batch."""
+    try:
+        run = _worker_cache.get(key, source)
+        return [run(*args) for args in batch]
+    except Exception as e:
+        # The exceptions of the user code may not be picklable
+        raise FunctionError('{}: {}'.format(type(e).__name__, e)) from None
+
+
+def source_key(source):
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+class _Metrics:
+    def __init__(self):
+        self.calls = 0
+        self.batches = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # seconds per call
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        n = len(latencies)
+        return {
+            'calls': self.calls,
+            'batches': self.batches,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'p50_us': latencies[n // 2] * 1e6 if n else None,
+            'p99_us': latencies[min(n - 1, int(n * .99))] * 1e6 if n else None,
+        }
+
+
+class FunctionRuntime:
+    """
+    :param processes: the size of the pool, the number of CPU cores if None
+    :param timeout: the seconds a batch may run in the pool
+    """
+
+    def __init__(self, processes=None, timeout=5.0, cache_size=CODE_CACHE_SIZE):
+        self.processes = processes
+        self.timeout = timeout
+
+        self.cache = _CodeCache(cache_size)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._waiting = set()  # the events of the batches in flight in the pool
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def run(self, fn_name, source, batch, trusted=False, timeout=None):
+        """
+        Call the function with each args tuple of `batch`, return the results in order.
+
+        :param fn_name: <Function.fn_name>, the metrics are recorded by it
+        :param source: the source of the function
+        :param batch: [(arg, ...), ...]
+        :param trusted: run in the calling process, for the protected functions
+        :param timeout: override the timeout of the pool
+        :raise FunctionTimeout: the batch did not finish in time
+        :raise FunctionError: the function failed
+        """
+        batch = list(batch)
+        key = source_key(source)
+        start = time.perf_counter()
+        try:
+            if trusted:
+                try:
+                    run = self.cache.get(key, source)
+                    results = [run(*args) for args in batch]
+                except FunctionError:
+                    raise
+                except Exception as e:
+                    raise FunctionError('{}: {}'.format(type(e).__name__, e)) from e
+            else:
+                results = self._run_in_pool(key, source, batch, timeout or self.timeout)
+        except FunctionTimeout:
+            self._record(fn_name, len(batch), start, timeout=True)
+            raise
+        except FunctionError:
+            self._record(fn_name, len(batch), start, error=True)
+            raise
+        self._record(fn_name, len(batch), start)
+        return results
+
+    def metrics(self):
+        """
+        Return the call metrics of each function.
+
+        :return: {<fn_name>: {'calls', 'batches', 'errors', 'timeouts',
+                              'p50_us', 'p99_us'}, ...}
+        """
+        with self._metrics_lock:
+            return {fn_name: metrics.as_dict()
+                    for fn_name, metrics in self._metrics.items()}
+
+    def start(self):
+        """Start the pool workers now instead of on the first call."""
+        with self._pool_lock:
+            return self._start()
+
+    def _start(self):
+        if self._pool is None:
+            # Not forked, the caller may be a threaded server
+            context = multiprocessing.get_context('spawn')
+            self._pool = context.Pool(self.processes)
+        return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def _run_in_pool(self, key, source, batch, timeout):
+        for _ in range(RESUBMIT_LIMIT + 1):
+            done = threading.Event()
+            with self._pool_lock:
+                pool = self._start()
+                self._waiting.add(done)
+            result = pool.apply_async(_run_batch, (key, source, batch),
+                                      callback=lambda _: done.set(),
+                                      error_callback=lambda _: done.set())
+            # Set by the result, or by the termination of the pool
+            done.wait(timeout)
+            with self._pool_lock:
+                self._waiting.discard(done)
+                terminated = self._pool is not pool
+            if result.ready():
+                try:
+                    return result.get(0)
+                except multiprocessing.pool.MaybeEncodingError as e:
+                    # The results of the user code may not be picklable
+                    raise FunctionError(str(e)) from None
+            if not terminated:
+                break
+            # Terminated by the timeout of another batch, this one is not to blame
+            logger.info('Function %s is run again in the new pool', key[:8])
+        else:
+            raise FunctionTimeout('The pool was terminated {} times while the function ran'
+                                  .format(RESUBMIT_LIMIT + 1))
+
+        # The worker is stuck or dead, the pool can not cancel a task
+        logger.warning('Function %s timed out after %ss, restart the pool',
+                       key[:8], timeout)
+        waiting = ()
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                waiting, self._waiting = self._waiting, set()
+        pool.terminate()
+        for event in waiting:
+            event.set()
+        raise FunctionTimeout('The function did not finish in {}s'.format(timeout))
+
+    def _record(self, fn_name, calls, start, error=False, timeout=False):
+        elapsed = time.perf_counter() - start
+        with self._metrics_lock:
+            metrics = self._metrics.get(fn_name)
+            if metrics is None:
+                metrics = self._metrics[fn_name] = _Metrics()
+            metrics.batches += 1
+            metrics.calls += calls
+            metrics.errors += error
+            metrics.timeouts += timeout
+            if calls and not (error or timeout):
+                metrics.latencies.append(elapsed / calls)
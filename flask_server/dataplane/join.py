@@ -0,0 +1,150 @@
+"""
+Vectorized Multiple Join of the IDF samples of a network application.
+
+Each MJ_Module row of a NetworkApp tells which DF_Object feeds the `param_i`
+input of the join, and which Function combines it. The samples of each
+DF_Object are buffered in a preallocated ring buffer, `join()` then takes the
+samples every input has received, in order, and assembles them by stacking the
+columns of the inputs at once:
+
+    joined[:, param_i] = function(buffer[DF_Object of param_i][:n])
+
+A join function gets the (n, width) block of its DF_Object and returns n values,
+or an (n, k) block. An input without a function is passed through.
+
+The memory of a network app is bounded: a buffer holds `capacity` samples, the
+oldest samples of an input are dropped (and counted) when it is full.
+"""
+import numpy as np
+
+__all__ = [
+    'JoinEngine',
+    'RingBuffer',
+]
+
+
+class RingBuffer:
+    """A fixed-size FIFO of samples, each a row of `width` floats."""
+
+    def __init__(self, capacity, width, dtype=np.float64):
+        self.capacity = capacity
+        self.width = width
+        self.dropped = 0
+
+        self._data = np.zeros((capacity, width), dtype=dtype)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def extend(self, rows):
+        """Append the rows, dropping the oldest ones if the buffer overflows."""
+        rows = np.asarray(rows, dtype=self._data.dtype).reshape(-1, self.width)
+        n = len(rows)
+        if n >= self.capacity:
+            # Only the newest `capacity` rows are kept
+            self.dropped += self._size + n - self.capacity
+            self._data[:] = rows[n - self.capacity:]
+            self._start, self._size = 0, self.capacity
+            return
+
+        overflow = self._size + n - self.capacity
+        if overflow > 0:
+            self.dropped += overflow
+            self._start = (self._start + overflow) % self.capacity
+            self._size -= overflow
+
+        end = (self._start + self._size) % self.capacity
+        first = min(n, self.capacity - end)
+        self._data[end:end + first] = rows[:first]
+        self._data[:n - first] = rows[first:]
+        self._size += n
+
+    def peek(self, n):
+        """Return the oldest `n` rows, a view unless they wrap around the end."""
+        n = min(n, self._size)
+        end = self._start + n
+        if end <= self.capacity:
+            return self._data[self._start:end]
+        return np.concatenate((self._data[self._start:], self._data[:end - self.capacity]))
+
+    def consume(self, n):
+        n = min(n, self._size)
+        self._start = (self._start + n) % self.capacity
+        self._size -= n
+
+
+class JoinEngine:
+    """
+    The compiled join of a NetworkApp.
+
+    :param config: the compiled NetworkApp configuration, see `project.compiler`
+    :param functions: {<Function.fn_name>: callable}, the join functions
+    :param capacity: the samples buffered per DF_Object
+    """
+
+    def __init__(self, config, functions=None, capacity=1024, dtype=np.float64):
+        functions = functions or {}
+        widths = {dfo['dfo_id']: len(dfo['params']) for dfo in config['idf']}
+
+        self.inputs = []  # (param_i, dfo_id, function), ordered by param_i
+        for module in sorted(config['join'], key=lambda m: m['param_i']):
+            dfo_id, fn_name = module['dfo_id'], module['fn_name']
+            if dfo_id not in widths:
+                raise ValueError('DF_Object {} is not an IDF of the network app'
+                                 .format(dfo_id))
+            if fn_name is not None and fn_name not in functions:
+                raise ValueError('Function "{}" is not provided'.format(fn_name))
+            self.inputs.append((module['param_i'], dfo_id,
+                                functions[fn_name] if fn_name is not None else None))
+
+        dfo_ids = dict.fromkeys(dfo_id for _, dfo_id, _ in self.inputs)
+        self.buffers = {dfo_id: RingBuffer(capacity, widths[dfo_id], dtype=dtype)
+                        for dfo_id in dfo_ids}
+
+    @property
+    def nbytes(self):
+        """The memory of the buffers, fixed at construction."""
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+    @property
+    def dropped(self):
+        return sum(buffer.dropped for buffer in self.buffers.values())
+
+    def push(self, dfo_id, samples):
+        """Buffer the (normalized) samples of a DF_Object, shape (n, width)."""
+        self.buffers[dfo_id].extend(samples)
+
+    def ready(self):
+        """The number of samples every input has received."""
+        return min((len(buffer) for buffer in self.buffers.values()), default=0)
+
+    def join(self, limit=None):
+        """
+        Join the samples every input has received and remove them from the buffers.
+
+        :return: ndarray of shape (n, joined width), or (0, 0) if nothing is ready
+        """
+        n = self.ready()
+        if limit is not None:
+            n = min(n, limit)
+        if n <= 0:
+            return np.empty((0, 0))
+
+        blocks = {dfo_id: buffer.peek(n) for dfo_id, buffer in self.buffers.items()}
+        columns = []
+        for _, dfo_id, function in self.inputs:
+            block = blocks[dfo_id]
+            if function is not None:
+                block = np.asarray(function(block))
+            columns.append(block.reshape(n, -1))
+        joined = np.hstack(columns) if columns else np.empty((n, 0))
+
+        for buffer in self.buffers.values():
+            buffer.consume(n)
+        return joined
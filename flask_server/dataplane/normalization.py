@@ -0,0 +1,132 @@
+"""
+Vectorized min/max normalization of the IDF samples.
+
+The DF_Module (or DeviceParameter) rows of a DF_Object are compiled into column
+vectors, one column per `param_i`, and a batch of samples (one row per sample)
+is transformed at once:
+
+    * 'variant' parameters are turned into the change from the previous sample,
+      the last sample of a batch is kept for the next one,
+    * with `normalization`, the values are scaled from [min, max] to [0, 1],
+      otherwise they are clipped to [min, max],
+    * a parameter whose min equals max has no range, it is passed through.
+
+The result of a batch is the same as transforming its samples one by one with
+`transform_sample`, the reference implementation.
+"""
+import numpy as np
+
+__all__ = [
+    'NormalizationEngine',
+    'compile_network_app',
+    'transform_sample',
+]
+
+SAMPLE = 'sample'
+VARIANT = 'variant'
+
+
+def _ordered(params):
+    params = sorted(params, key=lambda p: p.get('param_i', 0))
+    for param in params:
+        if param.get('idf_type', SAMPLE) not in (SAMPLE, VARIANT):
+            raise ValueError('Invalid idf_type "{}"'.format(param['idf_type']))
+    return params
+
+
+def transform_sample(params, sample, previous=None):
+    """Transform one sample (a sequence of floats) in plain Python."""
+    result = []
+    for i, param in enumerate(_ordered(params)):
+        value = float(sample[i])
+        if param.get('idf_type', SAMPLE) == VARIANT:
+            value = value - previous[i] if previous is not None else 0.0
+        low, high = float(param.get('min') or 0), float(param.get('max') or 0)
+        if low < high:
+            value = min(max(value, low), high)
+            if param.get('normalization'):
+                value = (value - low) / (high - low)
+        result.append(value)
+    return result
+
+
+class NormalizationEngine:
+    """
+    The compiled parameters of a DF_Object.
+
+    :param params: the DF_Module or DeviceParameter rows, or the 'params'
+                   of a compiled NetworkApp configuration, as dicts with
+                   `param_i`, `idf_type`, `min`, `max` and `normalization`
+    """
+
+    def __init__(self, params, dtype=np.float64):
+        params = _ordered(params)
+        self.width = len(params)
+        self.dtype = np.dtype(dtype)
+
+        low = np.array([p.get('min') or 0 for p in params], dtype=self.dtype)
+        high = np.array([p.get('max') or 0 for p in params], dtype=self.dtype)
+        ranged = low < high
+        scaled = ranged & np.array([bool(p.get('normalization')) for p in params])
+
+        # Unranged columns are clipped to (-inf, inf), scaled ones by 1 / (max - min)
+        self._low = np.where(ranged, low, -np.inf)
+        self._high = np.where(ranged, high, np.inf)
+        self._offset = np.where(scaled, low, 0).astype(self.dtype)
+        span = np.where(scaled, high - low, 1)
+        self._scale = np.where(scaled, 1 / span, 1).astype(self.dtype)
+        self._variant = np.array([p.get('idf_type', SAMPLE) == VARIANT for p in params])
+        self._has_variant = bool(self._variant.any())
+        self._clips = bool(ranged.any())
+        self._scales = bool(scaled.any())
+
+        # The last raw sample, the base of the first variant of the next batch
+        self._previous = None
+
+    def reset(self):
+        """Forget the previous sample, e.g. when the device reconnects."""
+        self._previous = None
+
+    def transform(self, batch, out=None):
+        """
+        Transform a batch of samples.
+
+        :param batch: array-like of shape (n, width), or (width,) for one sample
+        :param out: optional array of shape (n, width) to write the result into
+        :return: ndarray of shape (n, width)
+        """
+        batch = np.asarray(batch, dtype=self.dtype)
+        if batch.ndim == 1:
+            batch = batch.reshape(1, -1)
+        if batch.shape[1] != self.width:
+            raise ValueError('Expected {} parameters, got {}'
+                             .format(self.width, batch.shape[1]))
+        if out is None:
+            out = np.empty_like(batch)
+        if not len(batch):
+            return out
+
+        np.copyto(out, batch)
+        if self._has_variant:
+            variant = self._variant
+            out[1:, variant] = batch[1:, variant] - batch[:-1, variant]
+            out[0, variant] = (batch[0, variant] - self._previous[variant]
+                               if self._previous is not None else 0)
+            self._previous = batch[-1].copy()
+
+        if self._clips:
+            np.clip(out, self._low, self._high, out=out)
+        if self._scales:
+            out -= self._offset
+            out *= self._scale
+        return out
+
+
+def compile_network_app(config, dtype=np.float64):
+    """
+    Compile the IDFs of a NetworkApp configuration, see `project.compiler`.
+
+    :return: {<DF_Object.id>: NormalizationEngine, ...}
+    """
+    return {dfo['dfo_id']: NormalizationEngine(dfo['params'], dtype=dtype)
+            for dfo in config['idf']}
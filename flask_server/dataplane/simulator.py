@@ -0,0 +1,260 @@
+"""
+Simulated device fleet.
+
+A virtual device of a DeviceModel publishes a sample of each of its IDFs at a
+fixed rate. The samples follow the parameters of the feature (DeviceParameter
+of the general user): a bounded random walk in [min, max] for the 'sample'
+parameters, small steps around 0 for the 'variant' ones, rounded for 'int'
+and 0/1 for 'boolean'.
+
+The samples of all the devices of a model are generated at once, one
+(devices, parameters) array per feature and tick, and published to a broker,
+`LocalBroker` in process or any object with the same `publish()`:
+
+    iottalk/sim/<mac_addr>/<df_name>    [<value>, ...]
+
+It is used both by the projects in simulation mode (`Project.sim` = 'on') and
+as a load generator, see `flask simulate`.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import select
+
+from db.models import DeviceFeature, DeviceModel, DeviceParameter, DM_DF
+from gateway.local import topic_matches
+
+__all__ = [
+    'FleetSimulator',
+    'LocalBroker',
+    'load_models',
+]
+
+logger = logging.getLogger(__name__)
+
+TOPIC = 'iottalk/sim/{mac_addr}/{df_name}'
+
+# The generated parameter types, the others are published as their fixed value
+NUMERIC_TYPES = ('int', 'float', 'boolean')
+FIXED_VALUES = {'string': '', 'json': {}, 'void': None}
+
+# The step of the random walk, relative to max - min
+WALK_STEP = 0.05
+
+M = DeviceModel.__table__
+F = DeviceFeature.__table__
+MF = DM_DF.__table__
+P = DeviceParameter.__table__
+
+
+class LocalBroker:
+    """An in-process stand-in of the MQTT broker, the callbacks run in the publisher."""
+
+    def __init__(self):
+        self.published = 0
+
+        self._lock = threading.Lock()
+        self._subscriptions = []  # (topic filter, callback)
+
+    def subscribe(self, topic_filter, callback):
+        """Call `callback(topic, payload)` for every message matching the filter."""
+        with self._lock:
+            self._subscriptions.append((topic_filter, callback))
+
+    def unsubscribe(self, topic_filter, callback):
+        with self._lock:
+            self._subscriptions.remove((topic_filter, callback))
+
+    def publish(self, topic, payload):
+        with self._lock:
+            self.published += 1
+            subscriptions = list(self._subscriptions)
+        for topic_filter, callback in subscriptions:
+            if topic_matches(topic_filter, topic):
+                callback(topic, payload)
+
+
+class _FeatureStream:
+    """The samples of one IDF for all the virtual devices of a model."""
+
+    def __init__(self, df_name, params, devices, rng):
+        self.df_name = df_name
+        self.width = len(params)
+
+        numeric = [i for i, p in enumerate(params) if p['param_type'] in NUMERIC_TYPES]
+        self._numeric = np.array(numeric, dtype=np.intp)
+        self._fixed = {i: FIXED_VALUES.get(p['param_type'])
+                       for i, p in enumerate(params) if i not in numeric}
+
+        def column(name, default=0.0):
+            return np.array([float(params[i].get(name) or default) for i in numeric])
+
+        low, high = column('min'), column('max')
+        boolean = np.array([params[i]['param_type'] == 'boolean' for i in numeric], bool)
+        # A parameter without a range walks in [0, 1], a boolean is 0 or 1
+        unranged = (low >= high) | boolean
+        self._low = np.where(unranged, 0.0, low)
+        self._high = np.where(unranged, 1.0, high)
+        self._step = (self._high - self._low) * WALK_STEP
+        self._variant = np.array([params[i].get('idf_type') == 'variant' for i in numeric],
+                                 bool)
+        self._int = np.array([params[i]['param_type'] == 'int' for i in numeric], bool)
+        self._boolean = boolean
+
+        self._rng = rng
+        self._state = rng.uniform(self._low, self._high, size=(devices, len(numeric)))
+
+    def step(self):
+        """Return the next sample of every device, shape (devices, numeric parameters)."""
+        noise = self._rng.standard_normal(self._state.shape) * self._step
+        self._state += noise
+        np.clip(self._state, self._low, self._high, out=self._state)
+
+        values = np.where(self._variant, noise, self._state)
+        if self._int.any():
+            values[:, self._int] = np.rint(values[:, self._int])
+        if self._boolean.any():
+            values[:, self._boolean] = values[:, self._boolean] >= 0.5
+        return values
+
+    def payloads(self, values):
+        """Yield the JSON payload of each device."""
+        if not self._fixed:
+            for row in values.tolist():
+                yield json.dumps(row)
+            return
+
+        numeric = self._numeric.tolist()
+        for row in values.tolist():
+            sample = [None] * self.width
+            for i, value in zip(numeric, row):
+                sample[i] = value
+            for i, value in self._fixed.items():
+                sample[i] = value
+            yield json.dumps(sample)
+
+
+def load_models(connection, dm_ids):
+    """
+    Return the IDFs of the device models, with their general parameters.
+
+    :return: {<DeviceModel.id>: {'dm_name': ..., 'features': [{'df_name': ...,
+              'params': [{'param_type', 'min', 'max', 'idf_type'}, ...]}, ...]}}
+    """
+    models = {row.id: {'dm_name': row.dm_name, 'features': []}
+              for row in connection.execute(select(M.c.id, M.c.dm_name)
+                                            .where(M.c.id.in_(dm_ids)))}
+
+    params = defaultdict(list)
+    query = (select(MF.c.dm_id, F.c.df_name, P.c.param_type, P.c.min, P.c.max,
+                    P.c.idf_type)
+             .join(F, F.c.id == MF.c.df_id)
+             .join(P, P.c.dmdf_id == MF.c.id)
+             .where(MF.c.dm_id.in_(dm_ids), F.c.df_type == 'idf', P.c.user_id == 1)
+             .order_by(MF.c.dm_id, F.c.df_name, P.c.id))
+    for row in connection.execute(query):
+        params[(row.dm_id, row.df_name)].append({
+            'param_type': row.param_type,
+            'min': row.min,
+            'max': row.max,
+            'idf_type': row.idf_type,
+        })
+
+    for (dm_id, df_name), feature_params in params.items():
+        models[dm_id]['features'].append({'df_name': df_name, 'params': feature_params})
+    return models
+
+
+class FleetSimulator:
+    """
+    :param broker: where the samples are published, e.g. `LocalBroker()`
+    :param rate: the samples per second of each feature of each device
+    :param seed: the seed of the random generator, for reproducible runs
+    """
+
+    def __init__(self, broker, rate=1.0, seed=None):
+        self.broker = broker
+        self.rate = rate
+        self.published = 0
+
+        self._rng = np.random.default_rng(seed)
+        self._fleets = []  # (mac_addrs, [_FeatureStream, ...])
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_fleet(self, dm_name, features, count, prefix='sim'):
+        """
+        Add `count` virtual devices of a model.
+
+        :param features: the 'features' of the model, see `load_models`
+        :return: the devices, as the `devices` of the register_devices op
+        """
+        mac_addrs = ['{}-{}-{:06d}'.format(prefix, dm_name, i) for i in range(count)]
+        streams = [_FeatureStream(feature['df_name'], feature['params'], count, self._rng)
+                   for feature in features if feature['params']]
+        self._fleets.append((mac_addrs, streams))
+        return [{'mac_addr': mac_addr, 'd_name': mac_addr, 'dm_name': dm_name,
+                 'is_sim': True}
+                for mac_addr in mac_addrs]
+
+    @property
+    def devices(self):
+        return sum(len(mac_addrs) for mac_addrs, _ in self._fleets)
+
+    def tick(self):
+        """Generate and publish one sample of every feature of every device."""
+        published = 0
+        for mac_addrs, streams in self._fleets:
+            for stream in streams:
+                values = stream.step()
+                for mac_addr, payload in zip(mac_addrs, stream.payloads(values)):
+                    self.broker.publish(
+                        TOPIC.format(mac_addr=mac_addr, df_name=stream.df_name), payload)
+                published += len(mac_addrs)
+        self.published += published
+        return published
+
+    def run(self, seconds=None):
+        """
+        Tick at `rate` until stopped or for `seconds`.
+
+        A tick which takes longer than the interval delays the next ones, the
+        missed ticks are not made up.
+
+        :return: {'ticks', 'published', 'elapsed', 'late'}
+        """
+        interval = 1 / self.rate
+        start = next_tick = time.monotonic()
+        ticks = late = published = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if seconds is not None and now - start >= seconds:
+                break
+            if now < next_tick:
+                self._stop.wait(next_tick - now)
+                continue
+            published += self.tick()
+            ticks += 1
+            next_tick += interval
+            if time.monotonic() > next_tick:
+                late += 1
+                next_tick = time.monotonic()
+        return {'ticks': ticks, 'published': published,
+                'elapsed': time.monotonic() - start, 'late': late}
+
+    def start(self):
+        """Run in a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='fleet-simulator',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
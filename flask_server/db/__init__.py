@@ -1,3 +1,121 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlite3 import Connection as SQLite3Connection
+
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The bind key of the read-only engine, see `init_read_bind`
+READ_BIND = 'read'
+
+# True while the statements of the current context can be served by the read-only engine
+_reading = ContextVar('reading', default=False)
+# The after-commit callbacks of the op run by the group commit of `modules.writer`,
+# None when the ops commit on their own
+_group_commit = ContextVar('group_commit', default=None)
+
+
+@contextmanager
+def reading():
+    """Route the queries issued in this block to the read-only engine, if there is one."""
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+@contextmanager
+def group_commit(callbacks):
+    """
+    Run an op of a group commit batch: its `commit()` only flushes, its `rollback()`
+    is left to the SAVEPOINT of the caller, and the callbacks given to
+    `after_commit()` are appended to `callbacks`.
+    """
+    token = _group_commit.set(callbacks)
+    try:
+        yield
+    finally:
+        _group_commit.reset(token)
+
+
+def after_commit(fn, *args):
+    """
+    Run `fn(*args)` once the changes of the current op are committed,
+    e.g. to update an in-memory state. Call it after the `commit()` of the op.
+    """
+    callbacks = _group_commit.get()
+    if callbacks is None:
+        fn(*args)
+    else:
+        callbacks.append((fn, args))
+
+
+class RoutingSession(Session):
+    """
+    Session which sends the reads in a `reading()` block to the read-only engine,
+    and defers the commits in a `group_commit()` block.
+    """
+
+    def commit(self):
+        if _group_commit.get() is not None:
+            self.flush()
+        else:
+            super().commit()
+
+    def rollback(self):
+        if _group_commit.get() is None:
+            super().rollback()
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reading.get() and not self._flushing:
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def read_bind_uri(database_uri, replica_uri=''):
+    """
+    Return the URI of the read-only engine.
+
+    SQLite opens the same database file in read-only mode,
+    other databases use the replica, or no read-only engine if it is not given.
+    """
+    if replica_uri:
+        return replica_uri
+    if database_uri.startswith('sqlite:///'):
+        path = database_uri[len('sqlite:///'):]
+        return 'sqlite:///file:{}?mode=ro&uri=true'.format(path)
+    return None
+
+
+def init_read_bind(app):
+    """Make the connections of the read-only SQLite engine refuse any write."""
+    with app.app_context():
+        engine = db.engines.get(READ_BIND)
+        if engine is None or engine.dialect.name != 'sqlite':
+            return
+
+        @event.listens_for(engine, 'connect')
+        def enable_sqlite_query_only(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA query_only=ON')
+            cursor.close()
+
 
-db = SQLAlchemy()
+# SQLite does not enforce foreign keys, including their ON DELETE rules,
+# unless it is enabled on every new connection.
+#
+# Ref: https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#foreign-key-support
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, SQLite3Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
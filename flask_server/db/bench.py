@@ -0,0 +1,195 @@
+"""
+Benchmarks of the database, run them with `flask bench-<name>`.
+
+The rows are inserted into the configured database by a user created for the
+benchmark, and deleted by it.
+"""
+import datetime
+import statistics
+import time
+import uuid
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from db import models
+
+__all__ = [
+    'bench_cascade_delete',
+    'bench_search',
+]
+
+
+def _ids(table, rows):
+    """Insert the rows one statement each, return their ids."""
+    return [db.session.execute(insert(table).values(**row)).inserted_primary_key[0]
+            for row in rows]
+
+
+def _seed(features, parameters, devices):
+    tag = uuid.uuid4().hex[:12]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    user_id, = _ids(models.User.__table__, [{'username': 'bench-' + tag, 'group_id': 2}])
+    unit_id, = _ids(models.Unit.__table__, [{'unit_name': 'bench-' + tag}])
+    dm_id, = _ids(models.DeviceModel.__table__,
+                  [{'dm_name': 'bench-' + tag, 'dm_type': 'other'}])
+    df_ids = _ids(models.DeviceFeature.__table__,
+                  [{'df_name': 'bench-{}-{}'.format(tag, i), 'df_type': 'idf',
+                    'param_num': parameters, 'user_id': user_id}
+                   for i in range(features)])
+    mf_ids = _ids(models.DM_DF.__table__,
+                  [{'dm_id': dm_id, 'df_id': df_id} for df_id in df_ids])
+    db.session.execute(insert(models.DeviceParameter.__table__), [
+        {'param_type': 'float', 'min': 0, 'max': 0, 'idf_type': 'sample',
+         'normalization': False, 'user_id': user_id, 'df_id': df_id,
+         'dmdf_id': mf_id, 'unit_id': unit_id}
+        for df_id, mf_id in zip(df_ids, mf_ids) for _ in range(parameters)
+    ])
+    db.session.execute(insert(models.Device.__table__), [
+        {'mac_addr': 'bench-{}-{}'.format(tag, i), 'd_name': 'bench', 'status': 'online',
+         'monitor': '', 'is_sim': False, 'register_time': now,
+         'extra_setup_webpage': '', 'device_webpage': '',
+         'user_id': user_id, 'dm_id': dm_id}
+        for i in range(devices)
+    ])
+    db.session.commit()
+    return user_id, unit_id, dm_id
+
+
+def _timed(statement):
+    start = time.perf_counter()
+    db.session.execute(statement)
+    db.session.commit()
+    return (time.perf_counter() - start) * 1e3
+
+
+def bench_cascade_delete(features=1000, parameters=3, devices=1000, rounds=3):
+    """
+    Measure deleting a device model and a user by a single DELETE each, the
+    child rows being deleted by ON DELETE CASCADE, and refusing to delete a
+    Unit in use by ON DELETE RESTRICT.
+
+    :return: {'device_model_ms', 'user_ms', 'unit_in_use_ms', 'unit_refused'},
+             the medians of the rounds in milliseconds
+    """
+    device_model_ms, user_ms, unit_ms = [], [], []
+    refused = True
+    for _ in range(rounds):
+        user_id, unit_id, dm_id = _seed(features, parameters, devices)
+
+        start = time.perf_counter()
+        try:
+            db.session.execute(delete(models.Unit.__table__)
+                               .where(models.Unit.__table__.c.id == unit_id))
+            db.session.commit()
+            refused = False
+        except IntegrityError:
+            db.session.rollback()
+        unit_ms.append((time.perf_counter() - start) * 1e3)
+
+        # The device model takes its DM_DF, their parameters and the devices
+        device_model_ms.append(_timed(delete(models.DeviceModel.__table__).where(
+            models.DeviceModel.__table__.c.id == dm_id)))
+        # The user takes the device features and whatever is left
+        user_ms.append(_timed(delete(models.User.__table__).where(
+            models.User.__table__.c.id == user_id)))
+        _timed(delete(models.Unit.__table__).where(models.Unit.__table__.c.id == unit_id))
+
+    return {
+        'features': features,
+        'parameters': features * parameters,
+        'devices': devices,
+        'device_model_ms': statistics.median(device_model_ms),
+        'user_ms': statistics.median(user_ms),
+        'unit_in_use_ms': statistics.median(unit_ms),
+        'unit_refused': refused,
+    }
+
+
+def _median_ms(fn, rounds):
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1e3)
+    return statistics.median(times)
+
+
+def bench_search(features=20000, units=10, rounds=20):
+    """
+    Measure the catalogue search by the FTS5 index and by the LIKE fallback,
+    and renaming a unit, which updates the terms of the features using it.
+
+    Every feature has 2 parameters of one of `units` units.
+
+    :return: {'queries': {<name>: {'keyword', 'total', 'fts_ms', 'like_ms'}},
+              'rename_unit_ms', 'renamed_features'}
+    """
+    from modules import search
+
+    tag = uuid.uuid4().hex[:12]
+    user_id, = _ids(models.User.__table__, [{'username': 'bench-' + tag, 'group_id': 2}])
+    unit_ids = _ids(models.Unit.__table__,
+                    [{'unit_name': 'benchunit{}x{}'.format(tag, k)} for k in range(units)])
+    df_ids = _ids(models.DeviceFeature.__table__,
+                  [{'df_name': 'bench-{}-sensor{}'.format(tag, i), 'df_type': 'idf',
+                    'param_num': 2, 'content': 'temperature humidity reading {}'.format(i),
+                    'user_id': user_id}
+                   for i in range(features)])
+    # A device model per 100 features
+    dm_ids = _ids(models.DeviceModel.__table__,
+                  [{'dm_name': 'benchdm{}x{}'.format(tag, i), 'dm_type': 'other'}
+                   for i in range(0, features, 100)])
+    mf_ids = _ids(models.DM_DF.__table__,
+                  [{'dm_id': dm_ids[i // 100], 'df_id': df_id}
+                   for i, df_id in enumerate(df_ids)])
+    db.session.execute(insert(models.DeviceParameter.__table__), [
+        {'param_type': 'float', 'min': 0, 'max': 0, 'idf_type': 'sample',
+         'normalization': False, 'user_id': user_id, 'df_id': df_id, 'dmdf_id': mf_id,
+         'unit_id': unit_ids[i % units]}
+        for i, (df_id, mf_id) in enumerate(zip(df_ids, mf_ids)) for _ in range(2)
+    ])
+    db.session.commit()
+
+    keywords = {
+        'selective': 'sensor{}'.format(features // 2),
+        'unit': 'benchunit{}x1'.format(tag),
+        'broad': 'bench ' + tag,
+    }
+    queries = {}
+    try:
+        for name, keyword in keywords.items():
+            words = keyword.split()
+            total = search._search_fts(words, None, 20, 0)['total']
+            queries[name] = {
+                'keyword': keyword,
+                'total': total,
+                'fts_ms': _median_ms(lambda: search._search_fts(words, None, 20, 0),
+                                     rounds),
+                'like_ms': _median_ms(lambda: search._search_like(words, None, 20, 0),
+                                      rounds),
+            }
+
+        unit = models.Unit.__table__
+        start = time.perf_counter()
+        db.session.execute(update(unit).where(unit.c.id == unit_ids[0])
+                           .values(unit_name='benchunit{}renamed'.format(tag)))
+        db.session.commit()
+        rename_unit_ms = (time.perf_counter() - start) * 1e3
+        renamed = search._search_fts(['benchunit{}renamed'.format(tag)], 'df', 1,
+                                     0)['total']
+    finally:
+        db.session.rollback()
+        _timed(delete(models.DeviceModel.__table__).where(
+            models.DeviceModel.__table__.c.id.in_(dm_ids)))
+        _timed(delete(models.User.__table__).where(models.User.__table__.c.id == user_id))
+        _timed(delete(models.Unit.__table__).where(
+            models.Unit.__table__.c.id.in_(unit_ids)))
+
+    return {
+        'features': features,
+        'queries': queries,
+        'rename_unit_ms': rename_unit_ms,
+        'renamed_features': renamed,
+    }
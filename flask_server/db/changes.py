@@ -0,0 +1,69 @@
+"""
+Change tokens of the in-memory indexes.
+
+An index kept in the memory of every process (e.g. `catalogue.graph`) must know
+when another process has committed a change of its tables. Each index owns a row
+of `catalogueVersion`, every transaction changing the tables writes a new random
+token to it:
+
+    * a reader compares the stored token with the one the process has seen,
+      if they differ the index is loaded again,
+    * a writer replaces the token it has seen, if the stored one is different,
+      another process has written in between and the index is loaded again
+      after the commit instead of being updated incrementally.
+"""
+import uuid
+
+from sqlalchemy import insert, select, update
+
+from db.models import CatalogueVersion
+
+__all__ = [
+    'ChangeToken',
+]
+
+V = CatalogueVersion.__table__
+
+
+class ChangeToken:
+    def __init__(self, row_id):
+        self.row_id = row_id
+        # The stored token the process is in sync with
+        self.seen = None
+        self._key = 'change_token_{}'.format(row_id)
+
+    def stored(self, connection):
+        return connection.execute(select(V.c.token).where(V.c.id == self.row_id)).scalar()
+
+    def is_stale(self, connection):
+        return self.stored(connection) != self.seen
+
+    def write(self, session, connection):
+        """
+        Store the token of the session's transaction.
+
+        Return False if another process has written a token since the process saw it.
+        """
+        token = session.info.get(self._key)
+        if token is None:
+            token = session.info[self._key] = uuid.uuid4().hex
+
+        result = connection.execute(update(V)
+                                    .where(V.c.id == self.row_id,
+                                           V.c.token.in_((self.seen or '', token)))
+                                    .values(token=token))
+        if result.rowcount:
+            return True
+
+        result = connection.execute(update(V)
+                                    .where(V.c.id == self.row_id)
+                                    .values(token=token))
+        if not result.rowcount:
+            # The row of an index added after the table is created
+            connection.execute(insert(V).values(id=self.row_id, token=token))
+            return self.seen is None
+        return False
+
+    def pop(self, session):
+        """Return the token written by the committed or rolled back transaction."""
+        return session.info.pop(self._key, None)
@@ -0,0 +1,189 @@
+"""
+SQLite FTS5 index over the device feature/model catalogue.
+
+Each row of `catalogue_fts` is a DeviceFeature or a DeviceModel, the kind is
+encoded in the rowid (`id * 2` for features, `id * 2 + 1` for models) so the
+triggers can address a row without scanning the index.
+
+    name:    <DeviceFeature.df_name> / <DeviceModel.dm_name>
+    content: <DeviceFeature.content>
+    terms:   unit and function names of the feature's parameters /
+             feature names of the model
+
+The index is kept in sync by the triggers below, including the renames of a
+unit or a function, `rebuild` repopulates it.
+"""
+import logging
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+from db import db
+
+__all__ = [
+    'FEATURE',
+    'MODEL',
+    'TABLE',
+    'install',
+    'rebuild',
+]
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'catalogue_fts'
+FEATURE = 0
+MODEL = 1
+
+FEATURE_TERMS = '''(
+    SELECT coalesce(group_concat(name, ' '), '') FROM (
+        SELECT unit.unit_name AS name FROM "deviceParameter" AS p
+            JOIN unit ON unit.id = p.unit_id WHERE p.df_id = {df_id}
+        UNION
+        SELECT function.fn_name FROM "deviceParameter" AS p
+            JOIN function ON function.id = p.fn_id WHERE p.df_id = {df_id}
+    )
+)'''
+
+MODEL_TERMS = '''(
+    SELECT coalesce(group_concat(f.df_name, ' '), '') FROM dm_df AS m
+        JOIN "deviceFeature" AS f ON f.id = m.df_id WHERE m.dm_id = {dm_id}
+)'''
+
+
+def _update_feature_terms(df_id):
+    return 'UPDATE {table} SET terms = {terms} WHERE rowid = ({df_id}) * 2;'.format(
+        table=TABLE, terms=FEATURE_TERMS.format(df_id=df_id), df_id=df_id)
+
+
+def _update_model_terms(dm_id):
+    return 'UPDATE {table} SET terms = {terms} WHERE rowid = ({dm_id}) * 2 + 1;'.format(
+        table=TABLE, terms=MODEL_TERMS.format(dm_id=dm_id), dm_id=dm_id)
+
+
+def _update_terms_of_features(column, value):
+    """The unit/function names of the features whose parameters have `column` = `value`."""
+    return ('UPDATE {table} SET terms = {terms} WHERE rowid IN '
+            '(SELECT df_id * 2 FROM "deviceParameter" WHERE {column} = {value});').format(
+        table=TABLE, terms=FEATURE_TERMS.format(df_id='({}.rowid / 2)'.format(TABLE)),
+        column=column, value=value)
+
+
+def _update_model_terms_of_feature(df_id):
+    return ('UPDATE {table} SET terms = {terms} WHERE rowid IN '
+            '(SELECT dm_id * 2 + 1 FROM dm_df WHERE df_id = {df_id});').format(
+        table=TABLE, terms=MODEL_TERMS.format(dm_id='({}.rowid - 1) / 2'.format(TABLE)),
+        df_id=df_id)
+
+
+TABLE_DDL = '''CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(
+    name, content, terms, tokenize = 'unicode61', prefix = '2 3'
+)'''.format(table=TABLE)
+
+# A row deleted along with its parent by ON DELETE CASCADE skips the terms of the
+# parent, its index row is deleted anyway. Deleting a device model would otherwise
+# recompute its feature names once per DM_DF.
+_MODEL_EXISTS = 'EXISTS (SELECT 1 FROM "deviceModel" WHERE id = {dm_id})'
+_FEATURE_EXISTS = 'EXISTS (SELECT 1 FROM "deviceFeature" WHERE id = {df_id})'
+
+# (name, body), the names are kept to replace the triggers of an older version
+TRIGGERS = [
+    # deviceFeature
+    ('fts_df_insert', '''AFTER INSERT ON "deviceFeature" BEGIN
+        INSERT INTO {table} (rowid, name, content, terms)
+            VALUES (NEW.id * 2, NEW.df_name, coalesce(NEW.content, ''), '');
+    END'''.format(table=TABLE)),
+    ('fts_df_update', '''AFTER UPDATE OF df_name, content ON "deviceFeature" BEGIN
+        UPDATE {table} SET name = NEW.df_name, content = coalesce(NEW.content, '')
+            WHERE rowid = NEW.id * 2;
+        {model_terms}
+    END'''.format(table=TABLE, model_terms=_update_model_terms_of_feature('NEW.id'))),
+    ('fts_df_delete', '''AFTER DELETE ON "deviceFeature" BEGIN
+        DELETE FROM {table} WHERE rowid = OLD.id * 2;
+    END'''.format(table=TABLE)),
+
+    # deviceModel
+    ('fts_dm_insert', '''AFTER INSERT ON "deviceModel" BEGIN
+        INSERT INTO {table} (rowid, name, content, terms)
+            VALUES (NEW.id * 2 + 1, NEW.dm_name, '', '');
+    END'''.format(table=TABLE)),
+    ('fts_dm_update', '''AFTER UPDATE OF dm_name ON "deviceModel" BEGIN
+        UPDATE {table} SET name = NEW.dm_name WHERE rowid = NEW.id * 2 + 1;
+    END'''.format(table=TABLE)),
+    ('fts_dm_delete', '''AFTER DELETE ON "deviceModel" BEGIN
+        DELETE FROM {table} WHERE rowid = OLD.id * 2 + 1;
+    END'''.format(table=TABLE)),
+
+    # dm_df, the feature names of a model
+    ('fts_dmdf_insert', '''AFTER INSERT ON dm_df BEGIN
+        {terms}
+    END'''.format(terms=_update_model_terms('NEW.dm_id'))),
+    ('fts_dmdf_delete', '''AFTER DELETE ON dm_df
+            WHEN {exists} BEGIN
+        {terms}
+    END'''.format(exists=_MODEL_EXISTS.format(dm_id='OLD.dm_id'),
+                  terms=_update_model_terms('OLD.dm_id'))),
+
+    # deviceParameter, the unit/function names of a feature
+    ('fts_dp_insert', '''AFTER INSERT ON "deviceParameter" BEGIN
+        {terms}
+    END'''.format(terms=_update_feature_terms('NEW.df_id'))),
+    ('fts_dp_update', '''AFTER UPDATE OF unit_id, fn_id, df_id ON "deviceParameter" BEGIN
+        {old_terms}
+        {new_terms}
+    END'''.format(old_terms=_update_feature_terms('OLD.df_id'),
+                  new_terms=_update_feature_terms('NEW.df_id'))),
+    ('fts_dp_delete', '''AFTER DELETE ON "deviceParameter"
+            WHEN {exists} BEGIN
+        {terms}
+    END'''.format(exists=_FEATURE_EXISTS.format(df_id='OLD.df_id'),
+                  terms=_update_feature_terms('OLD.df_id'))),
+
+    # unit and function, renamed
+    ('fts_unit_update', '''AFTER UPDATE OF unit_name ON unit BEGIN
+        {terms}
+    END'''.format(terms=_update_terms_of_features('unit_id', 'NEW.id'))),
+    ('fts_function_update', '''AFTER UPDATE OF fn_name ON function BEGIN
+        {terms}
+    END'''.format(terms=_update_terms_of_features('fn_id', 'NEW.id'))),
+]
+
+
+def install(connection):
+    """
+    Create the FTS5 table if it does not exist, and (re)create its triggers.
+
+    Return False if the database is not SQLite or SQLite is built without FTS5.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+
+    try:
+        connection.execute(text(TABLE_DDL))
+        for name, body in TRIGGERS:
+            connection.execute(text('DROP TRIGGER IF EXISTS {}'.format(name)))
+            connection.execute(text('CREATE TRIGGER {} {}'.format(name, body)))
+    except OperationalError:
+        logger.warning('SQLite FTS5 is not available, catalogue search falls back to LIKE')
+        return False
+    return True
+
+
+def rebuild(connection):
+    """Repopulate the whole index from the catalogue tables."""
+    connection.execute(text('DELETE FROM {}'.format(TABLE)))
+    connection.execute(text(
+        '''INSERT INTO {table} (rowid, name, content, terms)
+            SELECT f.id * 2, f.df_name, coalesce(f.content, ''), {terms}
+            FROM "deviceFeature" AS f'''.format(
+                table=TABLE, terms=FEATURE_TERMS.format(df_id='f.id'))))
+    connection.execute(text(
+        '''INSERT INTO {table} (rowid, name, content, terms)
+            SELECT d.id * 2 + 1, d.dm_name, '', {terms}
+            FROM "deviceModel" AS d'''.format(
+                table=TABLE, terms=MODEL_TERMS.format(dm_id='d.id'))))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_catalogue_fts(target, connection, **kwargs):
+    if install(connection):
+        rebuild(connection)
@@ -1,24 +1,37 @@
 import datetime
-import sys
 
-import pytz
 from flask_login import UserMixin
 from sqlalchemy import event, CheckConstraint
 
-sys.path.append("..")
 from const import UserGroup
 from db import db
 
+# The id of the "None" unit, created along with the table
+NONE_UNIT_ID = 1
+
+
+def parse_bool(value):
+    """Parse a boolean of a request strictly, e.g. the string 'false' is False."""
+    if isinstance(value, str):
+        if value.strip().lower() in ('true', '1'):
+            return True
+        if value.strip().lower() in ('false', '0'):
+            return False
+    elif value in (0, 1):
+        return bool(value)
+    raise ValueError('Invalid boolean "{}"'.format(value))
+
 
 class TimestampMixin():
     # Ref: https://myapollo.com.tw/zh-tw/sqlalchemy-mixin-and-custom-base-classes/
     created_at = db.Column(
-        db.DateTime(timezone=True), default=lambda: datetime.datetime.now(pytz.UTC)
+        db.DateTime(timezone=True),
+        default=lambda: datetime.datetime.now(datetime.timezone.utc)
     )
     updated_at = db.Column(
         db.DateTime(timezone=True),
         nullable=True,
-        onupdate=lambda: datetime.datetime.now(pytz.UTC)
+        onupdate=lambda: datetime.datetime.now(datetime.timezone.utc)
     )
 
 
@@ -59,6 +72,12 @@ class User(TimestampMixin, UserMixin, db.Model):
         cascade='all, delete-orphan',
         passive_deletes=True
     )
+    device_parameter_deltas = db.relationship(
+        'DeviceParameterDelta',
+        back_populates='user',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
     projects = db.relationship(
         'Project',
         back_populates='user',
@@ -72,9 +91,13 @@ class User(TimestampMixin, UserMixin, db.Model):
         passive_deletes=True
     )
 
+    @property
+    def group_name(self):
+        return refdata.registry.group_name(self.group_id)
+
     @property
     def is_administrator(self):
-        return self.group.name == UserGroup.Administrator
+        return self.group_name == UserGroup.Administrator
 
 
 class Group(db.Model):
@@ -92,18 +115,17 @@ class Group(db.Model):
 # see def of UserGroup for more details
 # you can remove this if you use the fixtures or something else to init
 @event.listens_for(Group.__table__, 'after_create')
-def create_groups(*args, **kwargs):
-    for group in UserGroup:
-        db.session.add(Group(name=group.value))
-    db.session.flush()
-    db.session.commit()
+def create_groups(target, connection, **kwargs):
+    # On the connection creating the tables, the session would track the rows
+    # as a change of the reference data before `catalogueVersion` exists.
+    connection.execute(target.insert(), [{'name': group.value} for group in UserGroup])
 
 
 class RefreshToken(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.Text)
 
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
 
     user = db.relationship('User', back_populates='refresh_token')
     
@@ -120,8 +142,9 @@ class AccessToken(TimestampMixin, db.Model):
     token = db.Column(db.Text)
     expires_at = db.Column(db.DateTime())
 
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    refresh_token_id = db.Column(db.Integer, db.ForeignKey('refresh_token.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    refresh_token_id = db.Column(db.Integer,
+                                 db.ForeignKey('refresh_token.id', ondelete='CASCADE'))
 
     user = db.relationship('User', back_populates='access_tokens')
     refresh_token = db.relationship('RefreshToken', back_populates='access_tokens')
@@ -136,7 +159,8 @@ class DeviceFeature(TimestampMixin, db.Model):
     param_num = db.Column(db.Integer, nullable=False, default=0)
     content = db.Column(db.Text)
     
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
     
     user = db.relationship('User', back_populates='device_features')
     
@@ -202,8 +226,10 @@ class DM_DF(TimestampMixin, db.Model):
     
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     
-    dm_id = db.Column(db.Integer, db.ForeignKey('deviceModel.id'), nullable=False)
-    df_id = db.Column(db.Integer, db.ForeignKey('deviceFeature.id'), nullable=False)
+    dm_id = db.Column(db.Integer, db.ForeignKey('deviceModel.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
+    df_id = db.Column(db.Integer, db.ForeignKey('deviceFeature.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
     
     deviceFeature = db.relationship('DeviceFeature', back_populates='dm_df')
     deviceModel = db.relationship('DeviceModel', back_populates='dm_df')
@@ -225,11 +251,17 @@ class DeviceParameter(TimestampMixin, db.Model):
     max = db.Column(db.Float, nullable=False, default=0)
     idf_type = db.Column(db.String(20), nullable=False, default='sample')
     
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    df_id = db.Column(db.Integer, db.ForeignKey('deviceFeature.id'), nullable=False)
-    dmdf_id = db.Column(db.Integer, db.ForeignKey('dm_df.id'), nullable=False)
-    unit_id = db.Column(db.Integer, db.ForeignKey('unit.id'), nullable=False, default=0)
-    fn_id = db.Column(db.Integer, db.ForeignKey('function.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    df_id = db.Column(db.Integer, db.ForeignKey('deviceFeature.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
+    dmdf_id = db.Column(db.Integer, db.ForeignKey('dm_df.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+    # A Unit in use can not be deleted
+    unit_id = db.Column(db.Integer, db.ForeignKey('unit.id', ondelete='RESTRICT'),
+                        nullable=False, default=NONE_UNIT_ID, index=True)
+    fn_id = db.Column(db.Integer, db.ForeignKey('function.id', ondelete='SET NULL'),
+                      nullable=True, index=True)
     
     # Do not know why it exists.
     normalization = db.Column(db.Boolean, nullable=False, default=0)
@@ -240,10 +272,112 @@ class DeviceParameter(TimestampMixin, db.Model):
     unit = db.relationship('Unit', back_populates='device_parameters')
     function = db.relationship('Function', back_populates='device_parameters')
     
+    deltas = db.relationship(
+        'DeviceParameterDelta',
+        back_populates='base',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+    
     __table_args__ = (
         CheckConstraint(param_type.in_(['int', 'float', 'boolean', 'void', 'string', 'json']), name='valid_paramtype'),
         CheckConstraint(idf_type.in_(['sample', 'variant']))
     )
+    
+    # The fields a user is allowed to customize, with the type used to compare them.
+    OVERRIDABLE_FIELDS = {
+        'param_type': str,
+        'idf_type': str,
+        'min': float,
+        'max': float,
+        'unit_id': int,
+        'fn_id': int,
+        'normalization': parse_bool,
+    }
+    
+    def delta_from(self, values) -> dict:
+        """
+        Return the overridable fields in `values` that differ from this row.
+        
+        Fields missing from `values` are treated as unchanged.
+        """
+        delta = {}
+        for field, type_ in self.OVERRIDABLE_FIELDS.items():
+            if field not in values:
+                continue
+            value = values[field]
+            if value is not None and value != '':
+                value = type_(value)
+            else:
+                value = None
+            if value != getattr(self, field):
+                delta[field] = value
+        return delta
+
+
+class DeviceParameterDelta(TimestampMixin, db.Model):
+    """
+    Per-user override of a default (user_id = 1) DeviceParameter.
+    
+    Only the customized fields are stored, NULL means "inherit from the base row".
+    A field cleared to NULL by the user is recorded by its flag in `CLEARED_FLAGS`.
+    """
+    __tablename__ = 'deviceParameterDelta'
+    
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    param_type = db.Column(db.String(20), nullable=True)
+    min = db.Column(db.Float, nullable=True)
+    max = db.Column(db.Float, nullable=True)
+    idf_type = db.Column(db.String(20), nullable=True)
+    normalization = db.Column(db.Boolean, nullable=True)
+    min_cleared = db.Column(db.Boolean, nullable=False, default=False)
+    max_cleared = db.Column(db.Boolean, nullable=False, default=False)
+    unit_cleared = db.Column(db.Boolean, nullable=False, default=False)
+    fn_cleared = db.Column(db.Boolean, nullable=False, default=False)
+    
+    base_id = db.Column(db.Integer,
+                        db.ForeignKey('deviceParameter.id', ondelete='CASCADE'),
+                        nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    unit_id = db.Column(db.Integer, db.ForeignKey('unit.id', ondelete='SET NULL'),
+                        nullable=True)
+    fn_id = db.Column(db.Integer, db.ForeignKey('function.id', ondelete='SET NULL'),
+                      nullable=True)
+    
+    base = db.relationship('DeviceParameter', back_populates='deltas')
+    user = db.relationship('User', back_populates='device_parameter_deltas')
+    
+    __table_args__ = (
+        db.UniqueConstraint(base_id, user_id, name='unique_base_user'),
+    )
+    
+    # The fields which can be cleared to NULL, with the column recording it
+    CLEARED_FLAGS = {
+        'min': 'min_cleared',
+        'max': 'max_cleared',
+        'unit_id': 'unit_cleared',
+        'fn_id': 'fn_cleared',
+    }
+    
+    def apply(self, delta: dict):
+        """Replace the stored override by `delta`, see `DeviceParameter.delta_from`."""
+        for field in DeviceParameter.OVERRIDABLE_FIELDS:
+            setattr(self, field, delta.get(field))
+        for field, flag in self.CLEARED_FLAGS.items():
+            setattr(self, flag, field in delta and delta[field] is None)
+
+    def as_delta(self) -> dict:
+        """Return the stored override in the format of `DeviceParameter.delta_from`."""
+        delta = {}
+        for field in DeviceParameter.OVERRIDABLE_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                delta[field] = value
+        for field, flag in self.CLEARED_FLAGS.items():
+            if getattr(self, flag):
+                delta[field] = None
+        return delta
 
 
 class Unit(db.Model):
@@ -255,11 +389,16 @@ class Unit(db.Model):
     device_parameters = db.relationship(
         'DeviceParameter',
         back_populates='unit',
-        cascade='all, delete-orphan',
-        passive_deletes=True
+        passive_deletes='all'
     )
 
 
+# The unit of the parameters without one, their `unit_id` defaults to it
+@event.listens_for(Unit.__table__, 'after_create')
+def create_none_unit(target, connection, **kwargs):
+    connection.execute(target.insert(), [{'id': NONE_UNIT_ID, 'unit_name': 'None'}])
+
+
 class Function(db.Model):
     __tablename__ = 'function'
     
@@ -270,14 +409,17 @@ class Function(db.Model):
     device_parameters = db.relationship(
         'DeviceParameter',
         back_populates='function',
+        passive_deletes=True
     )
     df_modules = db.relationship(
         'DF_Module',
-        back_populates='function'
+        back_populates='function',
+        passive_deletes=True
     )
     mj_modules = db.relationship(
         'MJ_Module',
-        back_populates='function'
+        back_populates='function',
+        passive_deletes=True
     )
 
 
@@ -291,7 +433,8 @@ class Project(db.Model):
     exception = db.Column(db.Text, nullable=True)
     sim = db.Column(db.String(20), nullable=False, default='off')
     
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
     
     user = db.relationship('User', back_populates='projects')
     
@@ -303,8 +446,15 @@ class Project(db.Model):
     device_objects = db.relationship(
         'DeviceObject',
         back_populates='project',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+    netApps = db.relationship(
+        'NetworkApp',
+        backref='project',
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
-    netApps = db.relationship('NetworkApp', backref='project')
     
     def export(self) -> dict:
         return{
@@ -321,10 +471,21 @@ class NetworkApp(db.Model):
     na_name = db.Column(db.String(255), nullable=False)
     idx = db.Column(db.Integer, nullable=False)
     
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'),
+                           nullable=False)
     
-    df_modules = db.relationship('DF_Module', backref='netApps')
-    mj_modules = db.relationship('MJ_Module', backref='netApps')
+    df_modules = db.relationship(
+        'DF_Module',
+        backref='netApps',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
+    mj_modules = db.relationship(
+        'MJ_Module',
+        backref='netApps',
+        cascade='all, delete-orphan',
+        passive_deletes=True
+    )
     
     def export(self) -> dict:
         return {
@@ -346,11 +507,12 @@ class DF_Module(db.Model):
     # Do not know why it exists.
     normalization = db.Column(db.Boolean, nullable=False, default=0)
     
-    netApps_id = db.Column(db.Integer, db.ForeignKey('netApps.id'),
+    netApps_id = db.Column(db.Integer, db.ForeignKey('netApps.id', ondelete='CASCADE'),
                               primary_key=True, autoincrement=False, nullable=False)
-    df_object_id = db.Column(db.Integer, db.ForeignKey('df_object.id'),
+    df_object_id = db.Column(db.Integer, db.ForeignKey('df_object.id', ondelete='CASCADE'),
                              primary_key=True, autoincrement=False, nullable=False)
-    function_id = db.Column(db.Integer, db.ForeignKey('function.id'), nullable=True)
+    function_id = db.Column(db.Integer, db.ForeignKey('function.id', ondelete='SET NULL'),
+                            nullable=True)
     
     df_object = db.relationship('DF_Object', back_populates='df_modules')
     function = db.relationship('Function', back_populates='df_modules')
@@ -373,8 +535,10 @@ class DF_Object(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     name = db.Column(db.String(255), nullable=False)
     
-    df_id = db.Column(db.Integer, db.ForeignKey('deviceFeature.id'), nullable=False)
-    do_id = db.Column(db.Integer, db.ForeignKey('deviceObject.id'), nullable=False)
+    df_id = db.Column(db.Integer, db.ForeignKey('deviceFeature.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
+    do_id = db.Column(db.Integer, db.ForeignKey('deviceObject.id', ondelete='CASCADE'),
+                      nullable=False)
     
     deviceFeature = db.relationship('DeviceFeature', back_populates='df_objects')
     deviceObject = db.relationship('DeviceObject', back_populates='df_objects')
@@ -403,9 +567,12 @@ class DeviceObject(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     idx = db.Column(db.Integer, nullable=False, default=0)
     
-    dm_id = db.Column(db.Integer, db.ForeignKey('deviceModel.id'), nullable=False)
-    p_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
-    d_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=True)
+    dm_id = db.Column(db.Integer, db.ForeignKey('deviceModel.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
+    p_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'),
+                     nullable=False)
+    d_id = db.Column(db.Integer, db.ForeignKey('device.id', ondelete='SET NULL'),
+                     nullable=True, index=True)
     
     deviceModel = db.relationship('DeviceModel', back_populates='device_objects')
     project = db.relationship('Project', back_populates='device_objects')
@@ -438,16 +605,19 @@ class Device(db.Model):
     extra_setup_webpage = db.Column(db.String(255), nullable=False, default='')
     device_webpage = db.Column(db.String(255), nullable=False, default='')
     
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    dm_id = db.Column(db.Integer, db.ForeignKey('deviceModel.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False)
+    dm_id = db.Column(db.Integer, db.ForeignKey('deviceModel.id', ondelete='CASCADE'),
+                      nullable=False, index=True)
     
     user = db.relationship('User', back_populates='devices')
     deviceModel = db.relationship('DeviceModel', back_populates='devices')
     
+    # DeviceObject.d_id is set to NULL by the database when the device is deleted.
     device_objects = db.relationship(
         'DeviceObject',
         back_populates='device',
-        cascade='all, delete-orphan'
+        passive_deletes=True
     )
 
 
@@ -456,10 +626,12 @@ class MJ_Module(db.Model):
     
     param_i = db.Column(db.Integer, primary_key=True, autoincrement=False, nullable=False)
     
-    netApps_id = db.Column(db.Integer, db.ForeignKey('netApps.id'),
+    netApps_id = db.Column(db.Integer, db.ForeignKey('netApps.id', ondelete='CASCADE'),
                               primary_key=True, autoincrement=False, nullable=False)
-    df_object_id = db.Column(db.Integer, db.ForeignKey('df_object.id'), nullable=False)
-    function_id = db.Column(db.Integer, db.ForeignKey('function.id'), nullable=True)
+    df_object_id = db.Column(db.Integer, db.ForeignKey('df_object.id', ondelete='CASCADE'),
+                             nullable=False)
+    function_id = db.Column(db.Integer, db.ForeignKey('function.id', ondelete='SET NULL'),
+                            nullable=True)
     
     df_object = db.relationship('DF_Object', back_populates='mj_modules')
     function = db.relationship('Function', back_populates='mj_modules')
@@ -467,3 +639,65 @@ class MJ_Module(db.Model):
     def export(self) -> dict:
         data = ('param_i', 'df_object_id', 'function.fn_name')
         return self.to_dict(data)
+
+
+class NetworkAppBuild(TimestampMixin, db.Model):
+    """The fingerprint of a NetworkApp deployed by the last restart, see `project`."""
+    __tablename__ = 'netAppBuild'
+    
+    # Not a foreign key, the build of a deleted NetworkApp tells it must be unloaded.
+    # Keyed by the project too, an id reused by the NetworkApp of another project
+    # is not mistaken for the deleted one.
+    p_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'),
+                     primary_key=True, autoincrement=False, nullable=False)
+    na_id = db.Column(db.Integer, primary_key=True, autoincrement=False, nullable=False)
+    fingerprint = db.Column(db.String(40), nullable=False)
+
+
+class GuiClient(TimestampMixin, db.Model):
+    """The user of a GUI MQTT client id, see `gateway.clients`."""
+    __tablename__ = 'guiClient'
+    
+    client_id = db.Column(db.String(64), primary_key=True, nullable=False)
+    # The SHA-256 of the broker password of the client
+    secret_hash = db.Column(db.String(64), nullable=True)
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        nullable=False, index=True)
+
+    __table_args__ = (
+        # The expired clients are swept by it
+        db.Index('ix_guiClient_created_at', 'created_at'),
+    )
+
+
+class SchemaVersion(db.Model):
+    """The version of the schema the database is created with, see `db.schema`."""
+    __tablename__ = 'schemaVersion'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False, nullable=False)
+
+
+class CatalogueVersion(db.Model):
+    """
+    The change token of each in-memory index, see `db.changes`.
+
+    1: the catalogue, `catalogue.graph`
+    2: the dependency index, `dependency.index`
+    3: the reference data registry, `db.refdata`
+    """
+    __tablename__ = 'catalogueVersion'
+
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), nullable=False, default='')
+
+
+@event.listens_for(CatalogueVersion.__table__, 'after_create')
+def create_catalogue_version(target, connection, **kwargs):
+    connection.execute(target.insert(), [{'id': 1, 'token': ''}, {'id': 2, 'token': ''},
+                                         {'id': 3, 'token': ''}])
+
+
+# The full-text search index over the catalogue is created along with the tables.
+from db import fts  # noqa: E402,F401
+from db import refdata  # noqa: E402
@@ -0,0 +1,164 @@
+"""
+In-memory registry of the reference tables: Unit, Function and Group.
+
+The tables are tiny and nearly static, so their id -> name and name -> id maps
+are loaded once at startup and resolved without touching the database:
+
+    registry.units()                   registry.unit_id(unit_name)
+    registry.function_name(fn_id)      registry.function_id(fn_name)
+    registry.group_name(group_id)      registry.group_id(group_name)
+
+A commit which changes any of the tables marks the registry stale, it is loaded
+again on the next lookup. The commit also writes the change token of the
+registry (`db.changes`), the other processes compare it with the one they have
+loaded at most once per `TOKEN_CHECK_INTERVAL` seconds and load the registry
+again if it differs.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from db import db
+from db.changes import ChangeToken
+from db.models import Function, Group, Unit
+
+__all__ = [
+    'ReferenceData',
+    'registry',
+]
+
+logger = logging.getLogger(__name__)
+
+TRACKED_MODELS = (Unit, Function, Group)
+
+# The seconds a process serves the registry before it checks the change token again
+TOKEN_CHECK_INTERVAL = 1.0
+
+
+class _Maps:
+    def __init__(self, rows):
+        self.names = dict(rows)
+        self.ids = {name: id_ for id_, name in rows}
+
+
+class ReferenceData:
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+        self._stale = True
+        self._token = ChangeToken(3)
+        self._checked = 0.0
+        self._units = self._functions = self._groups = _Maps([])
+
+    def init_app(self, app):
+        self._app = app
+        app.extensions['refdata'] = self
+        self.load()
+
+    def load(self):
+        """Load all the reference tables, in one connection."""
+        with self._app.app_context():
+            with db.engine.connect() as connection:
+                token = self._token.stored(connection)
+                units = connection.execute(
+                    select(Unit.__table__.c.id, Unit.__table__.c.unit_name)).all()
+                functions = connection.execute(
+                    select(Function.__table__.c.id, Function.__table__.c.fn_name)).all()
+                groups = connection.execute(
+                    select(Group.__table__.c.id, Group.__table__.c.name)).all()
+
+        # Replace the maps at once, a lookup never sees a half-loaded registry
+        self._units, self._functions, self._groups = \
+            _Maps(units), _Maps(functions), _Maps(groups)
+        self._token.seen = token
+        self._checked = time.monotonic()
+        self._stale = False
+
+    def invalidate(self):
+        self._stale = True
+
+    def reset(self):
+        """Load the registry again on demand, in a forked worker process."""
+        self._lock = threading.Lock()
+        self._stale = True
+
+    def unit_id(self, unit_name):
+        return self._maps('_units').ids.get(unit_name)
+
+    def units(self):
+        """Return all the (id, unit_name) pairs, ordered by id."""
+        return sorted(self._maps('_units').names.items())
+
+    def function_name(self, fn_id):
+        return self._maps('_functions').names.get(fn_id)
+
+    def function_id(self, fn_name):
+        return self._maps('_functions').ids.get(fn_name)
+
+    def functions(self):
+        """Return all the (id, fn_name) pairs, ordered by id."""
+        return sorted(self._maps('_functions').names.items())
+
+    def group_name(self, group_id):
+        return self._maps('_groups').names.get(group_id)
+
+    def group_id(self, group_name):
+        return self._maps('_groups').ids.get(group_name)
+
+    def _maps(self, name):
+        now = time.monotonic()
+        if not self._stale and now - self._checked >= TOKEN_CHECK_INTERVAL:
+            # Another process may have committed a change of the tables
+            self._checked = now
+            if self._token.is_stale(db.session.connection()):
+                self._stale = True
+        if self._stale:
+            with self._lock:
+                if self._stale:
+                    self.load()
+        return getattr(self, name)
+
+
+registry = ReferenceData()
+
+
+def _track_change(session):
+    session.info['refdata_changed'] = True
+    registry._token.write(session, session.connection())
+
+
+# A session which flushed a change of the reference tables writes the change
+# token, and invalidates the registry when it commits.
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_changes(session, flush_context):
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, TRACKED_MODELS):
+            _track_change(session)
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_changes(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE, e.g. `query(Unit).filter(...).delete()`, skip the flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, TRACKED_MODELS):
+        _track_change(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    registry._token.pop(session)
+    if session.info.pop('refdata_changed', False):
+        registry.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('refdata_changed', None)
+    registry._token.pop(session)
@@ -0,0 +1,134 @@
+"""
+Schema version check at startup.
+
+`db.create_all()` inspects every table of the database, which is most of the
+startup time of a worker. The tables are only created when the version stored
+in the database differs from `SCHEMA_VERSION`, otherwise a single SELECT is run.
+"""
+import logging
+
+from sqlalchemy import delete, insert, inspect, select
+from sqlalchemy.exc import DBAPIError
+
+from db import db
+from db import fts
+from db.models import NONE_UNIT_ID, SchemaVersion, Unit
+
+# Use the table, not the model, an ORM query would configure all the mappers
+schema_version = SchemaVersion.__table__
+
+__all__ = [
+    'SCHEMA_VERSION',
+    'ensure_schema',
+]
+
+logger = logging.getLogger(__name__)
+
+# Bump it whenever a table, an index or a trigger is added to the models,
+# so the existing databases get them on the next startup.
+SCHEMA_VERSION = 10
+
+# The tables whose primary key, columns or foreign keys changed at a version,
+# created again along with their rows in the databases of an older version
+REBUILT_TABLES = {
+    7: ('netAppBuild',),
+    8: ('guiClient',),
+    # The ON DELETE rules of the foreign keys
+    9: ('refresh_token', 'access_token', 'deviceFeature', 'dm_df', 'deviceParameter',
+        'deviceParameterDelta', 'project', 'netApps', 'DeviceFeatureModule',
+        'df_object', 'deviceObject', 'device', 'MultipleJoinModule'),
+    # The flags of the min, max and unit cleared by a user
+    10: ('deviceParameterDelta',),
+}
+
+
+def stored_version():
+    """Return the schema version of the database, or None if it is not stored yet."""
+    try:
+        with db.engine.connect() as connection:
+            return connection.execute(select(schema_version.c.version)).scalar()
+    except DBAPIError:
+        # The database is created before the version is stored
+        return None
+
+
+def ensure_schema():
+    """
+    Create the missing tables and indexes if the stored schema version is not current.
+
+    Must be called in an app context, return True if the tables are created.
+    """
+    version = stored_version()
+    if version == SCHEMA_VERSION:
+        return False
+
+    logger.info('Upgrade the database schema from version %s to %s',
+                version, SCHEMA_VERSION)
+    # The tables of a database older than the stored versions are rebuilt too
+    existing = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    with db.engine.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            # Dropping a rebuilt table would delete or refuse the rows referencing
+            # it, the foreign keys are checked once all of them are rebuilt.
+            # The pragma is a no-op in a transaction.
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+        try:
+            with connection.begin():
+                _upgrade(connection, version, existing)
+                if sqlite:
+                    for violation in connection.exec_driver_sql('PRAGMA foreign_key_check'):
+                        logger.warning('Foreign key violation %s', tuple(violation))
+        finally:
+            if sqlite:
+                connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+                connection.commit()
+    return True
+
+
+def _upgrade(connection, version, existing):
+    # `create_all()` skips the existing tables, along with their new indexes
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    rebuilt = []
+    for since, names in REBUILT_TABLES.items():
+        if version is None or version < since:
+            for name in names:
+                # Once for all the versions
+                if name in existing and name not in rebuilt:
+                    _rebuild(connection, db.metadata.tables[name])
+                    rebuilt.append(name)
+    # Dropping a table drops its triggers
+    if rebuilt and fts.install(connection):
+        fts.rebuild(connection)
+    _create_none_unit(connection)
+    connection.execute(delete(schema_version))
+    connection.execute(insert(schema_version).values(version=SCHEMA_VERSION))
+
+
+def _create_none_unit(connection):
+    """The "None" unit of the databases created before it was seeded."""
+    unit = Unit.__table__
+    rows = connection.execute(
+        select(unit.c.id, unit.c.unit_name)
+        .where((unit.c.id == NONE_UNIT_ID) | (unit.c.unit_name == 'None'))).all()
+    if not rows:
+        connection.execute(insert(unit).values(id=NONE_UNIT_ID, unit_name='None'))
+    elif all(row.id != NONE_UNIT_ID for row in rows):
+        logger.warning('The unit "None" has the id %s instead of %s',
+                       rows[0].id, NONE_UNIT_ID)
+
+
+def _rebuild(connection, table):
+    """Create a table again with its rows, SQLite can not alter a primary key."""
+    # The columns of the old table, the new ones get their default
+    names = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    columns = [column for column in table.columns if column.name in names]
+    rows = [dict(row._mapping) for row in connection.execute(select(*columns))]
+    table.drop(connection)
+    table.create(connection)
+    if rows:
+        connection.execute(insert(table), rows)
@@ -0,0 +1,235 @@
+"""
+Slow-query log.
+
+Every statement executed by the engines is timed, one over `threshold_ms` is
+logged with its parameters and the op running it, and aggregated by the shape
+of the statement: the literals and the bound parameter lists of `IN (...)` are
+normalized, so the same query with other values is one entry.
+
+The query plan of a shape (`EXPLAIN QUERY PLAN` on SQLite, `EXPLAIN` on the
+others) is captured once by a background thread on its own connection, the
+statement itself is not run again.
+
+The binary parameters and the strings longer than `PARAM_LENGTH` are not
+logged, they are likely sessions or tokens. The top shapes are listed by
+`/account/slow_queries`.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = [
+    'SlowQueryLog',
+    'current_op',
+    'slow_queries',
+    'statement_shape',
+]
+
+logger = logging.getLogger(__name__)
+
+# The op_* running in the current context, set by `modules.interface`
+current_op = ContextVar('current_op', default=None)
+
+# The shapes kept, the one with the least total time is dropped beyond
+MAX_SHAPES = 1000
+# The statements waiting for their plan, the newer ones are skipped beyond
+EXPLAIN_QUEUE_SIZE = 100
+# The logged string parameters longer than it are replaced by their length
+PARAM_LENGTH = 64
+# The statements which have a plan
+EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+# A parameter in the qmark, format, pyformat or named style
+_PARAM = r'(?:\?|%s|%\(\w+\)s|:\w+)'
+_IN_LIST = re.compile(r'\(\s*{0}(?:\s*,\s*{0})*\s*\)'.format(_PARAM))
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalize a statement, "... IN (?, ?) AND x = 3" is "... IN (?...) AND x = ?"."""
+    shape = _STRING.sub('?', statement)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('(?...)', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def _loggable(parameters):
+    def value(v):
+        if isinstance(v, (bytes, memoryview)):
+            return '<{} of {}>'.format(type(v).__name__, len(v))
+        if isinstance(v, str) and len(v) > PARAM_LENGTH:
+            return '<str of {}>'.format(len(v))
+        return v
+
+    if isinstance(parameters, dict):
+        return {k: value(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [value(v) for v in parameters]
+    return parameters
+
+
+class _Shape:
+    __slots__ = ('shape', 'count', 'total_ms', 'max_ms', 'ops', 'statement',
+                 'parameters', 'plan', 'last_seen')
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.ops = Counter()
+        self.statement = None
+        self.parameters = None
+        self.plan = None
+        self.last_seen = None
+
+    def as_dict(self):
+        return {
+            'shape': self.shape,
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'mean_ms': self.total_ms / self.count,
+            'max_ms': self.max_ms,
+            'ops': dict(self.ops.most_common()),
+            'statement': self.statement,
+            'parameters': self.parameters,
+            'plan': self.plan,
+            'last_seen': self.last_seen,
+        }
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=0):
+        self.threshold_ms = threshold_ms
+
+        self._lock = threading.Lock()
+        self._shapes = {}  # shape -> _Shape
+        self._explain = queue.Queue(EXPLAIN_QUEUE_SIZE)
+        self._thread = None
+
+    def init_app(self, app):
+        self.threshold_ms = float(app.config.get('SLOW_QUERY_MS') or 0)
+        app.extensions['slow_queries'] = self
+
+    @property
+    def enabled(self):
+        return self.threshold_ms > 0
+
+    def record(self, engine, statement, parameters, elapsed_ms, executemany=False):
+        op = current_op.get()
+        shape = statement_shape(statement)
+        if executemany and parameters:
+            parameters = parameters[0]
+        logger.warning('Slow query %.1fms in %s: %s %r', elapsed_ms, op or '-',
+                       ' '.join(statement.split()), _loggable(parameters))
+
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                if len(self._shapes) >= MAX_SHAPES:
+                    least = min(self._shapes.values(), key=lambda e: e.total_ms)
+                    del self._shapes[least.shape]
+                entry = self._shapes[shape] = _Shape(shape)
+            entry.count += 1
+            entry.total_ms += elapsed_ms
+            entry.max_ms = max(entry.max_ms, elapsed_ms)
+            entry.ops[op or '-'] += 1
+            entry.statement = statement
+            entry.parameters = _loggable(parameters)
+            entry.last_seen = time.time()
+            explain = (entry.plan is None
+                       and statement.lstrip().upper().startswith(EXPLAINED))
+            if explain:
+                entry.plan = []  # requested
+
+        if explain:
+            self._request_plan(engine, shape, statement, parameters)
+
+    def top(self, limit=20, order='total_ms'):
+        """Return the shapes with the most `order`, 'total_ms', 'max_ms' or 'count'."""
+        with self._lock:
+            entries = sorted(self._shapes.values(), key=lambda e: getattr(e, order),
+                             reverse=True)
+            return [entry.as_dict() for entry in entries[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+    def _request_plan(self, engine, shape, statement, parameters):
+        self._ensure_thread()
+        try:
+            self._explain.put_nowait((engine, shape, statement, parameters))
+        except queue.Full:
+            with self._lock:
+                entry = self._shapes.get(shape)
+                if entry is not None:
+                    # Ask again the next time it is slow
+                    entry.plan = None
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._explain = queue.Queue(EXPLAIN_QUEUE_SIZE)
+                self._thread = threading.Thread(target=self._run, name='slow-query-explain',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            engine, shape, statement, parameters = self._explain.get()
+            try:
+                plan = self._plan(engine, statement, parameters)
+            except Exception as e:
+                plan = ['EXPLAIN failed: {}'.format(e)]
+            with self._lock:
+                entry = self._shapes.get(shape)
+                if entry is not None:
+                    entry.plan = plan
+
+    @staticmethod
+    def _plan(engine, statement, parameters):
+        sqlite = engine.dialect.name == 'sqlite'
+        prefix = 'EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN '
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+        if not sqlite:
+            return [' '.join(str(v) for v in row) for row in rows]
+
+        # (id, parent, notused, detail), indent the detail by its depth
+        depth = {0: -1}
+        plan = []
+        for id_, parent, _, detail in rows:
+            depth[id_] = depth.get(parent, -1) + 1
+            plan.append('  ' * depth[id_] + detail)
+        return plan
+
+
+slow_queries = SlowQueryLog()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if slow_queries.enabled:
+        context._slow_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_slow_query_start', None)
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1e3
+    if elapsed_ms >= slow_queries.threshold_ms and not statement.startswith('EXPLAIN'):
+        slow_queries.record(conn.engine, statement, parameters, elapsed_ms, executemany)
@@ -0,0 +1,5 @@
+from .index import dependencies
+
+__all__ = [
+    'dependencies',
+]
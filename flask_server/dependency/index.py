@@ -0,0 +1,367 @@
+"""
+Dependency index of the projects.
+
+The rows of the project tables are kept in memory as "used by" edges between
+nodes, a node is a `(kind, id)` pair:
+
+    dm  -> do     DeviceObject.dm_id          do  -> p      DeviceObject.p_id
+    d   -> do     DeviceObject.d_id           do  -> dfo    DF_Object.do_id
+    df  -> dfo    DF_Object.df_id             dfo -> na     DF_Module/MJ_Module.df_object_id
+    fn  -> na     DF_Module/MJ_Module.function_id
+    na  -> p      NetworkApp.project_id
+
+So everything affected by a change of a node is reachable from it. The edges
+are kept per row, with the nodes whose deletion cascades to the row, so a row
+deleted by `ON DELETE CASCADE` in the database is removed from the index too.
+
+The rows flushed or bulk changed by a transaction are tracked by session events
+and loaded again after the commit, the keys of the rows a bulk UPDATE or DELETE
+is about to change are selected by its WHERE clause beforehand. The commits of
+the other processes are detected by a change token, see `db.changes`, as are
+the changes which can not be told apart, e.g. a bulk INSERT or the deletion of
+a user: the whole index is loaded again on its next read then, not in the commit.
+The statements written as raw SQL are not tracked.
+"""
+import logging
+import threading
+from collections import Counter, defaultdict, deque
+
+from sqlalchemy import and_, event, or_, select
+from sqlalchemy.orm import Session
+
+from db import db
+from db.changes import ChangeToken
+from db.models import (Device, DeviceFeature, DeviceModel, DeviceObject, DF_Module,
+                       DF_Object, Function, MJ_Module, NetworkApp, Project, User)
+
+__all__ = [
+    'DependencyIndex',
+    'dependencies',
+]
+
+logger = logging.getLogger(__name__)
+
+# The tables of the edges: kind -> (table, key columns, other columns)
+ROW_TABLES = {
+    'na': (NetworkApp.__table__, ('id',), ('project_id',)),
+    'do': (DeviceObject.__table__, ('id',), ('dm_id', 'p_id', 'd_id')),
+    'dfo': (DF_Object.__table__, ('id',), ('df_id', 'do_id')),
+    'dfm': (DF_Module.__table__, ('netApps_id', 'df_object_id', 'param_i'),
+            ('function_id',)),
+    'mjm': (MJ_Module.__table__, ('netApps_id', 'param_i'),
+            ('df_object_id', 'function_id')),
+}
+
+# The models whose rows are edges, and the models which are only nodes
+EDGE_MODELS = {
+    NetworkApp: 'na',
+    DeviceObject: 'do',
+    DF_Object: 'dfo',
+    DF_Module: 'dfm',
+    MJ_Module: 'mjm',
+}
+NODE_MODELS = {
+    Project: 'p',
+    DeviceModel: 'dm',
+    DeviceFeature: 'df',
+    Device: 'd',
+    Function: 'fn',
+}
+
+# The kinds of the nodes which can be queried
+NODE_KINDS = ('dm', 'df', 'd', 'fn', 'p', 'na', 'do', 'dfo')
+
+# The row keys looked up by one statement after a commit
+KEYS_PER_QUERY = 200
+
+
+def _row_key(kind, row):
+    return (kind, *(getattr(row, column) for column in ROW_TABLES[kind][1]))
+
+
+def _edges(kind, row):
+    """Return the (used, user) edges and the owner nodes of a row."""
+    if kind == 'na':
+        return [(('na', row.id), ('p', row.project_id))], [('p', row.project_id)]
+    if kind == 'do':
+        edges = [(('dm', row.dm_id), ('do', row.id)), (('do', row.id), ('p', row.p_id))]
+        if row.d_id is not None:
+            edges.append((('d', row.d_id), ('do', row.id)))
+        return edges, [('p', row.p_id), ('dm', row.dm_id)]
+    if kind == 'dfo':
+        edges = [(('df', row.df_id), ('dfo', row.id)), (('do', row.do_id), ('dfo', row.id))]
+        return edges, [('do', row.do_id), ('df', row.df_id)]
+    if kind in ('dfm', 'mjm'):
+        edges = [(('dfo', row.df_object_id), ('na', row.netApps_id))]
+        if row.function_id is not None:
+            edges.append((('fn', row.function_id), ('na', row.netApps_id)))
+        return edges, [('na', row.netApps_id), ('dfo', row.df_object_id)]
+    return [], []
+
+
+class DependencyIndex:
+    def __init__(self):
+        self._app = None
+        self._lock = threading.RLock()
+        self._token = ChangeToken(2)
+        self._used_by = defaultdict(Counter)  # node -> Counter of the nodes using it
+        self._rows = {}                       # row key -> (edges, owners)
+        self._owned = defaultdict(set)        # node -> row keys deleted along with it
+
+    def init_app(self, app):
+        self._app = app
+        app.extensions['dependencies'] = self
+        with app.app_context(), db.engine.connect() as connection:
+            self.load(connection)
+
+    def load(self, connection):
+        """Load the whole index."""
+        token = self._token.stored(connection)
+        with self._lock:
+            self._used_by = defaultdict(Counter)
+            self._rows = {}
+            self._owned = defaultdict(set)
+            for key, row in self._select_rows(connection):
+                self._set_row(key, *_edges(key[0], row))
+            self._token.seen = token
+
+    def reset(self):
+        """Load the index again on its next read, in a forked worker process."""
+        self._lock = threading.RLock()
+        self._token.seen = None
+
+    def dependents(self, kind, id_):
+        """
+        Return the nodes which depend on a node, directly or not.
+
+        :return: {<kind>: [<id>, ...], ...}
+        """
+        self._sync()
+        result = defaultdict(set)
+        with self._lock:
+            for node in self._reachable_from((kind, id_)):
+                result[node[0]].add(node[1])
+        return {kind: sorted(ids) for kind, ids in result.items()}
+
+    def impact(self, kind, id_):
+        """Return the network apps affected by a change of a node, by project id."""
+        self._sync()
+        with self._lock:
+            network_apps = [node[1] for node in self._reachable_from((kind, id_))
+                            if node[0] == 'na']
+            projects = defaultdict(list)
+            for na_id in sorted(network_apps):
+                for node in self._used_by.get(('na', na_id), ()):
+                    if node[0] == 'p':
+                        projects[node[1]].append(na_id)
+        return dict(projects)
+
+    def is_reachable(self, source, target):
+        """Return True if the `target` node depends on the `source` node."""
+        self._sync()
+        with self._lock:
+            return target in self._reachable_from(source)
+
+    def _reachable_from(self, source):
+        seen = set()
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for user in self._used_by.get(node, ()):
+                if user not in seen:
+                    seen.add(user)
+                    queue.append(user)
+        return seen
+
+    def _sync(self):
+        connection = db.session.connection()
+        if self._token.is_stale(connection):
+            with self._lock:
+                if self._token.is_stale(connection):
+                    self.load(connection)
+
+    def apply(self, connection, keys, deleted_nodes=()):
+        """Load the edge rows touched by a commit again, and remove the deleted nodes."""
+        rows = dict(self._select_rows(connection, keys))
+        with self._lock:
+            for key in keys:
+                if key in rows:
+                    self._set_row(key, *_edges(key[0], rows[key]))
+                else:
+                    self._delete(key)
+            for node in deleted_nodes:
+                self._delete(node)
+
+    def _set_row(self, key, edges, owners):
+        self._remove_row(key)
+        self._rows[key] = (edges, owners)
+        for used, user in edges:
+            self._used_by[used][user] += 1
+        for owner in owners:
+            self._owned[owner].add(key)
+
+    def _remove_row(self, key):
+        edges, owners = self._rows.pop(key, ((), ()))
+        for used, user in edges:
+            users = self._used_by.get(used)
+            if users is not None and users[user] > 0:
+                users[user] -= 1
+                if not users[user]:
+                    del users[user]
+        for owner in owners:
+            self._owned.get(owner, set()).discard(key)
+
+    def _delete(self, key):
+        """Remove a deleted row, and the rows the database deletes along with it."""
+        self._remove_row(key)
+        for child in self._owned.pop(key, ()):
+            self._delete(child)
+        # The references set to NULL by the database, e.g. DeviceObject.d_id
+        self._used_by.pop(key, None)
+
+    @staticmethod
+    def _select_rows(connection, keys=None):
+        """Yield the (row key, row) of the edge tables, or only of `keys`."""
+        wanted = defaultdict(list)
+        for key in keys or ():
+            wanted[key[0]].append(key[1:])
+
+        for kind, (table, key_columns, columns) in ROW_TABLES.items():
+            query = select(*(table.c[column] for column in key_columns + columns))
+            if keys is None:
+                queries = [query]
+            else:
+                # A few statements, SQLite limits the depth of an expression
+                key_columns = [table.c[column] for column in key_columns]
+                queries = [
+                    query.where(or_(*(and_(*(column == value for column, value
+                                             in zip(key_columns, key)))
+                                      for key in chunk)))
+                    for chunk in _chunks(wanted[kind], KEYS_PER_QUERY)
+                ]
+            for query in queries:
+                for row in connection.execute(query):
+                    yield _row_key(kind, row), row
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+dependencies = DependencyIndex()
+
+
+def _pending(session):
+    return session.info.setdefault('dependencies',
+                                   {'keys': set(), 'nodes': set(), 'full': False})
+
+
+def _write_token(session, connection):
+    if not dependencies._token.write(session, connection):
+        _pending(session)['full'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flushed_changes(session, flush_context):
+    touched = False
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        model = type(instance)
+        if model in EDGE_MODELS:
+            _pending(session)['keys'].add(_row_key(EDGE_MODELS[model], instance))
+            touched = True
+        elif instance in session.deleted:
+            if model in NODE_MODELS:
+                _pending(session)['nodes'].add((NODE_MODELS[model], instance.id))
+                touched = True
+            elif isinstance(instance, User):
+                # The projects of the user are deleted by the database
+                _pending(session)['full'] = touched = True
+
+    if touched:
+        _write_token(session, session.connection())
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+
+    model = mapper.class_
+    deletes_nodes = model in NODE_MODELS or issubclass(model, User)
+    if model not in EDGE_MODELS and not (orm_execute_state.is_delete and deletes_nodes):
+        return
+
+    session = orm_execute_state.session
+    keys = _affected_keys(orm_execute_state, model)
+    if keys is None:
+        # The statement may change any rows, load the whole index again
+        _pending(session)['full'] = True
+    elif not keys:
+        return
+    elif model in EDGE_MODELS:
+        _pending(session)['keys'].update(keys)
+    else:
+        _pending(session)['nodes'].update(keys)
+    _write_token(session, session.connection())
+
+
+def _affected_keys(orm_execute_state, model):
+    """
+    Select the keys of the rows a bulk UPDATE or DELETE is about to change.
+
+    Return None if they can not be told: an INSERT, an UPDATE by a list of
+    parameters or of a table keyed by other columns than its id, a statement
+    without WHERE clause, and the deletion of a user.
+    """
+    statement = orm_execute_state.statement
+    whereclause = getattr(statement, 'whereclause', None)
+    if whereclause is None or orm_execute_state.is_insert or issubclass(model, User):
+        return None
+
+    if model in EDGE_MODELS:
+        kind = EDGE_MODELS[model]
+        table, key_columns, _ = ROW_TABLES[kind]
+        # The id of a row is never updated, the columns of a composite key may be
+        if orm_execute_state.is_update and key_columns != ('id',):
+            return None
+    else:
+        kind, table, key_columns = NODE_MODELS[model], model.__table__, ('id',)
+    if orm_execute_state.is_update and orm_execute_state.parameters:
+        return None
+
+    # Run on the connection, the session would call this event again
+    query = select(*(table.c[column] for column in key_columns)).where(whereclause)
+    connection = orm_execute_state.session.connection()
+    return {(kind, *row) for row in connection.execute(query)}
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_after_commit(session):
+    pending = session.info.pop('dependencies', None)
+    token = dependencies._token.pop(session)
+    if pending is None or dependencies._app is None:
+        return
+
+    if pending['full']:
+        # Loaded on the next read, the commit does not wait for it
+        dependencies._token.seen = None
+        return
+
+    try:
+        with db.engine.connect() as connection:
+            dependencies.apply(connection, pending['keys'], pending['nodes'])
+            dependencies._token.seen = token
+    except Exception:
+        logger.exception('Update the dependency index failed, '
+                         'it is loaded again on the next read')
+        dependencies._token.seen = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('dependencies', None)
+    dependencies._token.pop(session)
@@ -0,0 +1,8 @@
+from .clients import ClientRegistry, DbClientRegistry
+from .gateway import OpGateway
+
+__all__ = [
+    'ClientRegistry',
+    'DbClientRegistry',
+    'OpGateway',
+]
@@ -0,0 +1,174 @@
+"""
+Benchmark of the gateway with simulated GUI clients, run it with `flask bench-gateway`.
+
+`bench_scaling` runs the members of a shared subscription group in their own
+processes. Each one gets the clients whose topic hashes to it, as a broker with
+the `hash_topic` strategy would deliver them, and the broker itself is left out.
+"""
+import asyncio
+import json
+import multiprocessing
+import time
+import uuid
+
+from gateway.gateway import OpGateway, REQUEST_TOPIC, RESPONSE_TOPIC
+from gateway.local import MemoryBroker, share_member
+from modules.replay import replay_cache
+from modules.timing import op_timings
+
+__all__ = [
+    'bench_gateway',
+    'bench_scaling',
+]
+
+SHARE_GROUP = 'bench'
+
+
+def _percentile_ms(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1e3 if values else 0.0
+
+
+async def _gui(broker, client_id, op, requests, latencies, duplicates=0):
+    """
+    Publish `requests` requests one after another, like the GUI does, each one
+    delivered `duplicates` more times, like a retry after a lost response.
+    """
+    async with broker.client(client_id) as client:
+        await client.subscribe(RESPONSE_TOPIC.format(client_id))
+        messages = client.messages()
+        for _ in range(requests):
+            flag = str(uuid.uuid4())
+            start = time.perf_counter()
+            request = json.dumps({'op': op, 'flag': flag, 'data': {},
+                                  'req_timestamp': time.time() * 1e3})
+            for _ in range(1 + duplicates):
+                await client.publish(REQUEST_TOPIC.format(client_id), request)
+            responses = 0
+            while responses <= duplicates:
+                _, payload = await messages.__anext__()
+                if json.loads(payload).get('flag') == flag:
+                    responses += 1
+            latencies.append(time.perf_counter() - start)
+
+
+async def _flood(broker, client_id, op, requests):
+    """Publish all the requests at once, without waiting for the responses."""
+    async with broker.client(client_id) as client:
+        for _ in range(requests):
+            await client.publish(REQUEST_TOPIC.format(client_id),
+                                 json.dumps({'op': op, 'flag': str(uuid.uuid4())}))
+
+
+async def _bench(app, client_ids, requests, workers, flood, op, members=1,
+                 duplicates=0):
+    broker = MemoryBroker()
+    gateways = []
+    for i in range(members):
+        gateway_client = broker.client('gateway-{}'.format(i))
+        await gateway_client.__aenter__()
+        gateway = OpGateway(app, gateway_client, workers=workers,
+                            share_group=SHARE_GROUP if members > 1 else None)
+        for client_id in client_ids:
+            gateway.clients.bind(client_id, 1)
+        gateway.clients.bind('flood', 1)
+        gateways.append(gateway)
+    servers = [asyncio.create_task(gateway.run()) for gateway in gateways]
+    await asyncio.sleep(0)
+
+    latencies = []
+    start = time.perf_counter()
+    if flood:
+        await _flood(broker, 'flood', op, flood)
+    await asyncio.gather(*(_gui(broker, client_id, op, requests, latencies, duplicates)
+                           for client_id in client_ids))
+    elapsed = time.perf_counter() - start
+
+    for server in servers:
+        server.cancel()
+    metrics = {}
+    for gateway in gateways:
+        for name, value in gateway.metrics.items():
+            metrics[name] = metrics.get(name, 0) + value
+    return {
+        'clients': len(client_ids),
+        'requests': len(client_ids) * requests,
+        'elapsed': elapsed,
+        'throughput': len(client_ids) * requests / elapsed,
+        'p50_ms': _percentile_ms(latencies, .5),
+        'p99_ms': _percentile_ms(latencies, .99),
+        'metrics': metrics,
+        'replay': replay_cache.metrics(),
+        'timings': op_timings.snapshot().get(op, {}),
+    }
+
+
+def _client_ids(clients):
+    return ['gui-{}'.format(i) for i in range(clients)]
+
+
+def bench_gateway(app, clients=2000, requests=5, workers=8, flood=0,
+                  op='get_function_list', members=1, duplicates=0):
+    """
+    Run `clients` GUI clients, each sending `requests` requests one at a time,
+    while a flooding client publishes `flood` requests at once.
+
+    :param members: the gateways of a shared subscription group in the process
+    :param duplicates: the extra deliveries of every request
+    :return: {'clients', 'requests', 'elapsed', 'throughput', 'p50_ms', 'p99_ms',
+              'metrics', 'replay', 'timings'}
+    """
+    return asyncio.run(_bench(app, _client_ids(clients), requests, workers, flood, op,
+                              members, duplicates))
+
+
+def _member(index, members, clients, requests, workers, op, barrier, results):
+    """Run a member of the group in a spawned process."""
+    from server import create_app
+
+    app = create_app()
+    client_ids = [client_id for client_id in _client_ids(clients)
+                  if share_member(REQUEST_TOPIC.format(client_id), members) == index]
+    barrier.wait()
+    start = time.time()
+    result = asyncio.run(_bench(app, client_ids, requests, workers, 0, op))
+    result.update(start=start, end=time.time())
+    results.put(result)
+
+
+def bench_scaling(processes=(1, 2, 4), clients=2000, requests=5, workers=8,
+                  op='get_function_list'):
+    """
+    Run the same load on 1, 2, 4, ... gateway processes.
+
+    :return: [{'processes', 'requests', 'elapsed', 'throughput', 'p50_ms',
+               'p99_ms'}, ...], the percentiles are the worst of the processes
+    """
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for n in processes:
+        barrier = context.Barrier(n)
+        results = context.Queue()
+        members = [context.Process(target=_member,
+                                   args=(i, n, clients, requests, workers, op,
+                                         barrier, results))
+                   for i in range(n)]
+        for member in members:
+            member.start()
+        parts = [results.get() for _ in members]
+        for member in members:
+            member.join()
+
+        total = sum(part['requests'] for part in parts)
+        # From the first process started to the last one done, they may not overlap
+        elapsed = (max(part['end'] for part in parts)
+                   - min(part['start'] for part in parts))
+        rows.append({
+            'processes': n,
+            'requests': total,
+            'elapsed': elapsed,
+            'throughput': total / elapsed,
+            'p50_ms': max(part['p50_ms'] for part in parts),
+            'p99_ms': max(part['p99_ms'] for part in parts),
+        })
+    return rows
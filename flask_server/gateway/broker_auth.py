@@ -0,0 +1,48 @@
+"""
+Authentication and authorization of the GUI clients by the MQTT broker.
+
+The GUI connects to the broker with its client id as username and the secret
+given by `/mqtt_url` as password, the broker asks the server through its HTTP
+hooks, e.g. with EMQX:
+
+    POST /mqtt/auth  {"clientid": "${clientid}", "username": "${username}",
+                      "password": "${password}"}
+    POST /mqtt/acl   {"clientid": "${clientid}", "username": "${username}",
+                      "topic": "${topic}", "action": "${action}"}
+
+and both answer {"result": "allow" | "deny" | "ignore"}. A GUI client may only
+publish to its request topic and subscribe to its response topic. The other
+usernames, e.g. the account of the gateway, are ignored and left to the other
+authenticators of the broker, the credentials of the gateway are never given
+to a browser.
+"""
+from gateway.gateway import REQUEST_TOPIC, RESPONSE_TOPIC
+
+__all__ = [
+    'authenticate',
+    'authorize',
+]
+
+ALLOW = 'allow'
+DENY = 'deny'
+IGNORE = 'ignore'
+
+
+def authenticate(clients, clientid, username, password):
+    """Return the result of a connection of `clientid` with the credentials."""
+    if clients.user_id(username) is None:
+        return IGNORE
+    if clientid != username or clients.authenticate(username, password) is None:
+        return DENY
+    return ALLOW
+
+
+def authorize(clients, username, topic, action):
+    """Return the result of a publish or subscribe of `topic` by `username`."""
+    if clients.user_id(username) is None:
+        return IGNORE
+    if action == 'publish' and topic == REQUEST_TOPIC.format(username):
+        return ALLOW
+    if action == 'subscribe' and topic == RESPONSE_TOPIC.format(username):
+        return ALLOW
+    return DENY
@@ -0,0 +1,170 @@
+"""
+The user of each GUI MQTT client id.
+
+The GUI gets its client id from `/mqtt_url`, which binds it to the logged in
+user. With several gateway processes behind a shared subscription any of them
+may receive the requests of a client, so the binding is stored in the
+`guiClient` table, `ClientRegistry` keeps it in memory for a single process.
+
+Along with the client id the GUI gets a secret, its password on the broker,
+see `gateway.broker_auth`. Only the hash of the secret is stored.
+
+A client id expires `expire` seconds after it is bound, the ones of the GUIs
+closed without a detach are swept by the next binds.
+"""
+import datetime
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, insert, select
+
+from db.models import GuiClient
+from modules.utils import Context
+
+__all__ = [
+    'ClientRegistry',
+    'DbClientRegistry',
+    'build_context',
+]
+
+C = GuiClient.__table__
+
+# The client ids whose user is kept by each process
+CACHE_SIZE = 4096
+# The seconds a process trusts a cached user, an unbound client is served as long
+CACHE_TTL = 60
+# The seconds a client id stays bound, unless the GUI detaches it before
+CLIENT_EXPIRE = 86400
+# The seconds between two sweeps of the expired client ids by a process
+SWEEP_INTERVAL = 300
+
+
+def secret_hash(secret):
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def _matches(stored_hash, secret):
+    return (stored_hash is not None and secret is not None
+            and hmac.compare_digest(stored_hash, secret_hash(secret)))
+
+
+class ClientRegistry:
+    """In memory, for a single gateway process and the benchmarks."""
+
+    def __init__(self):
+        self._users = {}
+        self._secrets = {}  # client_id -> secret hash
+
+    def bind(self, client_id, u_id, secret=None):
+        self._users[client_id] = u_id
+        self._secrets[client_id] = secret_hash(secret) if secret is not None else None
+
+    def unbind(self, client_id):
+        self._users.pop(client_id, None)
+        self._secrets.pop(client_id, None)
+
+    def user_id(self, client_id):
+        return self._users.get(client_id)
+
+    def authenticate(self, client_id, secret):
+        """Return the user of the client id if `secret` is its secret, otherwise None."""
+        if _matches(self._secrets.get(client_id), secret):
+            return self._users.get(client_id)
+        return None
+
+
+class DbClientRegistry:
+    """
+    In the `guiClient` table, shared by the gateway processes.
+
+    The methods must be called in an app context, the users found are cached
+    for `ttl` seconds with LRU eviction.
+
+    :param expire: the seconds a client id stays bound
+    """
+
+    def __init__(self, db, size=CACHE_SIZE, ttl=CACHE_TTL, expire=CLIENT_EXPIRE):
+        self.db = db
+        self.size = size
+        self.ttl = ttl
+        self.expire = expire
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # client_id -> (u_id, expires)
+        self._swept = None
+
+    def bind(self, client_id, u_id, secret=None):
+        with self.db.engine.begin() as connection:
+            self._sweep(connection)
+            connection.execute(delete(C).where(C.c.client_id == client_id))
+            connection.execute(insert(C).values(
+                client_id=client_id, user_id=u_id,
+                secret_hash=secret_hash(secret) if secret is not None else None))
+        self._put(client_id, u_id)
+
+    def unbind(self, client_id):
+        with self.db.engine.begin() as connection:
+            connection.execute(delete(C).where(C.c.client_id == client_id))
+        with self._lock:
+            self._cache.pop(client_id, None)
+
+    def user_id(self, client_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(client_id)
+            if cached is not None and cached[1] > now:
+                self._cache.move_to_end(client_id)
+                return cached[0]
+
+        with self.db.engine.connect() as connection:
+            u_id = connection.execute(select(C.c.user_id)
+                                      .where(C.c.client_id == client_id,
+                                             C.c.created_at >= self._cutoff())).scalar()
+        if u_id is not None:
+            self._put(client_id, u_id)
+        return u_id
+
+    def authenticate(self, client_id, secret):
+        """Return the user of the client id if `secret` is its secret, otherwise None."""
+        with self.db.engine.connect() as connection:
+            row = connection.execute(select(C.c.user_id, C.c.secret_hash)
+                                     .where(C.c.client_id == client_id,
+                                            C.c.created_at >= self._cutoff())).first()
+        if row is None or not _matches(row.secret_hash, secret):
+            return None
+        return row.user_id
+
+    def _cutoff(self):
+        return (datetime.datetime.now(datetime.timezone.utc)
+                - datetime.timedelta(seconds=self.expire))
+
+    def _sweep(self, connection):
+        """Delete the expired client ids, once every `SWEEP_INTERVAL` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if self._swept is not None and now - self._swept < SWEEP_INTERVAL:
+                return
+            self._swept = now
+        connection.execute(delete(C).where(C.c.created_at < self._cutoff()))
+
+    def _put(self, client_id, u_id):
+        with self._lock:
+            self._cache[client_id] = (u_id, time.monotonic() + self.ttl)
+            self._cache.move_to_end(client_id)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+
+
+def build_context(clients, client_id, session):
+    """
+    Return the Context of a request of `client_id`, None if the client is not bound.
+
+    Every gateway process builds it the same way, whichever receives the request.
+    """
+    u_id = clients.user_id(client_id)
+    if u_id is None:
+        return None
+    return Context(u_id, session, client_id)
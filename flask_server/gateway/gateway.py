@@ -0,0 +1,320 @@
+"""
+Asyncio gateway between the GUI MQTT topics and the ops.
+
+The GUI (`static/mqtt.js`) publishes a request to `iottalk/api/gui/req/<id>`:
+
+    {'op': <op name>, 'flag': <uuid>, 'data': {<op arguments>}, ...}
+
+and expects the response on `iottalk/api/gui/res/<id>`:
+
+    {'op': <op name>, 'flag': <uuid>, 'state': 'ok', 'data': <op result>}
+    {'op': <op name>, 'flag': <uuid>, 'state': 'error', 'msg': <message>}
+
+An announcement is a message with `'op': 'anno'`, an 'Authentication Fail'
+one sends the GUI back to the login page.
+
+The requests of every client are queued in their own FIFO, the workers take
+the clients round-robin, so a client flooding requests does not delay the
+other ones, and the requests of a client run one at a time, in order. The
+ops run in a bounded thread pool, each one in its own app context.
+
+Backpressure: when `max_pending` requests are queued, the gateway stops
+reading from the broker until a request is done; a client with
+`max_pending_per_client` queued requests gets a 'Server busy' error.
+
+Timing: a response to an op carries the milliseconds spent on the way,
+
+    'timing': {'transit_ms', 'queue_ms', 'op_ms', 'db_ms', 'encode_ms'}
+
+and they are aggregated per op with the publish time, see `modules.timing`.
+The result is encoded in the worker thread, not in the event loop.
+
+Scaling out: the gateway processes given the same `share_group` join the MQTT
+v5 shared subscription `$share/<group>/iottalk/api/gui/req/+`, and the broker
+delivers each request to one of them. The requests of a client only run in
+order if the broker routes a topic to the same member, e.g. EMQX with
+`broker.shared_subscription_strategy = hash_topic`; with round robin (e.g.
+Mosquitto) the requests of a client may run at the same time in different
+processes. The users of the clients are read from the `guiClient` table, see
+`gateway.clients`.
+"""
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from db import db
+from gateway.clients import ClientRegistry, build_context
+from modules.dispatch import OPS, call_op
+from modules.timing import db_timer, op_timings
+from modules.utils import CCMError, ComplexEncoder
+from tracing import tracer
+
+__all__ = [
+    'OpGateway',
+    'REQUEST_TOPIC',
+    'RESPONSE_TOPIC',
+    'request_filter',
+]
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TOPIC = 'iottalk/api/gui/req/{}'
+RESPONSE_TOPIC = 'iottalk/api/gui/res/{}'
+
+# The ops handled by the gateway itself
+ATTACH = 'attach'
+DETACH = 'detach'
+ANNO = 'anno'
+
+
+# The error of a request of a client without user
+AUTH_FAIL = object()
+
+
+def _encode(timing, result):
+    """Encode the result of an op to JSON, the time is added to `timing`."""
+    start = time.perf_counter()
+    encoded = json.dumps(result, cls=ComplexEncoder)
+    timing['encode_ms'] = (time.perf_counter() - start) * 1e3
+    return encoded
+
+
+def request_filter(share_group=None):
+    """The topic filter of the requests, shared by the processes of `share_group`."""
+    topic_filter = REQUEST_TOPIC.format('+')
+    if share_group:
+        return '$share/{}/{}'.format(share_group, topic_filter)
+    return topic_filter
+
+
+class _Request:
+    __slots__ = ('envelope', 'queued', 'timing')
+
+    def __init__(self, envelope, timing):
+        self.envelope = envelope
+        self.queued = time.perf_counter()
+        self.timing = timing
+
+
+class _Client:
+    __slots__ = ('client_id', 'queue', 'scheduled')
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.queue = deque()
+        # The client is in the ready queue or one of its requests is running
+        self.scheduled = False
+
+
+class OpGateway:
+    """
+    :param app: the Flask app, the ops run in its app context
+    :param transport: `gateway.transport.MqttTransport` or a `MemoryBroker` client
+    :param clients: resolves the user id of a client id, `ClientRegistry` by default,
+                    `DbClientRegistry` when several processes share the requests
+    :param workers: the number of ops run at the same time
+    :param share_group: the shared subscription group of the gateway processes
+    """
+
+    def __init__(self, app, transport, clients=None, workers=8, max_pending=1024,
+                 max_pending_per_client=16, share_group=None):
+        self.app = app
+        self.transport = transport
+        self.clients = clients if clients is not None else ClientRegistry()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_client = max_pending_per_client
+        self.request_filter = request_filter(share_group)
+
+        self.metrics = {
+            'received': 0,
+            'completed': 0,
+            'errors': 0,
+            'rejected': 0,
+            'malformed': 0,
+            'paused': 0,
+        }
+
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='gateway')
+        self._queues = {}  # client_id -> _Client
+        self._ready = None
+        self._pending = 0
+        self._space = None
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def run(self):
+        """Subscribe to the request topics and serve until cancelled."""
+        self._ready = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._space.set()
+
+        await self.transport.subscribe(self.request_filter)
+        tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            async for topic, payload in self.transport.messages():
+                await self.receive(topic, payload)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def receive(self, topic, payload):
+        """Decode a request and queue it, wait while the gateway is full."""
+        client_id = topic.rsplit('/', 1)[-1]
+        try:
+            envelope = json.loads(payload)
+            if not isinstance(envelope, dict) or not isinstance(envelope.get('op'), str):
+                raise ValueError('no op')
+        except ValueError:
+            self.metrics['malformed'] += 1
+            logger.warning('Malformed request from %s', client_id)
+            return
+        self.metrics['received'] += 1
+        timing = {}
+        sent = envelope.get('req_timestamp')
+        if isinstance(sent, (int, float)):
+            timing['transit_ms'] = time.time() * 1e3 - sent
+
+        client = self._queues.get(client_id)
+        if client is None:
+            client = self._queues[client_id] = _Client(client_id)
+        if len(client.queue) >= self.max_pending_per_client:
+            self.metrics['rejected'] += 1
+            await self.respond(client_id, envelope, error='Server busy, try again later')
+            return
+
+        while self._pending >= self.max_pending:
+            # Stop reading from the broker, it buffers or drops for us
+            self.metrics['paused'] += 1
+            self._space.clear()
+            await self._space.wait()
+
+        # Forgotten while waiting if it was idle, or made again by a later request
+        client = self._queues.setdefault(client_id, client)
+        client.queue.append(_Request(envelope, timing))
+        self._pending += 1
+        if not client.scheduled:
+            client.scheduled = True
+            self._ready.put_nowait(client)
+
+    async def respond(self, client_id, envelope, data=None, error=None, timing=None,
+                      encoded=None):
+        """
+        :param timing: the 'timing' of the response
+        :param encoded: `data` already encoded to JSON
+        """
+        message = {'op': envelope.get('op'), 'flag': envelope.get('flag')}
+        if error is None:
+            message['state'] = 'ok'
+            if encoded is None:
+                message['data'] = data
+        else:
+            message.update(state='error', msg=error)
+        if timing is not None:
+            message['timing'] = timing
+
+        payload = json.dumps(message, cls=ComplexEncoder)
+        if error is None and encoded is not None:
+            payload = '{}, "data": {}}}'.format(payload[:-1], encoded)
+        await self.transport.publish(RESPONSE_TOPIC.format(client_id), payload)
+
+    async def announce(self, client_id, **fields):
+        """Send an announcement, e.g. `announce(client_id, state='Authentication Fail')`."""
+        await self.transport.publish(RESPONSE_TOPIC.format(client_id),
+                                     json.dumps({'op': ANNO, **fields}))
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            client = await self._ready.get()
+            request = client.queue.popleft()
+            request.timing['queue_ms'] = (time.perf_counter() - request.queued) * 1e3
+            try:
+                await self._handle(loop, client.client_id, request)
+            except Exception:
+                logger.exception('Handle %s of %s failed', request.envelope.get('op'),
+                                 client.client_id)
+            finally:
+                self._pending -= 1
+                self._space.set()
+                if client.queue:
+                    # Back to the end of the line, after the other clients
+                    self._ready.put_nowait(client)
+                else:
+                    client.scheduled = False
+                    # An idle client is forgotten, the next request makes a new one
+                    if self._queues.get(client.client_id) is client:
+                        del self._queues[client.client_id]
+
+    async def _handle(self, loop, client_id, request):
+        envelope = request.envelope
+        encoded, error = await loop.run_in_executor(
+            self._executor, self._call, client_id, envelope, request.timing)
+        if error is AUTH_FAIL:
+            await self.announce(client_id, state='Authentication Fail')
+            return
+        if envelope['op'] == DETACH:
+            # The client is gone, its later requests are a new client
+            self._queues.pop(client_id, None)
+            return
+
+        if error is None:
+            self.metrics['completed'] += 1
+        else:
+            self.metrics['errors'] += 1
+        timing = {name: round(ms, 3) for name, ms in request.timing.items()}
+        start = time.perf_counter()
+        await self.respond(client_id, envelope, error=error, timing=timing,
+                           encoded=encoded)
+        request.timing['publish_ms'] = (time.perf_counter() - start) * 1e3
+        if envelope['op'] in OPS:
+            # Not the made up op names, they would grow the histograms without bound
+            op_timings.record(envelope['op'], request.timing)
+
+    def _call(self, client_id, envelope, timing):
+        """
+        Run a request in a worker thread, return (result encoded to JSON, error message).
+
+        The op, SQL and encoding times are added to `timing`.
+        """
+        op = envelope['op']
+        with self.app.app_context(), tracer.span('MQTT ' + op, kind='server',
+                                                 client_id=client_id):
+            ctx = build_context(self.clients, client_id, db.session)
+            if ctx is None:
+                return None, (None if op == DETACH else AUTH_FAIL)
+            if op == ATTACH:
+                return 'null', None
+            if op == DETACH:
+                self.clients.unbind(client_id)
+                return None, None
+
+            start = time.perf_counter()
+            db_timer.start()
+            try:
+                encoded = call_op(ctx, op, envelope.get('data') or {},
+                                  flag=envelope.get('flag'),
+                                  encode=functools.partial(_encode, timing))
+            except CCMError as e:
+                return None, e.msg
+            except TypeError as e:
+                # Missing or unknown arguments of the op
+                return None, str(e)
+            except Exception:
+                logger.exception('Op %s failed', op)
+                return None, 'Internal server error'
+            finally:
+                timing['db_ms'] = db_timer.stop()
+                timing['op_ms'] = ((time.perf_counter() - start) * 1e3
+                                   - timing.get('encode_ms', 0.0))
+
+        # A replayed response is not encoded again
+        timing.setdefault('encode_ms', 0.0)
+        return encoded, None
@@ -0,0 +1,99 @@
+"""
+In-process stand-in of the MQTT broker, for the tests and the benchmarks.
+
+    broker = MemoryBroker()
+    async with broker.client('gui-1') as client:
+        await client.subscribe('iottalk/api/gui/res/gui-1')
+        await client.publish('iottalk/api/gui/req/gui-1', payload)
+        async for topic, payload in client.messages():
+            ...
+
+A client has the same methods as `gateway.transport.MqttTransport`.
+
+A shared subscription `$share/<group>/<filter>` delivers each message to one
+member of the group, chosen by the hash of the topic like the `hash_topic`
+strategy of EMQX, so the messages of a topic always go to the same member.
+"""
+import asyncio
+import zlib
+
+__all__ = [
+    'MemoryBroker',
+    'share_member',
+    'topic_matches',
+]
+
+SHARE_PREFIX = '$share/'
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT topic matching, with the '+' and '#' wildcards."""
+    filter_levels = topic_filter.split('/')
+    levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(levels) or (level != '+' and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+def share_member(topic, members):
+    """The index of the member of a shared subscription which receives `topic`."""
+    return zlib.crc32(topic.encode()) % members
+
+
+def _parse_filter(topic_filter):
+    """Return (share group or None, topic filter)."""
+    if topic_filter.startswith(SHARE_PREFIX):
+        group, topic_filter = topic_filter[len(SHARE_PREFIX):].split('/', 1)
+        return group, topic_filter
+    return None, topic_filter
+
+
+class _MemoryClient:
+    def __init__(self, broker, client_id):
+        self.client_id = client_id
+        self.filters = []
+        self.queue = asyncio.Queue()
+        self._broker = broker
+
+    async def __aenter__(self):
+        self._broker.clients.append(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._broker.clients.remove(self)
+
+    async def subscribe(self, topic_filter):
+        self.filters.append(_parse_filter(topic_filter))
+
+    async def publish(self, topic, payload):
+        await self._broker.publish(topic, payload)
+
+    async def messages(self):
+        while True:
+            yield await self.queue.get()
+
+
+class MemoryBroker:
+    def __init__(self):
+        self.clients = []
+        self.published = 0
+
+    def client(self, client_id=None):
+        return _MemoryClient(self, client_id)
+
+    async def publish(self, topic, payload):
+        self.published += 1
+        groups = {}  # (group, filter) -> [member client, ...]
+        for client in list(self.clients):
+            for group, topic_filter in client.filters:
+                if not topic_matches(topic_filter, topic):
+                    continue
+                if group is None:
+                    client.queue.put_nowait((topic, payload))
+                    break
+                groups.setdefault((group, topic_filter), []).append(client)
+        for members in groups.values():
+            members[share_member(topic, len(members))].queue.put_nowait((topic, payload))
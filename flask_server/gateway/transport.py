@@ -0,0 +1,52 @@
+"""
+MQTT transport of the gateway, by aiomqtt.
+
+aiomqtt is imported when a transport is created, the web server does not need it.
+"""
+
+__all__ = [
+    'MqttTransport',
+]
+
+
+class MqttTransport:
+    """
+    An MQTT v5 client with the methods the gateway uses:
+
+        async with MqttTransport(host, port) as transport:
+            await transport.subscribe(topic_filter)
+            await transport.publish(topic, payload)
+            async for topic, payload in transport.messages():
+                ...
+    """
+
+    def __init__(self, host, port=1883, username=None, password=None, client_id=None,
+                 tls=False):
+        import aiomqtt
+        from paho.mqtt.client import MQTTv5
+
+        self._client = aiomqtt.Client(
+            host, port,
+            username=username or None,
+            password=password or None,
+            identifier=client_id,
+            protocol=MQTTv5,
+            tls_params=aiomqtt.TLSParameters() if tls else None,
+        )
+
+    async def __aenter__(self):
+        await self._client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.__aexit__(*exc_info)
+
+    async def subscribe(self, topic_filter):
+        await self._client.subscribe(topic_filter)
+
+    async def publish(self, topic, payload):
+        await self._client.publish(topic, payload)
+
+    async def messages(self):
+        async for message in self._client.messages:
+            yield message.topic.value, message.payload
@@ -0,0 +1,88 @@
+"""
+Dependency Module.
+
+contains:
+
+    op_get_dependents
+    op_get_reachability
+"""
+
+from modules.interface import Interface
+from modules.utils import CCMError
+from dependency import dependencies
+from dependency.index import NODE_KINDS
+
+
+def _node(kind, id_):
+    if kind not in NODE_KINDS:
+        raise CCMError('Invalid node kind "{}", must be one of {}'
+                       .format(kind, ', '.join(NODE_KINDS)))
+    try:
+        return kind, int(id_)
+    except (TypeError, ValueError):
+        raise CCMError('Invalid {} id "{}"'.format(kind, id_))
+
+
+class Dependency(Interface):
+    """Dependency class."""
+
+    def op_get_dependents(self, ctx, kind, id):
+        """
+        Get everything which depends on a node, served from the dependency index.
+
+        A Device Model is used by its DeviceObjects, a Device Feature by its
+        DF_Objects, a DF_Object by the NetworkApps joining it, and so on up to
+        the Projects. `impact` lists the NetworkApps to restart after the node
+        is changed, by Project.
+
+        :param kind: 'dm', 'df', 'd', 'fn', 'p', 'na', 'do' or 'dfo'
+        :param id: <DeviceModel.id>, <DeviceFeature.id>, <Device.id>, <Function.id>,
+                   <Project.id>, <NetworkApp.id>, <DeviceObject.id> or <DF_Object.id>
+        :type kind: str
+        :type id: int
+
+        :return:
+            {
+                'p_ids': [<Project.id>, ...],
+                'na_ids': [<NetworkApp.id>, ...],
+                'do_ids': [<DeviceObject.id>, ...],
+                'dfo_ids': [<DF_Object.id>, ...],
+                'impact': [
+                    {
+                        'p_id': <Project.id>,
+                        'na_ids': [<NetworkApp.id>, ...]
+                    }, ...
+                ]
+            }
+        """
+        node = _node(kind, id)
+        dependents = dependencies.dependents(*node)
+        return {
+            'p_ids': dependents.get('p', []),
+            'na_ids': dependents.get('na', []),
+            'do_ids': dependents.get('do', []),
+            'dfo_ids': dependents.get('dfo', []),
+            'impact': [{'p_id': p_id, 'na_ids': na_ids}
+                       for p_id, na_ids in sorted(dependencies.impact(*node).items())],
+        }
+
+    def op_get_reachability(self, ctx, source_kind, source_id, target_kind, target_id):
+        """
+        Check if a node depends on another one, directly or not.
+
+        e.g. does NetworkApp 3 read a feature of Device Model 5:
+        `source_kind='dm', source_id=5, target_kind='na', target_id=3`
+
+        :param source_kind: the kind of the used node, see `op_get_dependents`
+        :param source_id: the id of the used node
+        :param target_kind: the kind of the dependent node
+        :param target_id: the id of the dependent node
+
+        :return:
+            {
+                'reachable': <bool>
+            }
+        """
+        source = _node(source_kind, source_id)
+        target = _node(target_kind, target_id)
+        return {'reachable': dependencies.is_reachable(source, target)}
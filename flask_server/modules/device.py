@@ -0,0 +1,227 @@
+"""
+Device Module.
+
+contains:
+
+    op_register_devices
+    op_delete_devices
+    op_report_device_status
+    op_get_online_devices
+"""
+
+import datetime
+from modules.interface import Interface
+from modules.utils import CCMError
+from presence import presence
+from db import models
+from db import after_commit, db
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Number of devices written by one INSERT statement
+REGISTER_CHUNK_SIZE = 500
+
+# The columns updated when a registered mac_addr registers again by the same user,
+# the device of another user is left untouched and reported as a conflict
+REGISTER_UPDATE_COLUMNS = (
+    'd_name',
+    'status',
+    'monitor',
+    'is_sim',
+    'register_time',
+    'extra_setup_webpage',
+    'device_webpage',
+    'dm_id',
+)
+
+# Dialects supporting INSERT ... ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+class Device(Interface):
+    """Device class."""
+
+    def op_register_devices(self, ctx, devices):
+        """
+        Register or re-register many devices at once.
+
+        A device is identified by its mac_addr, an already registered one is updated.
+        The mac_addr registered by another user are not updated but returned
+        in `conflicts`.
+        Devices are written in chunks by INSERT ... ON CONFLICT DO UPDATE statements
+        in one transaction, so concurrent registrations of the same device do not
+        race on the unique mac_addr.
+
+        :param devices: The devices to register
+        :type devices: List[{
+            'mac_addr': <Device.mac_addr>,
+            'd_name': <Device.d_name>,
+            'dm_name': <DeviceModel.dm_name>,
+            'is_sim': <Device.is_sim>, optional
+            'monitor': <Device.monitor>, optional
+            'extra_setup_webpage': <Device.extra_setup_webpage>, optional
+            'device_webpage': <Device.device_webpage>, optional
+        }]
+
+        :return:
+            {
+                'devices': [
+                    {
+                        'mac_addr': <Device.mac_addr>,
+                        'd_id': <Device.id>,
+                    }, ...
+                ],
+                'conflicts': [<Device.mac_addr of another user>, ...]
+            }
+        """
+        insert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+        if insert is None:
+            raise CCMError('Bulk registration is not supported by "{}"'.format(
+                db.engine.dialect.name))
+
+        if not devices:
+            return {'devices': [], 'conflicts': []}
+
+        # Resolve dm_name -> dm_id once for the whole batch
+        dm_names = {device['dm_name'] for device in devices}
+        dm_ids = dict(db.session.query(models.DeviceModel.dm_name, models.DeviceModel.id)
+                                .filter(models.DeviceModel.dm_name.in_(dm_names)))
+        unknown = dm_names - set(dm_ids)
+        if unknown:
+            raise CCMError('Device Model {} not found'.format(', '.join(sorted(unknown))))
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        rows = {}
+        for device in devices:
+            # the last entry wins if a mac_addr is given more than once
+            rows[device['mac_addr']] = {
+                'mac_addr': device['mac_addr'],
+                'd_name': device['d_name'],
+                'status': 'online',
+                'monitor': device.get('monitor', ''),
+                'is_sim': bool(device.get('is_sim', False)),
+                'register_time': now,
+                'extra_setup_webpage': device.get('extra_setup_webpage', ''),
+                'device_webpage': device.get('device_webpage', ''),
+                'user_id': ctx.u_id,
+                'dm_id': dm_ids[device['dm_name']],
+            }
+        rows = list(rows.values())
+
+        table = models.Device.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.mac_addr],
+            set_={column: statement.excluded[column] for column in REGISTER_UPDATE_COLUMNS},
+            where=table.c.user_id == statement.excluded.user_id,
+        )
+
+        d_ids = {}
+        conflicts = set()
+        try:
+            for i in range(0, len(rows), REGISTER_CHUNK_SIZE):
+                chunk = rows[i:i + REGISTER_CHUNK_SIZE]
+                db.session.execute(statement, chunk)
+                records = (db.session.query(models.Device.mac_addr, models.Device.id,
+                                            models.Device.user_id)
+                                     .filter(models.Device.mac_addr.in_(
+                                         [row['mac_addr'] for row in chunk])))
+                for mac_addr, d_id, user_id in records:
+                    if user_id == ctx.u_id:
+                        d_ids[mac_addr] = d_id
+                    else:
+                        conflicts.add(mac_addr)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        for row in rows:
+            if row['mac_addr'] not in conflicts:
+                after_commit(presence.register, row['mac_addr'], row['dm_id'])
+
+        return {
+            'devices': [
+                {'mac_addr': device['mac_addr'], 'd_id': d_ids[device['mac_addr']]}
+                for device in devices if device['mac_addr'] in d_ids
+            ],
+            'conflicts': sorted(conflicts),
+        }
+
+    def op_delete_devices(self, ctx, mac_addrs):
+        """
+        Delete the registered devices of the user by their mac_addr.
+
+        The unknown mac_addr are ignored, the deleted ones are returned.
+
+        :param mac_addrs: [<Device.mac_addr>, ...]
+        :type mac_addrs: List[str]
+
+        :return:
+            {
+                'mac_addr': [<Device.mac_addr>, ...]
+            }
+        """
+        deleted = [mac_addr for mac_addr, in (
+            db.session.query(models.Device.mac_addr)
+                      .filter(models.Device.mac_addr.in_(mac_addrs),
+                              models.Device.user_id == ctx.u_id))]
+
+        # DeviceObject.d_id is set to NULL by the database
+        (db.session.query(models.Device)
+                   .filter(models.Device.mac_addr.in_(deleted))
+                   .delete(synchronize_session=False))
+        db.session.commit()
+
+        for mac_addr in deleted:
+            after_commit(presence.forget, mac_addr)
+
+        return {'mac_addr': deleted}
+
+    def op_report_device_status(self, ctx, mac_addr, status='online'):
+        """
+        Record the heartbeat of a device, or its going offline.
+
+        Only the in-memory presence table is updated, the status is written
+        to `Device.status` once per flush window if it changed.
+
+        :param mac_addr: <Device.mac_addr>
+        :param status: 'online' or 'offline'
+        :type mac_addr: str
+        :type status: str
+
+        :return:
+            {
+                'mac_addr': <Device.mac_addr>,
+                'status': <Device.status>
+            }
+        """
+        if status not in ('online', 'offline'):
+            raise CCMError('Invalid device status "{}"'.format(status))
+        if not presence.heartbeat(mac_addr, status):
+            raise CCMError('Device {} not found'.format(mac_addr))
+
+        return {'mac_addr': mac_addr, 'status': status}
+
+    def op_get_online_devices(self, ctx, dm_id):
+        """
+        Get the online devices of a Device Model.
+
+        The status is answered from the in-memory presence table,
+        without touching the database.
+
+        :param dm_id: <DeviceModel.id>
+        :type dm_id: int
+
+        :return:
+            {
+                'dm_id': <DeviceModel.id>,
+                'mac_addr': [<Device.mac_addr>, ...]
+            }
+        """
+        return {
+            'dm_id': dm_id,
+            'mac_addr': presence.online_devices(int(dm_id)),
+        }
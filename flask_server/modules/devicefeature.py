@@ -11,13 +11,13 @@ contains:
     op_search_device_feature
 """
 
-import sys
-sys.path.append("..")
+from catalogue import catalogue
 from modules.deviceparameter import DeviceParameter
 from modules.interface import Interface
 from modules.utils import CCMError, record_parser
 from db import models
 from db import db
+from sqlalchemy import exists, or_
 
 class DeviceFeature(Interface):
     """Device Feature class."""
@@ -150,21 +150,17 @@ class DeviceFeature(Interface):
             raise CCMError('Device Feature id {} not found'.format(df_id))
 
         # Check in use
-        mf_records = (db.session.query(models.DM_DF).filter(models.DM_DF.df_id == df_id).all())
-        
-        dfo_records = (db.session.query(models.DF_Object).filter(models.DF_Object.df_id == df_id).all())
-
-        if mf_records or dfo_records:
+        in_use = db.session.query(or_(
+            exists().where(models.DM_DF.df_id == df_id),
+            exists().where(models.DF_Object.df_id == df_id),
+        )).scalar()
+        if in_use:
             raise CCMError('Device Feature is in use.')
 
-        # delete DeviceParameter
-        db.session.query(models.DeviceParameter).filter(models.DeviceParameter.df_id == df_id).delete()
-
-        # delete FunctionSDF
-        db.session.query(models.FunctionSDF).filter(models.FunctionSDF.df_id == df_id).delete()
-
-        # delete DeviceFeature
-        db.session.query(models.DeviceFeature).filter(models.DeviceFeature.df_id == df_id).delete()
+        # delete DeviceFeature, its DeviceParameter are deleted by the database
+        (db.session.query(models.DeviceFeature)
+                   .filter(models.DeviceFeature.id == df_id)
+                   .delete())
         db.session.commit()
 
         return {'df_id': df_id}
@@ -188,6 +184,12 @@ class DeviceFeature(Interface):
             }
         """
 
+        if catalogue.enabled:
+            user_id = (db.session.query(models.User.id)
+                                 .filter(models.User.username == df_user)
+                                 .scalar())
+            return catalogue.feature_list(user_id)
+
         df_records = (db.session.query(models.DeviceFeature).filter(models.DeviceFeature.user == df_user).order_by(models.DeviceFeature.df_name).all())
         
         result = {
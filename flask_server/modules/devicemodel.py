@@ -11,15 +11,16 @@ contains:
     op_search_device_model
 """
 
-import sys
-sys.path.append("..")
-from modules.deviceparameter import DeviceParameter
+from collections import defaultdict
+
+from catalogue import catalogue
+from modules.deviceparameter import DeviceParameter, save_parameters
 from modules.dmdf import DMDFTag
 from modules.interface import Interface
 from modules.utils import CCMError, record_parser
 from db import models
 from db import db
-from sqlalchemy import or_
+from sqlalchemy import exists, or_
 
 class DeviceModel(Interface):
     """DeviceModel class."""
@@ -101,6 +102,8 @@ class DeviceModel(Interface):
         Server will check the dm_name and dm_id is equal to DB,
         and check Device Model is not in use,
         then update and return the dm_id on success.
+        Only the DM_DF and parameters which differ from the stored ones are written,
+        all in one transaction.
 
         :param dm_id: <DeviceModel.id>
         :param dm_name: <DeviceModel.dm_name>
@@ -119,7 +122,12 @@ class DeviceModel(Interface):
 
         :return:
             {
-                'dm_id': <DeviceModel.id>
+                'dm_id': <DeviceModel.id>,
+                'changes': {
+                    'added': [<DeviceFeature.id>, ...],
+                    'updated': [<DeviceFeature.id>, ...],
+                    'removed': [<DeviceFeature.id>, ...],
+                }
             }
         """
 
@@ -135,58 +143,90 @@ class DeviceModel(Interface):
         dm_id = dm_record.id
 
         # check dm in use
-        do_records = db.session.query(models.DeviceObject).filter(models.DeviceObject.dm_id == dm_id).all()
-        if do_records:
+        in_use = db.session.query(
+            exists().where(models.DeviceObject.dm_id == dm_id)).scalar()
+        if in_use:
             raise CCMError('Device Model is in use.')
 
-        # update plural
+        user_id = ctx.u_id
+        DP = models.DeviceParameter
+
+        # update plural and device_only
         if plural:
             dm_record.plural = plural
-            db.session.commit()
-
-        # update device_only
         if device_only:
             dm_record.device_only = device_only
-            db.session.commit()
 
-        # TODO: fix user setting mf
-        old_mf_records = (db.session.query(models.DM_DF).filter(models.DM_DF.dm_id == dm_id))
-        old_mf_records = {mf.df_id: mf for mf in old_mf_records}
-        
-        # save DM_DF and DF_Parameter and DM_DF_Tag
-        for df in df_list:
-            if int(df['df_id']) in old_mf_records:
-                old_mf_records.pop(int(df['df_id']))
-            # update DF_Parameter
-            DeviceParameter.op_update_device_parameter(
-                ctx,
-                dm_id=dm_id,
-                df_id=df['df_id'],
-                df_parameter=df.get('df_parameter', [])
-            )
-
-            # update new DM_DF_Tag
-            DMDFTag.op_save_dm_df_tag(
-                ctx,
-                dm_id=dm_id,
-                df_id=df['df_id'],
-                tags=df.get('tags', [])
-            )
-
-        # delete not use DeviceParameter, DM_DF_Tag, DM_DF
-        for mf in old_mf_records.values():
-            (db.session.query(models.DeviceParameter)
-                       .filter(models.DeviceParameter.dmdf_id == mf.id)
-                       .delete())
-            (db.session.query(models.DM_DF_Tag)
-                       .filter(models.DM_DF_Tag.dmdf_id == mf.id)
-                       .delete())
+        # Load the current state of the model once
+        mf_records = (db.session.query(models.DM_DF)
+                                .filter(models.DM_DF.dm_id == dm_id)
+                                .all())
+        mf_records = {mf.df_id: mf for mf in mf_records}
+        new_dfs = {int(df['df_id']): df for df in df_list}
+
+        removed = [df_id for df_id in mf_records if df_id not in new_dfs]
+        added = [df_id for df_id in new_dfs if df_id not in mf_records]
+        kept = {mf_records[df_id].id: df_id for df_id in new_dfs if df_id in mf_records}
+
+        base_records = defaultdict(list)
+        copied_mf_ids = set()
+        dfp_records = (db.session.query(DP)
+                                 .filter(DP.dmdf_id.in_(kept), DP.user_id.in_((1, user_id)))
+                                 .order_by(DP.id))
+        for dfp_record in dfp_records:
+            if dfp_record.user_id == 1:
+                base_records[dfp_record.dmdf_id].append(dfp_record)
+            else:
+                copied_mf_ids.add(dfp_record.dmdf_id)
+
+        delta_records = (db.session.query(models.DeviceParameterDelta)
+                                   .join(DP, DP.id == models.DeviceParameterDelta.base_id)
+                                   .filter(DP.dmdf_id.in_(kept),
+                                           models.DeviceParameterDelta.user_id == user_id))
+        deltas = {record.base_id: record.as_delta() for record in delta_records}
+
+        # Only the DM_DF whose parameters differ from the stored ones are written
+        updated = []
+        for mf_id, df_id in kept.items():
+            df_parameter = new_dfs[df_id].get('df_parameter', [])
+            bases = base_records[mf_id]
+            if (mf_id in copied_mf_ids
+                    or len(bases) != len(df_parameter)
+                    or any(base.delta_from(dfp) != deltas.get(base.id, {})
+                           for base, dfp in zip(bases, df_parameter))):
+                save_parameters(user_id, DP.dmdf_id == mf_id, bases, df_parameter,
+                                df_id=df_id, mf_id=mf_id)
+                updated.append(df_id)
+
+        for df_id in added:
+            new_mf = models.DM_DF(dm_id=dm_id, df_id=df_id)
+            db.session.add(new_mf)
+            db.session.flush()
+            save_parameters(user_id, DP.dmdf_id == new_mf.id, [],
+                            new_dfs[df_id].get('df_parameter', []),
+                            df_id=df_id, mf_id=new_mf.id)
+
+        # delete not use DM_DF, its DeviceParameter are deleted by the database
+        if removed:
+            removed_mf_ids = [mf_records[df_id].id for df_id in removed]
             (db.session.query(models.DM_DF)
-                       .filter(models.DM_DF.id == mf.id)
+                       .filter(models.DM_DF.id.in_(removed_mf_ids))
                        .delete())
-            db.session.commit()
 
-        return {'dm_id': dm_id}
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return {
+            'dm_id': dm_id,
+            'changes': {
+                'added': added,
+                'updated': updated,
+                'removed': removed,
+            },
+        }
 
     def op_delete_device_model(self, ctx, dm_id):
         """
@@ -209,21 +249,15 @@ class DeviceModel(Interface):
             raise CCMError('Device Model not found')
 
         # check in use
-        do_records = db.session.query(models.DeviceObject.dm_id).filter(models.DeviceObject.dm_id == dm_id).all()
-
-        d_records = db.session.query(models.Device.dm_id).filter(models.Device.dm_id == dm_id).all()
-        if do_records or d_records:
+        in_use = db.session.query(or_(
+            exists().where(models.DeviceObject.dm_id == dm_id),
+            exists().where(models.Device.dm_id == dm_id),
+        )).scalar()
+        if in_use:
             raise CCMError('Device Model is in use.')
 
-        # delete DM_DF, DF_Parameter, DM_DF_Tag
-        mf_records = db.session.query(models.DM_DF).filter(models.DM_DF.dm_id == dm_id).all()
-        for mf_record in mf_records:
-            DeviceParameter.op_delete_device_parameter(ctx, mf_id=mf_record.id)
-            DMDFTag.op_delete_dm_df_tag(ctx, mf_id=mf_record.id)
-            db.session.delete(mf_record)
-            db.session.commit()
-
-        db.session.delete(dm_record)
+        # DM_DF and DF_Parameter are deleted by the database (ON DELETE CASCADE)
+        db.session.query(models.DeviceModel).filter(models.DeviceModel.id == dm_id).delete()
         db.session.commit()
 
         return {'dm_id': dm_id}
@@ -270,6 +304,11 @@ class DeviceModel(Interface):
         """
         user_id = ctx.u_id
 
+        if catalogue.enabled:
+            dm = catalogue.model_info(dm_id, user_id)
+            if dm is not None:
+                return dm
+
         # query DeviceModel
         dm_record = db.session.query(models.DeviceModel).filter(models.DeviceModel.id == dm_id).first()
         if dm_record is None:
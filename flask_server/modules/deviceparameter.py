@@ -9,12 +9,11 @@ contains:
     op_get_device_parameter
 """
 
-import sys
-sys.path.append("..")
 from modules.interface import Interface
 from modules.utils import CCMError, record_parser
 from db import models
 from db import db
+from sqlalchemy import and_, case, func, null, select
 
 
 class DeviceParameter(Interface):
@@ -66,7 +65,7 @@ class DeviceParameter(Interface):
                 max=dfp.get('max', 0),
                 dmdf_id=mf_id,
                 df_id=df_id,
-                unit_id=dfp.get('unit_id', 1),  # 1 for None
+                unit_id=dfp.get('unit_id', models.NONE_UNIT_ID),
                 fn_id=dfp.get('fn_id', None),
                 user=df_user,
                 normalization=dfp.get('normalization', 0),
@@ -129,31 +128,19 @@ class DeviceParameter(Interface):
         else:
             raise CCMError('One of [ "df_id" or "mf_id" ] should be supplied.')
 
-        # update device feature parameter
-        for dfp in enumerate(df_parameter):
-            # try update first
-            user = db.session.query(models.User).filter(models.User.username == df_user).first()
-            update_dfp = db.session.query(models.DeviceParameter).filter(condition, models.DeviceParameter.user_id == user.id).update(dfp)
-
-            db.session.commit()
-
-            # if return value is 0 means update 0 rows, so create new one
-            if update_dfp == 0:
-                new_dfp = models.DF_Parameter(
-                    param_type=dfp.get('param_type', 'int'),
-                    idf_type=dfp.get('idf_type', 'sample'),
-                    min=dfp.get('min', 0),
-                    max=dfp.get('max', 0),
-                    dmdf_id=mf_id,
-                    df_id=df_id,
-                    unit_id=dfp.get('unit_id', 1),  # 1 for None
-                    fn_id=dfp.get('fn_id', None),
-                    user_id=user.id,
-                    normalization=dfp.get('normalization', 0),
-                )
-                db.session.add(new_dfp)
-                db.session.commit()
-
+        user = db.session.query(models.User).filter(models.User.username == df_user).first()
+        if not user:
+            raise CCMError(
+                'User "{}" is not a valid user stored in database'.format(df_user))
+
+        # The general setting (user_id = 1) is the base row of every user's customization
+        base_records = (db.session.query(models.DeviceParameter)
+                                  .filter(condition, models.DeviceParameter.user_id == 1)
+                                  .order_by(models.DeviceParameter.id)
+                                  .all())
+
+        save_parameters(user.id, condition, base_records, df_parameter,
+                        df_id=df_id, mf_id=mf_id)
         db.session.commit()
 
         return {'mf_id': mf_id} if mf_id else {'df_id': df_id}
@@ -238,14 +225,130 @@ class DeviceParameter(Interface):
 
         # query user DF_Parameter
         user = db.session.query(models.User).filter(models.User.username == df_user).first()
-        dfp_records = db.session.query(models.DeviceParameter).filter(models.DeviceParameter.user_id == user.id, condition).all()
+        dfp_records = []
+        if user.id != 1:
+            # full copies stored before the delta format was introduced
+            dfp_records = (db.session.query(models.DeviceParameter)
+                                     .filter(models.DeviceParameter.user_id == user.id,
+                                             condition)
+                                     .order_by(models.DeviceParameter.id)
+                                     .all())
 
         if not dfp_records:
-            # query general DF_Parameter
-            dfp_records = db.session.query(models.DeviceParameter).filter(condition, models.DeviceParameter.user_id == 1).all()
+            # general DF_Parameter merged with the user's overrides
+            dfp_records = db.session.execute(
+                _merged_parameter_query(user.id, condition)).all()
 
         df_parameters = []
         for dfp_record in dfp_records:
             df_parameters.append(record_parser(dfp_record))
 
         return {'df_parameter': df_parameters}
+
+
+def _merged_parameter_query(user_id, condition):
+    """
+    Build the query of the general DeviceParameter rows merged with the user's deltas.
+
+    The result rows have the same columns as DeviceParameter,
+    so the output of `record_parser` stays the same as the full copy format.
+    """
+    base = models.DeviceParameter
+    delta = models.DeviceParameterDelta
+
+    columns = []
+    for column in base.__table__.columns:
+        if column.name in delta.CLEARED_FLAGS:
+            value = case((getattr(delta, delta.CLEARED_FLAGS[column.name]), null()),
+                         else_=func.coalesce(getattr(delta, column.name),
+                                             getattr(base, column.name)))
+        elif (column.name in base.OVERRIDABLE_FIELDS
+              or column.name in ('user_id', 'updated_at')):
+            value = func.coalesce(getattr(delta, column.name), getattr(base, column.name))
+        else:
+            value = getattr(base, column.name)
+        columns.append(value.label(column.name))
+
+    return (select(*columns)
+            .select_from(base)
+            .outerjoin(delta, and_(delta.base_id == base.id, delta.user_id == user_id))
+            .where(condition, base.user_id == 1)
+            .order_by(base.id))
+
+
+def save_parameters(user_id, condition, base_records, df_parameter, df_id=None, mf_id=None):
+    """
+    Save `df_parameter` of the user without committing.
+
+    The user's setting is stored as deltas against `base_records`, the general rows
+    selected by `condition`. The general setting itself, or a setting which can not
+    be matched with the general rows, is stored as full DeviceParameter rows.
+    """
+    if user_id == 1 or len(base_records) != len(df_parameter):
+        _save_parameter_rows(user_id, condition, df_parameter, df_id, mf_id)
+        return
+
+    _save_parameter_deltas(user_id, base_records, df_parameter)
+
+    # Drop the full copies stored before the delta format was introduced
+    (db.session.query(models.DeviceParameter)
+               .filter(condition, models.DeviceParameter.user_id == user_id)
+               .delete(synchronize_session=False))
+
+
+def _save_parameter_deltas(user_id, base_records, df_parameter):
+    """Store the differences between `df_parameter` and the general rows as user deltas."""
+    delta_records = (db.session.query(models.DeviceParameterDelta)
+                               .filter(models.DeviceParameterDelta.user_id == user_id,
+                                       models.DeviceParameterDelta.base_id.in_(
+                                           [base.id for base in base_records]))
+                               .all())
+    delta_records = {record.base_id: record for record in delta_records}
+
+    for base, dfp in zip(base_records, df_parameter):
+        delta = base.delta_from(dfp)
+        delta_record = delta_records.get(base.id)
+
+        if not delta:
+            # same as the general setting, nothing to store
+            if delta_record:
+                db.session.delete(delta_record)
+            continue
+
+        if not delta_record:
+            delta_record = models.DeviceParameterDelta(base_id=base.id, user_id=user_id)
+            db.session.add(delta_record)
+        delta_record.apply(delta)
+
+
+def _save_parameter_rows(user_id, condition, df_parameter, df_id, mf_id):
+    """Store `df_parameter` as full DeviceParameter rows owned by the user."""
+    dfp_records = (db.session.query(models.DeviceParameter)
+                             .filter(condition, models.DeviceParameter.user_id == user_id)
+                             .order_by(models.DeviceParameter.id)
+                             .all())
+
+    for dfp_record, dfp in zip(dfp_records, df_parameter):
+        for field, value in dfp_record.delta_from(dfp).items():
+            setattr(dfp_record, field, value)
+
+    for dfp in df_parameter[len(dfp_records):]:
+        new_dfp = models.DeviceParameter(
+            param_type=dfp.get('param_type', 'int'),
+            idf_type=dfp.get('idf_type', 'sample'),
+            min=dfp.get('min', 0),
+            max=dfp.get('max', 0),
+            dmdf_id=mf_id,
+            df_id=df_id,
+            unit_id=dfp.get('unit_id', models.NONE_UNIT_ID),
+            fn_id=dfp.get('fn_id', None),
+            user_id=user_id,
+            normalization=dfp.get('normalization', 0),
+        )
+        db.session.add(new_dfp)
+
+    surplus_ids = [dfp_record.id for dfp_record in dfp_records[len(df_parameter):]]
+    if surplus_ids:
+        (db.session.query(models.DeviceParameter)
+                   .filter(models.DeviceParameter.id.in_(surplus_ids))
+                   .delete(synchronize_session=False))
@@ -0,0 +1,103 @@
+"""
+Op dispatcher.
+
+Maps the op names used by the GUI (e.g. 'get_device_model_info') to the `op_*`
+methods of the Interface classes, routes the mutating ops to the single
+writer thread when it is enabled, and replays the response of a request
+delivered again, see `modules.replay`.
+"""
+
+from modules.dependency import Dependency
+from modules.device import Device
+from modules.devicefeature import DeviceFeature
+from modules.devicemodel import DeviceModel
+from modules.deviceparameter import DeviceParameter
+from modules.dmdf import DMDFTag
+from modules.function import Function
+from modules.project import Project
+from modules.replay import Replay, replay_cache
+from modules.search import Search
+from modules.timing import Timing
+from modules.unit import Unit
+from modules.utils import CCMError
+from modules.whereused import WhereUsed
+from modules.writer import write_queue
+
+__all__ = [
+    'OPS',
+    'call_op',
+    'is_mutating_op',
+]
+
+INTERFACES = (
+    Dependency,
+    Device,
+    DeviceFeature,
+    DeviceModel,
+    DeviceParameter,
+    DMDFTag,
+    Function,
+    Project,
+    Replay,
+    Search,
+    Timing,
+    Unit,
+    WhereUsed,
+)
+
+# The op name prefixes of the ops which write the database
+MUTATING_PREFIXES = (
+    'create_',
+    'update_',
+    'delete_',
+    'save_',
+    'register_',
+    'restart_',
+)
+
+
+def _collect_ops():
+    ops = {}
+    for interface in INTERFACES:
+        instance = interface()
+        for name in dir(interface):
+            if name.startswith('op_'):
+                ops[name[len('op_'):]] = getattr(instance, name)
+    return ops
+
+
+OPS = _collect_ops()
+
+
+def is_mutating_op(op):
+    return op.startswith(MUTATING_PREFIXES)
+
+
+def call_op(ctx, op, data=None, flag=None, encode=None):
+    """
+    Run the op `op` with the keyword arguments `data` and return its result.
+
+    The mutating ops are run by the writer thread if it is enabled,
+    the caller waits for the batch containing the op to be committed.
+
+    :param flag: the flag of the GUI request, the response of a request already
+                 run for `ctx.client_id` is replayed, along with `encode` only
+    :param encode: encode the result, e.g. to JSON, the encoded result is returned
+    """
+    fn = OPS.get(op)
+    if fn is None:
+        raise CCMError('Unknown op "{}"'.format(op))
+
+    data = data or {}
+    if encode is None:
+        return _run(fn, ctx, op, data)
+    if flag is not None and ctx.client_id is not None and replay_cache.enabled:
+        # The responses are cached encoded, a replay is not encoded again
+        return replay_cache.call((ctx.client_id, flag), encode, _run, fn, ctx, op, data)
+    return encode(_run(fn, ctx, op, data))
+
+
+def _run(fn, ctx, op, data):
+    if write_queue.enabled and is_mutating_op(op):
+        return write_queue.submit(fn, ctx, **data).result()
+    return fn(ctx, **data)
@@ -9,8 +9,6 @@ contains:
 
 """
 
-import sys
-sys.path.append("..")
 from modules.interface import Interface
 from modules.utils import CCMError, record_parser
 from db import models
@@ -0,0 +1,29 @@
+"""
+Function Module.
+
+contains:
+
+    op_get_function_list
+"""
+
+from modules.interface import Interface
+from db.refdata import registry
+
+
+class Function(Interface):
+    """Function class."""
+
+    def op_get_function_list(self, ctx):
+        """
+        Get all the Functions, served from the reference data registry.
+
+        :return:
+            [
+                {
+                    'fn_id': <Function.id>,
+                    'fn_name': <Function.fn_name>
+                }, ...
+            ]
+        """
+        return [{'fn_id': fn_id, 'fn_name': fn_name}
+                for fn_id, fn_name in registry.functions()]
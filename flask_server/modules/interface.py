@@ -1,4 +1,50 @@
+import functools
+from contextvars import ContextVar
+
+from db import reading
+from db.slowlog import current_op
+from tracing import tracer
+
+# The prefixes of the ops which only read the database
+READ_OP_PREFIXES = ('op_get_', 'op_search_')
+
+# The number of ops being run in the current context, ops may call other ops
+_op_depth = ContextVar('op_depth', default=0)
+
+
+def _wrap_op(name, fn):
+    read_only = name.startswith(READ_OP_PREFIXES)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        depth = _op_depth.get()
+        token = _op_depth.set(depth + 1)
+        op_token = current_op.set(name)
+        try:
+            with tracer.span(name):
+                # A read op called by a mutating op must see the uncommitted changes,
+                # only the outermost read op goes to the read-only engine.
+                if read_only and depth == 0:
+                    with reading():
+                        return fn(*args, **kwargs)
+                return fn(*args, **kwargs)
+        finally:
+            current_op.reset(op_token)
+            _op_depth.reset(token)
+
+    return wrapper
+
+
 class Interface(object):
     """
     Interface class.
+
+    The `op_get_*` and `op_search_*` ops of the subclasses are routed to
+    the read-only engine automatically.
     """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, fn in list(vars(cls).items()):
+            if name.startswith('op_') and callable(fn):
+                setattr(cls, name, _wrap_op(name, fn))
@@ -0,0 +1,48 @@
+"""
+Project Module.
+
+contains:
+
+    op_restart_project
+"""
+
+from modules.interface import Interface
+from modules.utils import CCMError
+from db import models
+from db import db
+from project import compiler
+
+
+class Project(Interface):
+    """Project class."""
+
+    def op_restart_project(self, ctx, p_id, full=False):
+        """
+        Restart a Project, reload only the NetworkApps changed since the last restart.
+
+        The NetworkApps are fingerprinted by their DF_Module/MJ_Module rows,
+        the changed ones are compiled (or taken from the compiled configuration
+        cache) and returned to be reloaded. `Project.restart` is cleared.
+
+        :param p_id: <Project.id>
+        :param full: reload all the NetworkApps, even the unchanged ones
+        :type p_id: int
+        :type full: bool
+
+        :return:
+            {
+                'p_id': <Project.id>,
+                'reload': {<NetworkApp.id>: <join configuration>, ...},
+                'unchanged': [<NetworkApp.id>, ...],
+                'unload': [<NetworkApp.id>, ...]
+            }
+        """
+        p_record = db.session.get(models.Project, p_id)
+        if not p_record:
+            raise CCMError('Project not found')
+
+        result = compiler.restart(db.session.connection(), p_id, full=bool(full))
+        p_record.restart = False
+        db.session.commit()
+
+        return {'p_id': p_id, **result}
@@ -0,0 +1,182 @@
+"""
+Replay Module.
+
+The GUI stamps every request with a UUID `flag` and sends it again when the
+response is lost. The response of an op is cached by (client id, flag), so a
+duplicate delivery gets the same response without running the op again, e.g.
+creating a second device model. A duplicate arriving while the op still runs
+waits for it.
+
+The successful results and the CCMError messages are cached, other exceptions
+are not, the op runs again on the next delivery. The results are kept encoded
+by the caller, e.g. to the JSON the gateway publishes, and replayed encoded.
+
+The cache is bounded by entries and bytes with LRU eviction, and an entry
+expires `ttl` seconds after the op, retries come within seconds.
+
+contains:
+
+    op_get_replay_metrics
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from modules.interface import Interface
+from modules.utils import CCMError
+
+__all__ = [
+    'Replay',
+    'ReplayCache',
+    'replay_cache',
+]
+
+
+class ReplayCache:
+    def __init__(self, size=4096, ttl=300, max_bytes=16 * 1024 * 1024):
+        self.size = size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (payload, error, expires)
+        self._bytes = 0
+        self._running = {}  # key -> threading.Event, set when the op is done
+
+    def init_app(self, app):
+        self.size = int(app.config.get('REPLAY_CACHE_SIZE', self.size))
+        self.ttl = float(app.config.get('REPLAY_CACHE_TTL', self.ttl))
+        self.max_bytes = int(app.config.get('REPLAY_CACHE_MAX_BYTES', self.max_bytes))
+        app.extensions['replay_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def call(self, key, encode, fn, *args, **kwargs):
+        """
+        Return the cached response of `key`, or run `fn(*args, **kwargs)` to cache it.
+
+        :param encode: encode the result of `fn` to a str, the cached response
+        :return: the encoded result
+        """
+        while True:
+            with self._lock:
+                entry = self._get(key)
+                if entry is None:
+                    done = self._running.get(key)
+                    if done is None:
+                        done = self._running[key] = threading.Event()
+                        self.misses += 1
+                        break
+                    self.waits += 1
+                else:
+                    self.hits += 1
+
+            if entry is not None:
+                payload, error, _ = entry
+                if error is not None:
+                    raise CCMError(error)
+                return payload
+            # Another thread runs the op, replay its response or run it if it failed
+            done.wait(self.ttl)
+
+        try:
+            result = fn(*args, **kwargs)
+        except CCMError as e:
+            self._put(key, 'null', e.msg)
+            raise
+        else:
+            payload = encode(result)
+            self._put(key, payload, None)
+            return payload
+        finally:
+            with self._lock:
+                self._running.pop(key).set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self):
+        """
+        :return: {'entries', 'bytes', 'hits', 'misses', 'hit_rate', 'waits',
+                  'evictions', 'expirations'}
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, payload, error):
+        size = len(payload) + len(error or '')
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, error, now + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.size or self._bytes > self.max_bytes:
+                oldest, (_, _, expires) = next(iter(self._entries.items()))
+                self._remove(oldest)
+                if expires <= now:
+                    self.expirations += 1
+                else:
+                    self.evictions += 1
+
+    def _remove(self, key):
+        payload, error, _ = self._entries.pop(key)
+        self._bytes -= len(payload) + len(error or '')
+
+
+replay_cache = ReplayCache()
+
+
+class Replay(Interface):
+    """Replay class."""
+
+    def op_get_replay_metrics(self, ctx):
+        """
+        Get the metrics of the replay cache of this process.
+
+        :return:
+            {
+                'entries': <number of cached responses>,
+                'bytes': <size of the cached responses>,
+                'hits': <number of replayed responses>,
+                'misses': <number of ops run>,
+                'hit_rate': <hits / (hits + misses)>,
+                'waits': <number of duplicates which waited for the op>,
+                'evictions': <number of responses evicted by the size bounds>,
+                'expirations': <number of responses expired by the TTL>
+            }
+        """
+        return replay_cache.metrics()
@@ -0,0 +1,148 @@
+"""
+Search Module.
+
+contains:
+
+    op_search_catalogue
+"""
+
+import re
+from modules.interface import Interface
+from modules.utils import CCMError
+from db import fts
+from db import models
+from db import db
+from sqlalchemy import func, inspect, literal, or_, select, text, union_all
+
+KINDS = {
+    'df': fts.FEATURE,
+    'dm': fts.MODEL,
+}
+
+# bm25 weights of the name, content and terms columns
+RANK = 'bm25({}, 10.0, 1.0, 2.0)'.format(fts.TABLE)
+
+# Whether the FTS5 index is installed, by engine
+_fts_engines = {}
+
+
+class Search(Interface):
+    """Search class."""
+
+    def op_search_catalogue(self, ctx, keyword, kind=None, limit=20, offset=0):
+        """
+        Full-text search of Device Features and Device Models.
+
+        Every word of `keyword` is a prefix query and all of them should match
+        one of the name, content or unit/function names of a Device Feature,
+        or the name and feature names of a Device Model.
+        Results are ordered by relevance, the name has the highest weight.
+
+        If the database does not support SQLite FTS5,
+        the search falls back to a substring match on names and content ordered by name.
+
+        :param keyword: The search words
+        :param kind: 'df' or 'dm' to search only Device Features or Device Models, optional
+        :param limit: The page size
+        :param offset: The number of results to skip
+        :type keyword: str
+        :type kind: str
+        :type limit: int
+        :type offset: int
+
+        :return:
+            {
+                'total': <number of matched results>,
+                'results': [
+                    {
+                        'kind': 'df' / 'dm',
+                        'id': <DeviceFeature.id> / <DeviceModel.id>,
+                        'name': <DeviceFeature.df_name> / <DeviceModel.dm_name>,
+                    }, ...
+                ]
+            }
+        """
+        if kind is not None and kind not in KINDS:
+            raise CCMError('Invalid search kind "{}"'.format(kind))
+
+        words = re.findall(r'\w+', keyword or '')
+        if not words:
+            return {'total': 0, 'results': []}
+
+        limit = max(0, min(int(limit), 100))
+        offset = max(0, int(offset))
+
+        if _fts_installed():
+            return _search_fts(words, kind, limit, offset)
+        return _search_like(words, kind, limit, offset)
+
+
+def _fts_installed():
+    engine = db.engine
+    if engine not in _fts_engines:
+        _fts_engines[engine] = (engine.dialect.name == 'sqlite'
+                                and inspect(engine).has_table(fts.TABLE))
+    return _fts_engines[engine]
+
+
+def _search_fts(words, kind, limit, offset):
+    query = ' '.join('"{}"*'.format(word) for word in words)
+    condition = '{} MATCH :query'.format(fts.TABLE)
+    if kind is not None:
+        condition += ' AND rowid % 2 = {}'.format(KINDS[kind])
+
+    total = db.session.execute(
+        text('SELECT count(*) FROM {} WHERE {}'.format(fts.TABLE, condition)),
+        {'query': query}
+    ).scalar()
+
+    records = db.session.execute(
+        text('SELECT rowid, name FROM {} WHERE {} ORDER BY {} LIMIT :limit OFFSET :offset'
+             .format(fts.TABLE, condition, RANK)),
+        {'query': query, 'limit': limit, 'offset': offset}
+    )
+
+    results = []
+    for rowid, name in records:
+        results.append({
+            'kind': 'dm' if rowid % 2 == fts.MODEL else 'df',
+            'id': rowid // 2,
+            'name': name,
+        })
+
+    return {'total': total, 'results': results}
+
+
+def _search_like(words, kind, limit, offset):
+    selects = []
+
+    if kind in (None, 'df'):
+        DF = models.DeviceFeature
+        conditions = [or_(DF.df_name.ilike('%{}%'.format(word)),
+                          DF.content.ilike('%{}%'.format(word)))
+                      for word in words]
+        selects.append(select(literal('df').label('kind'), DF.id.label('id'),
+                              DF.df_name.label('name')).where(*conditions))
+
+    if kind in (None, 'dm'):
+        DM = models.DeviceModel
+        conditions = [DM.dm_name.ilike('%{}%'.format(word)) for word in words]
+        selects.append(select(literal('dm').label('kind'), DM.id.label('id'),
+                              DM.dm_name.label('name')).where(*conditions))
+
+    matches = (union_all(*selects) if len(selects) > 1 else selects[0]).subquery()
+
+    total = db.session.execute(select(func.count()).select_from(matches)).scalar()
+
+    records = db.session.execute(
+        select(matches.c.kind, matches.c.id, matches.c.name)
+        .order_by(func.lower(matches.c.name), matches.c.kind, matches.c.id)
+        .limit(limit)
+        .offset(offset)
+    )
+
+    results = []
+    for kind_, id_, name in records:
+        results.append({'kind': kind_, 'id': id_, 'name': name})
+
+    return {'total': total, 'results': results}
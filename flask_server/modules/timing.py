@@ -0,0 +1,177 @@
+"""
+Timing Module.
+
+Where the time of a GUI request goes, recorded by the gateway per op:
+
+    transit  from `req_timestamp` of the GUI to the gateway, the clocks may differ
+    queue    waiting in the queue of the client
+    op       running the op, including `db`
+    db       executing SQL statements, in the thread running the op
+    encode   encoding the result to JSON
+    publish  publishing the response to the broker
+
+Each phase of each op is aggregated in a histogram of log-spaced buckets,
+4 per doubling, so a percentile is within 19% and the memory is fixed.
+
+The SQL time of an op run by the writer thread (`WRITE_QUEUE`) is not counted.
+
+contains:
+
+    op_get_op_timings
+"""
+import math
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from modules.interface import Interface
+
+__all__ = [
+    'OpTimings',
+    'PHASES',
+    'Timing',
+    'db_timer',
+    'op_timings',
+]
+
+PHASES = ('transit', 'queue', 'op', 'db', 'encode', 'publish')
+
+# The histogram buckets: [0, 0.01ms), then 4 buckets per doubling up to ~11 minutes
+BUCKETS_PER_DOUBLING = 4
+MIN_MS = 0.01
+BUCKETS = 4 * 26 + 2
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        if ms < MIN_MS:
+            i = 0
+        else:
+            i = min(BUCKETS - 1,
+                    1 + int(math.log2(ms / MIN_MS) * BUCKETS_PER_DOUBLING))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        """The upper bound of the bucket of the q-th value, in milliseconds."""
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.max, MIN_MS * 2 ** (i / BUCKETS_PER_DOUBLING))
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(.5),
+            'p90': self.percentile(.9),
+            'p99': self.percentile(.99),
+            'max': self.max,
+        }
+
+
+class OpTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (op, phase) -> Histogram
+
+    def record(self, op, timing):
+        """Record a request, `timing` is {<phase>_ms: milliseconds, ...}."""
+        with self._lock:
+            for phase in PHASES:
+                ms = timing.get(phase + '_ms')
+                if ms is None or ms < 0:
+                    # A clock of the GUI ahead of the server
+                    continue
+                histogram = self._histograms.get((op, phase))
+                if histogram is None:
+                    histogram = self._histograms[(op, phase)] = Histogram()
+                histogram.record(ms)
+
+    def snapshot(self):
+        """:return: {<op>: {<phase>: {'count', 'mean', 'p50', 'p90', 'p99', 'max'}}}"""
+        with self._lock:
+            result = {}
+            for (op, phase), histogram in self._histograms.items():
+                result.setdefault(op, {})[phase] = histogram.as_dict()
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+op_timings = OpTimings()
+
+
+class _DbTimer(threading.local):
+    """The SQL time of the current thread, counted between `start()` and `stop()`."""
+
+    def __init__(self):
+        self.active = False
+        self.total = 0.0
+        self.started = 0.0
+
+    def start(self):
+        self.active = True
+        self.total = 0.0
+
+    def stop(self):
+        """Return the SQL time since `start()`, in milliseconds."""
+        self.active = False
+        return self.total * 1e3
+
+
+db_timer = _DbTimer()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if db_timer.active:
+        db_timer.started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if db_timer.active:
+        db_timer.total += time.perf_counter() - db_timer.started
+
+
+class Timing(Interface):
+    """Timing class."""
+
+    def op_get_op_timings(self, ctx):
+        """
+        Get the time of the requests served by the gateway of this process, per op.
+
+        :return:
+            {
+                <op name>: {
+                    <'transit', 'queue', 'op', 'db', 'encode' or 'publish'>: {
+                        'count': <number of requests>,
+                        'mean': <mean milliseconds>,
+                        'p50': <median milliseconds>,
+                        'p90': <90th percentile milliseconds>,
+                        'p99': <99th percentile milliseconds>,
+                        'max': <maximum milliseconds>
+                    }, ...
+                }, ...
+            }
+        """
+        return op_timings.snapshot()
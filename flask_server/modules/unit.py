@@ -0,0 +1,71 @@
+"""
+Unit Module.
+
+contains:
+
+    op_create_unit
+    op_get_unit_list
+"""
+
+from modules.interface import Interface
+from modules.utils import CCMError
+from db import models
+from db import db
+from db.refdata import registry
+from sqlalchemy.exc import IntegrityError
+
+
+class Unit(Interface):
+    """Unit class."""
+
+    def op_create_unit(self, ctx, unit_name):
+        """
+        Create a new Unit, and return its id.
+
+        The id of the existing Unit is returned if the name is in use,
+        including by a Unit just created by another process.
+
+        :param unit_name: <Unit.unit_name>
+        :type unit_name: str
+
+        :return:
+            {
+                'unit_id': <Unit.id>
+            }
+        """
+        unit_name = unit_name.strip() if unit_name else ''
+        if not unit_name:
+            raise CCMError('Invalid unit name "{}"'.format(unit_name))
+
+        unit_id = registry.unit_id(unit_name)
+        if unit_id is None:
+            new_unit = models.Unit(unit_name=unit_name)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(new_unit)
+            except IntegrityError:
+                # Created by another process since the registry was loaded
+                registry.invalidate()
+                unit_id = registry.unit_id(unit_name)
+                if unit_id is None:
+                    raise
+            else:
+                db.session.commit()
+                unit_id = new_unit.id
+
+        return {'unit_id': unit_id}
+
+    def op_get_unit_list(self, ctx):
+        """
+        Get all the Units, served from the reference data registry.
+
+        :return:
+            [
+                {
+                    'unit_id': <Unit.id>,
+                    'unit_name': <Unit.unit_name>
+                }, ...
+            ]
+        """
+        return [{'unit_id': unit_id, 'unit_name': unit_name}
+                for unit_id, unit_name in registry.units()]
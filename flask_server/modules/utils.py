@@ -6,7 +6,7 @@ import traceback
 
 from contextlib import contextmanager
 
-from iotgui.config import LOG_COLOR_DEFAULT
+from const import LOG_COLOR_DEFAULT
 
 
 class Context:
@@ -0,0 +1,97 @@
+"""
+WhereUsed Module.
+
+contains:
+
+    op_get_where_used
+"""
+
+from modules.interface import Interface
+from db import models
+from db import db
+from sqlalchemy import func, select
+
+
+def _count(model, column, target):
+    """Correlated COUNT(*) of `model` rows whose `column` refers to the `target` row."""
+    return (select(func.count())
+            .select_from(model)
+            .where(column == target.id)
+            .correlate(target)
+            .scalar_subquery())
+
+
+class WhereUsed(Interface):
+    """WhereUsed class."""
+
+    def op_get_where_used(self, ctx, dm_ids=None, df_ids=None):
+        """
+        Get the in use status and reference counts of many Device Models/Features at once.
+
+        A Device Model is in use if any DeviceObject or Device refers to it,
+        a Device Feature is in use if any DM_DF or DF_Object refers to it.
+        Each kind of ids is answered by one query.
+
+        :param dm_ids: <DeviceModel.id> list, optional
+        :param df_ids: <DeviceFeature.id> list, optional
+        :type dm_ids: List[int]
+        :type df_ids: List[int]
+
+        :return:
+            {
+                'dm_list': [
+                    {
+                        'dm_id': <DeviceModel.id>,
+                        'in_use': <bool>,
+                        'device_object': <number of DeviceObject>,
+                        'device': <number of Device>,
+                    }, ...
+                ],
+                'df_list': [
+                    {
+                        'df_id': <DeviceFeature.id>,
+                        'in_use': <bool>,
+                        'dm_df': <number of DM_DF>,
+                        'df_object': <number of DF_Object>,
+                    }, ...
+                ]
+            }
+        """
+        result = {'dm_list': [], 'df_list': []}
+
+        if dm_ids:
+            dm_records = db.session.execute(
+                select(
+                    models.DeviceModel.id,
+                    _count(models.DeviceObject, models.DeviceObject.dm_id,
+                           models.DeviceModel),
+                    _count(models.Device, models.Device.dm_id, models.DeviceModel))
+                .where(models.DeviceModel.id.in_(dm_ids))
+                .order_by(models.DeviceModel.id))
+
+            for dm_id, do_count, d_count in dm_records:
+                result['dm_list'].append({
+                    'dm_id': dm_id,
+                    'in_use': bool(do_count or d_count),
+                    'device_object': do_count,
+                    'device': d_count,
+                })
+
+        if df_ids:
+            df_records = db.session.execute(
+                select(
+                    models.DeviceFeature.id,
+                    _count(models.DM_DF, models.DM_DF.df_id, models.DeviceFeature),
+                    _count(models.DF_Object, models.DF_Object.df_id, models.DeviceFeature))
+                .where(models.DeviceFeature.id.in_(df_ids))
+                .order_by(models.DeviceFeature.id))
+
+            for df_id, mf_count, dfo_count in df_records:
+                result['df_list'].append({
+                    'df_id': df_id,
+                    'in_use': bool(mf_count or dfo_count),
+                    'dm_df': mf_count,
+                    'df_object': dfo_count,
+                })
+
+        return result
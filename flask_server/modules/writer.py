@@ -0,0 +1,140 @@
+"""
+Single writer thread with group commit.
+
+When enabled, the mutating ops are not run by the calling thread but submitted
+to one writer thread. The writer takes all the submissions waiting in the queue,
+up to `batch_size`, and runs them in a single database transaction:
+
+    * each op runs inside its own SAVEPOINT, a failing op only rolls back itself,
+    * the `commit()` of an op only flushes, the batch is committed once at the end,
+    * the callbacks given to `db.after_commit()` by the ops which succeeded are run
+      after the batch is committed, then the future of every op is resolved.
+
+So there is only one writer fighting for the SQLite lock, and one fsync per batch.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from db import db, group_commit
+from tracing import tracer
+
+__all__ = [
+    'WriteQueue',
+    'write_queue',
+]
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    def __init__(self, batch_size=64):
+        self.enabled = False
+        self.batch_size = batch_size
+
+        self._app = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = bool(app.config.get('WRITE_QUEUE'))
+        self.batch_size = int(app.config.get('WRITE_QUEUE_BATCH_SIZE', self.batch_size))
+        app.extensions['write_queue'] = self
+
+    def submit(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` in the writer thread and return its Future."""
+        future = Future()
+        self._ensure_thread()
+        # The op is traced as part of the caller's trace
+        self._queue.put((future, tracer.wrap(fn), args, kwargs))
+        return future
+
+    def _ensure_thread(self):
+        # The writer thread does not survive a fork, start a new one in the child process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='write-queue',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+            if batch:
+                with self._app.app_context():
+                    self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        session = db.session()
+        try:
+            if db.engine.dialect.name == 'sqlite':
+                # Take the write lock at once, and let the SAVEPOINTs below nest
+                # in this transaction instead of starting their own.
+                session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+
+            results = self._run_ops(session, batch)
+            session.commit()
+        except Exception as e:
+            logger.exception('Commit a batch of %d ops failed', len(batch))
+            session.rollback()
+            for future, fn, args, kwargs in batch:
+                future.set_exception(e)
+            return
+        finally:
+            db.session.remove()
+
+        for future, result, error, callbacks in results:
+            for fn, args in callbacks:
+                try:
+                    fn(*args)
+                except Exception:
+                    logger.exception('After-commit callback %r failed', fn)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _run_ops(self, session, batch):
+        results = []
+
+        # The ops commit on their own, `group_commit()` defers it to the end of the
+        # batch. A failing op is rolled back to its SAVEPOINT, with its callbacks.
+        for future, fn, args, kwargs in batch:
+            callbacks = []
+            savepoint = session.begin_nested()
+            try:
+                with group_commit(callbacks):
+                    result = fn(*args, **kwargs)
+                session.flush()
+            except Exception as e:
+                # Also when a failed flush has deactivated it, the session stays
+                # in PendingRollbackError until the SAVEPOINT is rolled back
+                savepoint.rollback()
+                results.append((future, None, e, ()))
+            else:
+                if savepoint.is_active:
+                    savepoint.commit()
+                results.append((future, result, None, callbacks))
+
+        return results
+
+
+write_queue = WriteQueue()
@@ -0,0 +1,5 @@
+from .tracker import presence
+
+__all__ = [
+    'presence',
+]
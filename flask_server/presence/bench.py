@@ -0,0 +1,101 @@
+"""
+Benchmark of the presence tracker, run it with `flask bench-presence`.
+
+The devices are inserted into the configured database by a user created for
+the benchmark, and deleted by it.
+"""
+import datetime
+import random
+import time
+import uuid
+
+from sqlalchemy import bindparam, delete, insert
+
+from db import db
+from db import models
+from presence.tracker import OFFLINE, ONLINE, presence
+
+__all__ = [
+    'bench_presence',
+]
+
+
+def _seed(devices):
+    tag = uuid.uuid4().hex[:12]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    user_id = db.session.execute(insert(models.User.__table__).values(
+        username='bench-' + tag, group_id=2)).inserted_primary_key[0]
+    dm_id = db.session.execute(insert(models.DeviceModel.__table__).values(
+        dm_name='bench-' + tag, dm_type='other')).inserted_primary_key[0]
+    mac_addrs = ['bench-{}-{}'.format(tag, i) for i in range(devices)]
+    db.session.execute(insert(models.Device.__table__), [
+        {'mac_addr': mac_addr, 'd_name': 'bench', 'status': ONLINE, 'monitor': '',
+         'is_sim': False, 'register_time': now, 'extra_setup_webpage': '',
+         'device_webpage': '', 'user_id': user_id, 'dm_id': dm_id}
+        for mac_addr in mac_addrs
+    ])
+    db.session.commit()
+    return user_id, dm_id, mac_addrs
+
+
+def bench_presence(devices=10000, heartbeats=200_000, windows=20, direct=2000):
+    """
+    Measure the heartbeats recorded by the tracker and the flushes writing their
+    status transitions, against one UPDATE per heartbeat.
+
+    The heartbeats are spread over `windows` flush windows, each one is online
+    or offline at random, so about half of them change the live status.
+
+    :return: {'heartbeats_per_sec', 'flush_ms', 'written', 'direct_per_sec'}
+    """
+    user_id, dm_id, mac_addrs = _seed(devices)
+    flush_interval = presence.flush_interval
+    # Flushed by the benchmark only
+    presence.flush_interval = 3600
+    presence.reset()
+    presence.online_devices(dm_id)  # load
+
+    rng = random.Random(0)
+    reports = [(rng.choice(mac_addrs), rng.choice((ONLINE, OFFLINE)))
+               for _ in range(heartbeats)]
+    per_window = heartbeats // windows
+    elapsed = flush_elapsed = 0.0
+    written = 0
+    try:
+        for i in range(windows):
+            start = time.perf_counter()
+            for mac_addr, status in reports[i * per_window:(i + 1) * per_window]:
+                presence.heartbeat(mac_addr, status)
+            elapsed += time.perf_counter() - start
+
+            start = time.perf_counter()
+            written += presence.flush()
+            flush_elapsed += time.perf_counter() - start
+
+        statement = (models.Device.__table__.update()
+                     .where(models.Device.__table__.c.mac_addr == bindparam('mac'))
+                     .values(status=bindparam('new_status')))
+        start = time.perf_counter()
+        for mac_addr, status in reports[:direct]:
+            db.session.execute(statement, {'mac': mac_addr, 'new_status': status})
+            db.session.commit()
+        direct_elapsed = time.perf_counter() - start
+    finally:
+        presence.stop()
+        presence.flush_interval = flush_interval
+        db.session.execute(delete(models.User.__table__)
+                           .where(models.User.__table__.c.id == user_id))
+        db.session.execute(delete(models.DeviceModel.__table__)
+                           .where(models.DeviceModel.__table__.c.id == dm_id))
+        db.session.commit()
+        presence.reset()
+
+    return {
+        'devices': devices,
+        'heartbeats': heartbeats,
+        'windows': windows,
+        'heartbeats_per_sec': heartbeats / elapsed,
+        'flush_ms': flush_elapsed / windows * 1e3,
+        'written': written,
+        'direct_per_sec': direct / direct_elapsed,
+    }
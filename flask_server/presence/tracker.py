@@ -0,0 +1,233 @@
+"""
+In-memory device presence with coalesced status writes.
+
+The live status of every device is kept in memory. Heartbeats only change the
+memory, the status transitions are written to `Device.status` by a background
+thread once per flush window, so a device flapping within the window costs no
+write at all and the writes of all devices share one transaction.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam
+
+from db import db
+from db.models import Device
+
+__all__ = [
+    'PresenceTracker',
+    'presence',
+]
+
+logger = logging.getLogger(__name__)
+
+ONLINE = 'online'
+OFFLINE = 'offline'
+
+
+class PresenceTracker:
+    def __init__(self, flush_interval=1.0):
+        self.flush_interval = flush_interval
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._models = {}                         # mac_addr -> dm_id
+        self._live = {}                           # mac_addr -> status
+        self._stored = {}                         # mac_addr -> status in database
+        self._pending = {}                        # mac_addr -> status to be written
+        self._online_by_model = defaultdict(set)  # dm_id -> {mac_addr, ...}
+
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self._app = app
+        self.flush_interval = app.config.get('PRESENCE_FLUSH_INTERVAL', self.flush_interval)
+        app.extensions['presence'] = self
+
+    def heartbeat(self, mac_addr, status=ONLINE):
+        """
+        Record the status reported by a device.
+
+        Return False if the device is not registered.
+        """
+        if status not in (ONLINE, OFFLINE):
+            raise ValueError('Invalid device status "{}"'.format(status))
+
+        self._ensure_loaded()
+        with self._lock:
+            known = mac_addr in self._models
+            if known:
+                self._set_status(mac_addr, status)
+        # Registered by another process since the devices are loaded
+        if not known and not self._load_device(mac_addr, status):
+            return False
+
+        self._ensure_thread()
+        return True
+
+    def register(self, mac_addr, dm_id, status=ONLINE):
+        """Track a device which is just stored in the database with `status`."""
+        self._ensure_loaded()
+        with self._lock:
+            self._forget(mac_addr)
+            self._models[mac_addr] = dm_id
+            self._stored[mac_addr] = status
+            self._set_status(mac_addr, status)
+
+    def forget(self, mac_addr):
+        """Stop tracking a deleted device."""
+        with self._lock:
+            self._forget(mac_addr)
+
+    def status(self, mac_addr):
+        self._ensure_loaded()
+        return self._live.get(mac_addr)
+
+    def online_devices(self, dm_id):
+        """Return the mac_addr of the online devices of a DeviceModel."""
+        self._ensure_loaded()
+        with self._lock:
+            return sorted(self._online_by_model.get(dm_id, ()))
+
+    def flush(self):
+        """Write the pending status transitions in one batched UPDATE."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        params = [{'mac': mac_addr, 'new_status': status}
+                  for mac_addr, status in pending.items()]
+        statement = (Device.__table__.update()
+                     .where(Device.__table__.c.mac_addr == bindparam('mac'))
+                     .values(status=bindparam('new_status')))
+        try:
+            with self._app.app_context():
+                db.session.execute(statement, params)
+                db.session.commit()
+        except Exception:
+            logger.exception('Write %d device status failed', len(pending))
+            with self._lock:
+                # Write the live status again, unless it is back to the stored one
+                # or the device is forgotten during the write
+                for mac_addr in pending:
+                    live = self._live.get(mac_addr)
+                    if live is not None and live != self._stored.get(mac_addr):
+                        self._pending[mac_addr] = live
+            return 0
+
+        with self._lock:
+            for mac_addr, status in pending.items():
+                if mac_addr not in self._models:
+                    continue
+                self._stored[mac_addr] = status
+                # A transition recorded during the write was compared to the old status
+                if self._live[mac_addr] == status:
+                    self._pending.pop(mac_addr, None)
+                else:
+                    self._pending[mac_addr] = self._live[mac_addr]
+        return len(pending)
+
+    def reset(self):
+        """
+        Drop the in-memory state, it is loaded from the database again on demand.
+
+        Used by a forked worker process, whose copy of the state is stale.
+        """
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._models.clear()
+        self._live.clear()
+        self._stored.clear()
+        self._pending.clear()
+        self._online_by_model.clear()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _set_status(self, mac_addr, status):
+        dm_id = self._models[mac_addr]
+        self._live[mac_addr] = status
+        if status == ONLINE:
+            self._online_by_model[dm_id].add(mac_addr)
+        else:
+            self._online_by_model[dm_id].discard(mac_addr)
+
+        if self._stored.get(mac_addr) == status:
+            # back to the stored status within the flush window
+            self._pending.pop(mac_addr, None)
+        else:
+            self._pending[mac_addr] = status
+
+    def _forget(self, mac_addr):
+        dm_id = self._models.pop(mac_addr, None)
+        if dm_id is not None:
+            self._online_by_model[dm_id].discard(mac_addr)
+        self._live.pop(mac_addr, None)
+        self._stored.pop(mac_addr, None)
+        self._pending.pop(mac_addr, None)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+
+        with self._app.app_context():
+            records = db.session.query(Device.mac_addr, Device.dm_id, Device.status).all()
+
+        with self._lock:
+            if self._loaded:
+                return
+            for mac_addr, dm_id, status in records:
+                self._models[mac_addr] = dm_id
+                self._stored[mac_addr] = status
+                self._set_status(mac_addr, status)
+            self._loaded = True
+
+    def _load_device(self, mac_addr, status):
+        """Track a device of the database with `status`, False if it is not stored."""
+        with self._app.app_context():
+            record = (db.session.query(Device.dm_id, Device.status)
+                                .filter(Device.mac_addr == mac_addr)
+                                .first())
+        if record is None:
+            return False
+
+        with self._lock:
+            # Unless it is registered meanwhile
+            if mac_addr not in self._models:
+                self._models[mac_addr] = record.dm_id
+                self._stored[mac_addr] = record.status
+            self._set_status(mac_addr, status)
+        return True
+
+    def _ensure_thread(self):
+        # The flush thread does not survive a fork, start a new one in the child process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='presence-flush',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+presence = PresenceTracker()
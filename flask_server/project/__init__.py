@@ -0,0 +1,5 @@
+from .compiler import compiler
+
+__all__ = [
+    'compiler',
+]
@@ -0,0 +1,259 @@
+"""
+Incremental compilation of the network applications of a project.
+
+Each NetworkApp is compiled to the join configuration the runtime loads: its
+input and output DF_Objects with the DF_Module parameters (idf_type, min, max,
+normalization and Function) and the MJ_Module join functions.
+
+The fingerprint of a NetworkApp is the SHA-1 of everything its configuration is
+compiled from. A restart compares the fingerprints with the ones deployed by the
+last restart (`netAppBuild`), only the changed NetworkApps are compiled and
+reloaded, the others keep running. The compiled configurations are cached by
+fingerprint, so a NetworkApp changed back, or equal to another one, is not
+compiled again.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from db.models import (DeviceFeature, DF_Module, DF_Object, MJ_Module, NetworkApp,
+                       NetworkAppBuild)
+from db.refdata import registry
+
+__all__ = [
+    'ArtifactCache',
+    'ProjectCompiler',
+    'compiler',
+]
+
+logger = logging.getLogger(__name__)
+
+NA = NetworkApp.__table__
+DFM = DF_Module.__table__
+MJM = MJ_Module.__table__
+DFO = DF_Object.__table__
+DF = DeviceFeature.__table__
+B = NetworkAppBuild.__table__
+
+# The number of compiled configurations kept in memory
+ARTIFACT_CACHE_SIZE = 1024
+
+
+def _sources(connection, p_id):
+    """Return what the configuration of each NetworkApp of the project is compiled from."""
+    sources = {}
+    for row in connection.execute(select(NA.c.id, NA.c.na_name)
+                                  .where(NA.c.project_id == p_id)):
+        sources[row.id] = {'na_name': row.na_name, 'df_modules': [], 'mj_modules': []}
+
+    df_modules = (
+        select(DFM.c.netApps_id, DFM.c.df_object_id, DFM.c.param_i, DFM.c.idf_type,
+               DFM.c.min, DFM.c.max, DFM.c.normalization, DFO.c.do_id, DF.c.df_name,
+               DF.c.df_type, DFM.c.function_id)
+        .join(NA, NA.c.id == DFM.c.netApps_id)
+        .join(DFO, DFO.c.id == DFM.c.df_object_id)
+        .join(DF, DF.c.id == DFO.c.df_id)
+        .where(NA.c.project_id == p_id)
+    )
+    for row in connection.execute(df_modules):
+        sources[row.netApps_id]['df_modules'].append(_with_fn_name(row._asdict()))
+
+    mj_modules = (
+        select(MJM.c.netApps_id, MJM.c.param_i, MJM.c.df_object_id, MJM.c.function_id)
+        .join(NA, NA.c.id == MJM.c.netApps_id)
+        .where(NA.c.project_id == p_id)
+    )
+    for row in connection.execute(mj_modules):
+        sources[row.netApps_id]['mj_modules'].append(_with_fn_name(row._asdict()))
+
+    for source in sources.values():
+        source['df_modules'].sort(key=lambda m: (m['df_object_id'], m['param_i']))
+        source['mj_modules'].sort(key=lambda m: m['param_i'])
+    return sources
+
+
+def _with_fn_name(module):
+    # The Function names are resolved by the registry instead of a join
+    fn_id = module.pop('function_id')
+    module['fn_name'] = registry.function_name(fn_id) if fn_id is not None else None
+    return module
+
+
+def fingerprint(source):
+    """Return the SHA-1 of the canonical JSON of a NetworkApp source."""
+    encoded = json.dumps(source, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+def compile_network_app(source):
+    """
+    Compile a NetworkApp source to its join configuration.
+
+    :return:
+        {
+            'na_name': <NetworkApp.na_name>,
+            'idf': [
+                {
+                    'dfo_id': <DF_Object.id>,
+                    'do_id': <DeviceObject.id>,
+                    'df_name': <DeviceFeature.df_name>,
+                    'params': [
+                        {
+                            'param_i': <DF_Module.param_i>,
+                            'idf_type': <DF_Module.idf_type>,
+                            'min': <DF_Module.min>,
+                            'max': <DF_Module.max>,
+                            'normalization': <DF_Module.normalization>,
+                            'fn_name': <Function.fn_name>
+                        }, ...
+                    ]
+                }, ...
+            ],
+            'odf': [<same as idf>, ...],
+            'join': [
+                {
+                    'param_i': <MJ_Module.param_i>,
+                    'dfo_id': <DF_Object.id>,
+                    'fn_name': <Function.fn_name>
+                }, ...
+            ]
+        }
+    """
+    df_objects = OrderedDict()
+    for module in source['df_modules']:
+        dfo = df_objects.get(module['df_object_id'])
+        if dfo is None:
+            dfo = df_objects[module['df_object_id']] = {
+                'dfo_id': module['df_object_id'],
+                'do_id': module['do_id'],
+                'df_name': module['df_name'],
+                'df_type': module['df_type'],
+                'params': [],
+            }
+        dfo['params'].append({
+            'param_i': module['param_i'],
+            'idf_type': module['idf_type'],
+            'min': module['min'],
+            'max': module['max'],
+            'normalization': bool(module['normalization']),
+            'fn_name': module['fn_name'],
+        })
+
+    config = {'na_name': source['na_name'], 'idf': [], 'odf': [], 'join': []}
+    for dfo in df_objects.values():
+        config[dfo.pop('df_type')].append(dfo)
+    for module in source['mj_modules']:
+        config['join'].append({
+            'param_i': module['param_i'],
+            'dfo_id': module['df_object_id'],
+            'fn_name': module['fn_name'],
+        })
+    return config
+
+
+class ArtifactCache:
+    """A thread-safe LRU map of fingerprint -> compiled configuration."""
+
+    def __init__(self, size=ARTIFACT_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._artifacts = OrderedDict()
+
+    def get_or_compile(self, fp, source):
+        with self._lock:
+            artifact = self._artifacts.get(fp)
+            if artifact is not None:
+                self._artifacts.move_to_end(fp)
+                self.hits += 1
+                return artifact
+
+        artifact = compile_network_app(source)
+        with self._lock:
+            self.misses += 1
+            self._artifacts[fp] = artifact
+            while len(self._artifacts) > self.size:
+                self._artifacts.popitem(last=False)
+        return artifact
+
+    def clear(self):
+        with self._lock:
+            self._artifacts.clear()
+
+    def reset(self):
+        """Drop the artifacts inherited by a forked worker process."""
+        self._lock = threading.Lock()
+        self._artifacts = OrderedDict()
+
+
+class ProjectCompiler:
+    def __init__(self):
+        self._app = None
+        self.cache = ArtifactCache()
+
+    def init_app(self, app):
+        self._app = app
+        self.cache.size = app.config.get('ARTIFACT_CACHE_SIZE', self.cache.size)
+        app.extensions['project_compiler'] = self
+
+    def fingerprints(self, connection, p_id):
+        """Return the {na_id: (fingerprint, source)} of the NetworkApps of a project."""
+        return {na_id: (fingerprint(source), source)
+                for na_id, source in _sources(connection, p_id).items()}
+
+    def restart(self, connection, p_id, full=False):
+        """
+        Compile the changed NetworkApps of a project and record them as deployed.
+
+        The caller commits the transaction of `connection`.
+
+        :param full: reload all the NetworkApps, even the unchanged ones
+
+        :return:
+            {
+                'reload': {<NetworkApp.id>: <configuration>, ...},
+                'unchanged': [<NetworkApp.id>, ...],
+                'unload': [<NetworkApp.id>, ...]
+            }
+        """
+        current = self.fingerprints(connection, p_id)
+        deployed = dict(connection.execute(select(B.c.na_id, B.c.fingerprint)
+                                           .where(B.c.p_id == p_id)).all())
+
+        result = {'reload': {}, 'unchanged': [], 'unload': []}
+        inserted, updated = [], []
+        for na_id, (fp, source) in sorted(current.items()):
+            if deployed.get(na_id) == fp and not full:
+                result['unchanged'].append(na_id)
+                continue
+            result['reload'][na_id] = self.cache.get_or_compile(fp, source)
+            if na_id in deployed:
+                updated.append({'b_na_id': na_id, 'b_fingerprint': fp})
+            else:
+                inserted.append({'na_id': na_id, 'fingerprint': fp, 'p_id': p_id})
+        result['unload'] = sorted(set(deployed) - set(current))
+
+        if inserted:
+            connection.execute(insert(B), inserted)
+        if updated:
+            connection.execute(update(B)
+                               .where(B.c.p_id == p_id, B.c.na_id == bindparam('b_na_id'))
+                               .values(fingerprint=bindparam('b_fingerprint')),
+                               updated)
+        if result['unload']:
+            connection.execute(delete(B).where(B.c.p_id == p_id,
+                                               B.c.na_id.in_(result['unload'])))
+
+        logger.info('Project %s restarted: %d reloaded, %d unchanged, %d unloaded',
+                    p_id, len(result['reload']), len(result['unchanged']),
+                    len(result['unload']))
+        return result
+
+
+compiler = ProjectCompiler()
@@ -0,0 +1,163 @@
+"""
+Production server.
+
+Run the app by gunicorn with pre-forked worker processes:
+
+    $ python serve.py [--bind ADDRESS] [--workers N] [--threads N]
+
+The app is created once by the master process and shared with the workers
+(`preload_app`), each worker then re-creates its database connections and caches.
+
+Send SIGHUP to the master process to replace the workers gracefully, the new
+workers are started before the old ones finish their requests and exit, and the
+listening socket is kept. The server options in `.env` are read again, the app
+itself is not. To run new code, send SIGUSR2 to start a new master next to the
+old one, then SIGQUIT to the old one.
+
+Ref: https://docs.gunicorn.org/en/stable/custom.html
+"""
+import argparse
+import http.client
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from gunicorn.app.base import BaseApplication
+
+from server import create_app, reset_after_fork
+import config
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+class Application(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        config.read_config(str(BASE_DIR / '.env'))
+        options = {
+            'bind': config.SERVER_BIND,
+            'workers': int(config.SERVER_WORKERS or os.cpu_count() or 1),
+            'threads': int(config.SERVER_THREADS or 1),
+        }
+        options.update({key: value for key, value in self.options.items() if value})
+        options.update({
+            'preload_app': True,
+            'post_fork': self.post_fork,
+        })
+        for key, value in options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return create_app()
+
+    def post_fork(self, server, worker):
+        reset_after_fork(self.callable)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_listening(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('The server is not listening on port {}'.format(port))
+
+
+def bench_serve(workers=(1, 2, 4), clients=16, requests=2000, path='/account',
+                reload=False):
+    """
+    Measure the requests/sec of the server with each number of `workers`,
+    `clients` threads sending `requests` requests in total over keep-alive
+    connections. With `reload`, SIGHUP is sent in the middle of the run.
+
+    :return: [{'workers', 'requests', 'errors', 'elapsed', 'throughput',
+               'p50_ms', 'p99_ms'}, ...]
+    """
+    results = []
+    for n in workers:
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, str(BASE_DIR / 'serve.py'),
+             '--bind', '127.0.0.1:{}'.format(port), '--workers', str(n)],
+            cwd=str(BASE_DIR), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_listening(port)
+            latencies, errors = [], []
+            per_client = requests // clients
+
+            def connect():
+                return http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+            def client():
+                connection = connect()
+                for _ in range(per_client):
+                    start = time.perf_counter()
+                    try:
+                        connection.request('GET', path)
+                        connection.getresponse().read()
+                    except (OSError, http.client.HTTPException) as e:
+                        errors.append(e)
+                        connection.close()
+                        connection = connect()
+                        continue
+                    latencies.append(time.perf_counter() - start)
+                connection.close()
+
+            threads = [threading.Thread(target=client) for _ in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            if reload:
+                while len(latencies) < requests // 2 and any(t.is_alive() for t in threads):
+                    time.sleep(0.01)
+                process.send_signal(signal.SIGHUP)
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+
+        latencies.sort()
+        results.append({
+            'workers': n,
+            'requests': len(latencies),
+            'errors': len(errors),
+            'elapsed': elapsed,
+            'throughput': len(latencies) / elapsed,
+            'p50_ms': latencies[len(latencies) // 2] * 1e3 if latencies else 0.0,
+            'p99_ms': latencies[int(len(latencies) * .99)] * 1e3 if latencies else 0.0,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the production server.')
+    parser.add_argument('--bind', help='the address to listen on, e.g. 0.0.0.0:8100')
+    parser.add_argument('--workers', type=int, help='the number of worker processes')
+    parser.add_argument('--threads', type=int, help='the number of threads per worker')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    Application(vars(args)).run()
+
+
+if __name__ == '__main__':
+    main()
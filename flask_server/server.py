@@ -1,26 +1,38 @@
 import datetime
-import pytz
 import json
 import logging
+import secrets
 import uuid
 from pathlib import Path
 
-from flask import Flask, render_template, url_for
+from flask import Flask, jsonify, render_template, request, url_for
 from flask_login import LoginManager, current_user
 from flask_session import Session, RedisSessionInterface
 from flask_wtf.csrf import CSRFProtect
-from libgravatar import Gravatar
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from account_app import account_app
+from account_app.utils import login_required
 from auth_app import auth_app
-from db import db
+from catalogue import catalogue
+from commands import commands
+from db import db, init_read_bind, read_bind_uri, READ_BIND
 from db.models import User
+from db.refdata import registry
+from db.schema import ensure_schema
+from db.slowlog import slow_queries
+from dependency import dependencies
+from modules.replay import replay_cache
+from modules.writer import write_queue
 from oauth2_client import oauth2_client
+from presence import presence
+from project import compiler
+from tracing import tracer
 import config
 
 __all__ = [
     'create_app',
+    'reset_after_fork',
 ]
 
 logger = logging.getLogger(__name__)
@@ -36,6 +48,8 @@ def create_app():
     )
     app.register_blueprint(auth_app)
     app.register_blueprint(account_app)
+    for command in commands:
+        app.cli.add_command(command)
     app.config['SECRET_KEY'] = config.SECRET_KEY
     # Make WSGI use those X-Forwareded HTTP headers.
     # The following X-Forwareded HTTP headers must be by the front reverse proxy.
@@ -55,7 +69,15 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}/localdfm.db'.format(str(BASE_DIR))
     # Ref: https://tinyurl.com/9umn83fe
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # The read ops (`op_get_*`, `op_search_*`) use a separate read-only engine.
+    #
+    # Ref: https://flask-sqlalchemy.palletsprojects.com/en/3.0.x/binds/
+    read_uri = read_bind_uri(app.config['SQLALCHEMY_DATABASE_URI'],
+                             config.DATABASE_REPLICA_URL)
+    if read_uri:
+        app.config['SQLALCHEMY_BINDS'] = {READ_BIND: read_uri}
     db.init_app(app)
+    init_read_bind(app)
 
     # Configure Flask-Session. We use database to store session.
     #
@@ -86,16 +108,56 @@ def create_app():
     # Initialize CSRFProtect app
     #
     # Ref: https://flask-wtf.readthedocs.io/en/stable/csrf.html
-    CSRFProtect(app)
+    csrf = CSRFProtect(app)
 
+    # Create the tables only if the database is not at the current schema version.
     with app.app_context():
-        db.create_all()
+        ensure_schema()
+
+    # Unit, Function and Group are resolved from memory.
+    registry.init_app(app)
+
+    # The device model/feature catalogue is served from memory if enabled.
+    app.config['CATALOGUE_CACHE'] = bool(config.CATALOGUE_CACHE)
+    catalogue.init_app(app)
+
+    # The dependencies between the project rows are indexed in memory.
+    dependencies.init_app(app)
+
+    # The compiled network applications are cached in memory by fingerprint.
+    compiler.init_app(app)
+
+    # Device status is tracked in memory and written back in batches.
+    presence.init_app(app)
+
+    # Serialize the mutating ops by a single writer thread with group commit.
+    app.config['WRITE_QUEUE'] = bool(config.WRITE_QUEUE)
+    app.config['WRITE_QUEUE_BATCH_SIZE'] = int(config.WRITE_QUEUE_BATCH_SIZE)
+    write_queue.init_app(app)
+
+    # Replay the response of a GUI request delivered again.
+    app.config['REPLAY_CACHE_SIZE'] = int(config.REPLAY_CACHE_SIZE)
+    app.config['REPLAY_CACHE_TTL'] = float(config.REPLAY_CACHE_TTL)
+    app.config['REPLAY_CACHE_MAX_BYTES'] = int(config.REPLAY_CACHE_MAX_BYTES)
+    replay_cache.init_app(app)
+
+    # Log the slow statements with their query plan.
+    app.config['SLOW_QUERY_MS'] = float(config.SLOW_QUERY_MS or 0)
+    slow_queries.init_app(app)
+
+    # Trace a sample of the requests and the ops they run.
+    app.config['TRACING_SAMPLE_RATE'] = float(config.TRACING_SAMPLE_RATE)
+    app.config['TRACING_FILE'] = config.TRACING_FILE
+    app.config['TRACING_OTLP_URL'] = config.TRACING_OTLP_URL
+    tracer.init_app(app)
 
     # Register custom context processor
     # Ref: https://flask.palletsprojects.com/en/1.1.x/templating/#context-processors
     @app.context_processor
     def custom_context_processor():
         def gravatar_url(email: str, **kwargs):
+            from libgravatar import Gravatar
+
             return Gravatar(email).get_image(**kwargs)
 
         return {'gravatar_url': gravatar_url, }
@@ -104,10 +166,6 @@ def create_app():
     def load_user(user_id):
         return User.query.filter_by(id=user_id).first()
 
-    @app.before_first_request
-    def init_database():
-        db.create_all()
-
     @app.route('/')
     def index():
         if not current_user.is_authenticated:
@@ -115,4 +173,73 @@ def create_app():
             return oauth2_client.nycu.authorize_redirect(redirect_uri)
         return render_template('manage.html')
 
+    # The GUI MQTT clients, expired after GUI_CLIENT_EXPIRE seconds.
+    # Imported here, the other routes do not need the ops
+    from gateway.clients import DbClientRegistry
+
+    gui_clients = DbClientRegistry(db, expire=int(config.GUI_CLIENT_EXPIRE))
+
+    @app.route('/mqtt_url')
+    @login_required
+    def mqtt_url():
+        """
+        Give the GUI a new MQTT client id, bound to the user for the gateway.
+
+        The GUI connects to the broker with the client id and its own secret,
+        see `gateway.broker_auth`.
+        """
+        client_id = str(uuid.uuid4())
+        secret = secrets.token_urlsafe(32)
+        gui_clients.bind(client_id, current_user.id, secret)
+        return jsonify({
+            'id': client_id,
+            'credential_id': client_id,
+            'ws_scheme': config.MQTT_WS_SCHEME,
+            'host': config.MQTT_HOST,
+            'ws_port': int(config.MQTT_WS_PORT),
+            'username': client_id,
+            'password': secret,
+        })
+
+    # The HTTP hooks of the broker, it posts the fields without a CSRF token
+    @app.route('/mqtt/auth', methods=['POST'])
+    @csrf.exempt
+    def mqtt_auth():
+        from gateway.broker_auth import authenticate
+
+        fields = request.get_json(silent=True) or request.form
+        return jsonify({'result': authenticate(gui_clients, fields.get('clientid'),
+                                               fields.get('username'),
+                                               fields.get('password'))})
+
+    @app.route('/mqtt/acl', methods=['POST'])
+    @csrf.exempt
+    def mqtt_acl():
+        from gateway.broker_auth import authorize
+
+        fields = request.get_json(silent=True) or request.form
+        return jsonify({'result': authorize(gui_clients, fields.get('username'),
+                                            fields.get('topic'), fields.get('action'))})
+
     return app
+
+
+def reset_after_fork(app):
+    """
+    Re-create the per-process state in a worker forked from a preloaded app.
+
+    The pooled database connections must not be shared with the parent process,
+    and the in-memory caches, along with their locks, are dropped and loaded
+    again by the worker itself on demand.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            # Leave the parent's connections open, they still belong to it.
+            #
+            # Ref: https://docs.sqlalchemy.org/en/20/core/pooling.html#pooling-multiprocessing
+            engine.dispose(close=False)
+    registry.reset()
+    catalogue.reset()
+    dependencies.reset()
+    compiler.cache.reset()
+    presence.reset()
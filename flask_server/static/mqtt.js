@@ -45,6 +45,11 @@ function mqtt_init() {
     var _mqtt_anno_callback;
     var _mqtt_topic_callback = {}; // for topic listener
     var _mqtt_callback_list = {}; // for request call back
+    // The server side timing of each response, shown when the local storage has
+    // 'op_timing_debug' set, e.g. localStorage.setItem('op_timing_debug', '1')
+    let _timing_debug = !!window.localStorage.getItem('op_timing_debug');
+    let _timing_rows = [];
+    let _timing_sent = {};
   
     function mqtt_message(topic, message, retained=false) {
       let msg = new Paho.MQTT.Message(message);
@@ -72,6 +77,32 @@ function mqtt_init() {
       }
     }
   
+    function show_timing(msg) {
+      let row = msg['timing'];
+      let fields = ['transit_ms', 'queue_ms', 'op_ms', 'db_ms', 'encode_ms'];
+      let total = '';
+      if (row['req_timestamp']) {
+        total = ((new Date()).getTime() - row['req_timestamp']).toFixed(1);
+      }
+      _timing_rows.unshift('<tr><td>' + msg['op'] + '</td><td>' + total + '</td>' +
+        fields.map((f) => '<td>' + (f in row ? row[f].toFixed(1) : '') + '</td>').join('') +
+        '</tr>');
+      _timing_rows = _timing_rows.slice(0, 20);
+
+      let overlay = $('#op-timing-overlay');
+      if (!overlay.length) {
+        overlay = $('<div id="op-timing-overlay"></div>').css({
+          'position': 'fixed', 'right': 0, 'bottom': 0, 'z-index': 9999,
+          'background': 'rgba(0, 0, 0, 0.75)', 'color': '#fff',
+          'font': '11px monospace', 'padding': '4px', 'max-height': '40%',
+          'overflow': 'auto',
+        }).appendTo('body');
+      }
+      overlay.html('<table><tr><th>op</th><th>total</th><th>transit</th><th>queue</th>' +
+        '<th>op</th><th>db</th><th>encode</th></tr>' + _timing_rows.join('') +
+        '</table>');
+    }
+
     function request(op, data, callback) {
       let flag = UUID();
       let msg = {
@@ -85,6 +116,9 @@ function mqtt_init() {
       if (callback) {
         _mqtt_callback_list[flag] = callback;
       }
+      if (_timing_debug) {
+        _timing_sent[flag] = msg['req_timestamp'];
+      }
   
       publish(JSON.stringify(msg), callback);
     }
@@ -125,8 +159,14 @@ function mqtt_init() {
       if (!('op' in msg)) {
         return;
       }
+
+      if (_timing_debug && msg['timing']) {
+        msg['timing']['req_timestamp'] = _timing_sent[msg['flag']];
+        delete _timing_sent[msg['flag']];
+        show_timing(msg);
+      }
   
-      else if ('anno' == msg['op']) {
+      if ('anno' == msg['op']) {
         if ('Authentication Fail' == msg['state']) {
           window.location = window.location.origin + "/login";
         }
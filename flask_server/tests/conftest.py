@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+# The modules are imported from the top of `flask_server`, as the server does
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from db import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path / 'test.db')
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
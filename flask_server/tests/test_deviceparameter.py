@@ -0,0 +1,55 @@
+import pytest
+
+from db import db
+from db import models
+from modules.deviceparameter import _merged_parameter_query
+
+
+def _base():
+    return models.DeviceParameter(param_type='float', idf_type='sample', min=0, max=10,
+                                  unit_id=models.NONE_UNIT_ID, fn_id=None,
+                                  normalization=True)
+
+
+def test_delta_clears_fields_to_null():
+    base = _base()
+    delta = base.delta_from({'min': None, 'max': '', 'unit_id': None, 'idf_type': 'sample'})
+    assert delta == {'min': None, 'max': None, 'unit_id': None}
+
+    record = models.DeviceParameterDelta()
+    record.apply(delta)
+    assert record.as_delta() == delta
+
+
+def test_delta_parses_booleans_strictly():
+    base = _base()
+    assert base.delta_from({'normalization': 'false'}) == {'normalization': False}
+    assert base.delta_from({'normalization': 'True'}) == {}
+    assert base.delta_from({'normalization': 0}) == {'normalization': False}
+    with pytest.raises(ValueError):
+        base.delta_from({'normalization': 'no'})
+
+
+def test_merged_parameter_of_cleared_fields(app):
+    with app.app_context():
+        user = models.User(username='user', group_id=2)
+        dm = models.DeviceModel(dm_name='Dummy', dm_type='other')
+        df = models.DeviceFeature(df_name='Dummy-I', df_type='idf', param_num=1, user_id=1)
+        general = models.User(id=1, username='general', group_id=2)
+        db.session.add_all([general, user, dm, df])
+        db.session.flush()
+        mf = models.DM_DF(dm_id=dm.id, df_id=df.id)
+        db.session.add(mf)
+        db.session.flush()
+        base = _base()
+        base.user_id, base.df_id, base.dmdf_id = 1, df.id, mf.id
+        db.session.add(base)
+        db.session.flush()
+        record = models.DeviceParameterDelta(base_id=base.id, user_id=user.id)
+        record.apply(base.delta_from({'min': None, 'max': 5}))
+        db.session.add(record)
+        db.session.commit()
+
+        row = db.session.execute(_merged_parameter_query(
+            user.id, models.DeviceParameter.dmdf_id == mf.id)).one()
+        assert (row.min, row.max, row.unit_id) == (None, 5, models.NONE_UNIT_ID)
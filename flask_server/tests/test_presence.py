@@ -0,0 +1,34 @@
+import datetime
+
+from sqlalchemy import insert
+
+from db import db
+from db import models
+from presence.tracker import OFFLINE, ONLINE, PresenceTracker
+
+
+def test_heartbeat_of_a_device_registered_by_another_process(app):
+    # Flushed by the test only
+    tracker = PresenceTracker(flush_interval=3600)
+    tracker.init_app(app)
+    assert not tracker.heartbeat('mac-1')
+
+    # Stored by another process, the tracker has loaded the devices before
+    with app.app_context():
+        user_id = db.session.execute(insert(models.User.__table__).values(
+            username='user', group_id=2)).inserted_primary_key[0]
+        dm_id = db.session.execute(insert(models.DeviceModel.__table__).values(
+            dm_name='Dummy', dm_type='other')).inserted_primary_key[0]
+        db.session.execute(insert(models.Device.__table__).values(
+            mac_addr='mac-1', d_name='Dummy', status=OFFLINE, monitor='', is_sim=False,
+            register_time=datetime.datetime.now(datetime.timezone.utc),
+            extra_setup_webpage='', device_webpage='', user_id=user_id, dm_id=dm_id))
+        db.session.commit()
+
+    assert tracker.heartbeat('mac-1', ONLINE)
+    assert tracker.status('mac-1') == ONLINE
+    assert tracker.online_devices(dm_id) == ['mac-1']
+    assert tracker.flush() == 1
+    tracker.stop()
+    with app.app_context():
+        assert models.Device.query.filter_by(mac_addr='mac-1').one().status == ONLINE
@@ -0,0 +1,81 @@
+import re
+
+from sqlalchemy import delete, insert, select, text
+
+from db import db
+from db import models
+from db.schema import REBUILT_TABLES, SCHEMA_VERSION, ensure_schema
+
+
+def _table_sql(connection, name):
+    return connection.execute(
+        text('SELECT sql FROM sqlite_master WHERE type = :type AND name = :name'),
+        {'type': 'table', 'name': name}).scalar()
+
+
+def _seed_model(connection):
+    user_id = connection.execute(insert(models.User.__table__).values(
+        username='user', group_id=2)).inserted_primary_key[0]
+    dm_id = connection.execute(insert(models.DeviceModel.__table__).values(
+        dm_name='Dummy', dm_type='other')).inserted_primary_key[0]
+    df_id = connection.execute(insert(models.DeviceFeature.__table__).values(
+        df_name='Dummy-I', df_type='idf', param_num=1, user_id=user_id)
+    ).inserted_primary_key[0]
+    mf_id = connection.execute(insert(models.DM_DF.__table__).values(
+        dm_id=dm_id, df_id=df_id)).inserted_primary_key[0]
+    # Without a unit_id, the parameter gets the "None" unit
+    connection.execute(insert(models.DeviceParameter.__table__).values(
+        param_type='int', min=0, max=0, idf_type='sample', normalization=False,
+        user_id=user_id, df_id=df_id, dmdf_id=mf_id))
+    return dm_id
+
+
+def test_fresh_database_has_the_none_unit(app):
+    with app.app_context(), db.engine.begin() as connection:
+        assert connection.execute(
+            select(models.Unit.__table__.c.unit_name)
+            .where(models.Unit.__table__.c.id == models.NONE_UNIT_ID)).scalar() == 'None'
+        _seed_model(connection)
+
+
+def test_upgrade_adds_the_on_delete_rules(app):
+    names = REBUILT_TABLES[9]
+    with app.app_context():
+        # A database created before the ON DELETE rules and the schema version
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+            with connection.begin():
+                dm_id = _seed_model(connection)
+                for name in names:
+                    table = db.metadata.tables[name]
+                    sql = re.sub(r' ON DELETE (CASCADE|SET NULL|RESTRICT)', '',
+                                 _table_sql(connection, name))
+                    rows = [dict(row._mapping) for row in connection.execute(select(table))]
+                    table.drop(connection)
+                    connection.exec_driver_sql(sql)
+                    if rows:
+                        connection.execute(insert(table), rows)
+                connection.execute(delete(models.SchemaVersion.__table__))
+            connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+            connection.commit()
+            assert 'ON DELETE' not in _table_sql(connection, 'dm_df')
+
+        assert ensure_schema()
+
+        with db.engine.begin() as connection:
+            for name in names:
+                assert 'ON DELETE' in _table_sql(connection, name), name
+            assert connection.execute(
+                select(models.SchemaVersion.__table__.c.version)).scalar() == SCHEMA_VERSION
+            assert connection.execute(
+                text("SELECT count(*) FROM sqlite_master WHERE type = 'trigger'"
+                     " AND name = 'fts_dmdf_insert'")).scalar() == 1
+            assert connection.execute(
+                select(models.DeviceParameter.__table__.c.id)).all()
+
+            connection.execute(delete(models.DeviceModel.__table__)
+                               .where(models.DeviceModel.__table__.c.id == dm_id))
+            assert not connection.execute(select(models.DM_DF.__table__.c.id)).all()
+            assert not connection.execute(
+                select(models.DeviceParameter.__table__.c.id)).all()
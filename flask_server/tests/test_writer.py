@@ -0,0 +1,34 @@
+from concurrent.futures import Future
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from db.models import NONE_UNIT_ID, Unit
+from modules.writer import WriteQueue
+
+
+def _add_unit(unit_id, name):
+    db.session.add(Unit(id=unit_id, unit_name=name))
+    db.session.commit()
+    return unit_id
+
+
+def test_failing_op_fails_alone_in_its_batch(app):
+    writer = WriteQueue()
+    writer.init_app(app)
+    batch = [(Future(), _add_unit, args, {})
+             for args in ((10, 'a'), (11, 'a'), (12, 'b'))]
+    for future, *_ in batch:
+        future.set_running_or_notify_cancel()
+
+    with app.app_context():
+        writer._run_batch(batch)
+
+    good, bad, other = (future for future, *_ in batch)
+    assert good.result() == 10
+    with pytest.raises(IntegrityError):
+        bad.result()
+    assert other.result() == 12
+    with app.app_context():
+        assert sorted(unit.id for unit in Unit.query) == [NONE_UNIT_ID, 10, 12]
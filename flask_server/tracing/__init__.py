@@ -0,0 +1,5 @@
+from .tracer import tracer
+
+__all__ = [
+    'tracer',
+]
@@ -0,0 +1,96 @@
+"""
+Span exporters, called by the background thread of the tracer with a batch of spans.
+
+    JsonLinesExporter  appends a JSON object per span to a local file
+    OtlpHttpExporter   posts the spans as OTLP/HTTP JSON to a collector,
+                       e.g. http://localhost:4318/v1/traces
+"""
+import json
+import os
+import threading
+
+__all__ = [
+    'JsonLinesExporter',
+    'OtlpHttpExporter',
+    'exporter_from_config',
+]
+
+SERVICE_NAME = 'localdfm'
+
+# https://opentelemetry.io/docs/specs/otlp/ SpanKind and StatusCode
+OTLP_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+OTLP_STATUS_ERROR = 2
+
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.as_dict(), default=str) + '\n' for span in spans)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(lines)
+
+
+class OtlpHttpExporter:
+    def __init__(self, url, timeout=5.0):
+        import requests
+
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def export(self, spans):
+        body = {
+            'resourceSpans': [{
+                'resource': {'attributes': [_attribute('service.name', SERVICE_NAME),
+                                            _attribute('process.pid', os.getpid())]},
+                'scopeSpans': [{
+                    'scope': {'name': 'tracing'},
+                    'spans': [_otlp_span(span) for span in spans],
+                }],
+            }],
+        }
+        response = self._session.post(self.url, data=json.dumps(body, default=str),
+                                      headers={'Content-Type': 'application/json'},
+                                      timeout=self.timeout)
+        response.raise_for_status()
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def _otlp_span(span):
+    otlp = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': OTLP_KINDS[span.kind],
+        'startTimeUnixNano': str(int(span.start * 1e9)),
+        'endTimeUnixNano': str(int(span.end * 1e9)),
+        'attributes': [_attribute(key, value) for key, value in span.attributes.items()],
+    }
+    if span.parent_id:
+        otlp['parentSpanId'] = span.parent_id
+    if span.error:
+        otlp['status'] = {'code': OTLP_STATUS_ERROR, 'message': span.error}
+    return otlp
+
+
+def exporter_from_config(app_config):
+    """Return the exporter configured by TRACING_OTLP_URL or TRACING_FILE, or None."""
+    if app_config.get('TRACING_OTLP_URL'):
+        return OtlpHttpExporter(app_config['TRACING_OTLP_URL'])
+    if app_config.get('TRACING_FILE'):
+        return JsonLinesExporter(app_config['TRACING_FILE'])
+    return None
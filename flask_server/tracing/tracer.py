@@ -0,0 +1,274 @@
+"""
+Lightweight span tracing.
+
+A trace starts at an HTTP route or a GUI request of the gateway, the spans of
+the ops (`modules.interface`), of the ops they call and of their SQL statements
+nest under it, along with the outbound HTTP calls wrapped by `tracer.span()`:
+
+    with tracer.span('oauth2 revoke_token', kind='client', url=url):
+        ...
+
+Sampling is decided once at the root span, with probability `sample_rate`,
+and every span of the trace follows it. An unsampled trace costs a context
+variable lookup per span, and nothing at all when the rate is 0.
+
+The finished spans are queued and written by a background thread to the
+exporter, see `tracing.exporters`.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = [
+    'Span',
+    'Tracer',
+    'tracer',
+]
+
+logger = logging.getLogger(__name__)
+
+# The spans kept waiting for the exporter, the newer ones are dropped beyond
+QUEUE_SIZE = 10000
+# The spans written to the exporter at once
+EXPORT_BATCH_SIZE = 512
+# The characters of an SQL statement kept in its span
+STATEMENT_LENGTH = 500
+
+_current = ContextVar('tracing_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end',
+                 'attributes', 'error', '_tracer', '_token')
+
+    def __init__(self, tracer, name, kind, parent, attributes):
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+        self._tracer = tracer
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        self.end = time.time()
+        if error is not None:
+            self.error = '{}: {}'.format(type(error).__name__, error)
+        self._tracer._finish(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.finish(exc)
+
+    def as_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start,
+            'end': self.end,
+            'duration_ms': (self.end - self.start) * 1e3,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _Scope:
+    """Runs a block as part of an unsampled trace, or with a given parent span."""
+
+    __slots__ = ('span', '_token')
+
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        self._token = _current.set(self.span)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+
+
+class _Noop:
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NOOP = _Noop()
+# The current span of an unsampled trace
+_UNSAMPLED = object()
+
+
+class Tracer:
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.exporter = None
+        self.dropped = 0
+
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        from tracing.exporters import exporter_from_config
+
+        self.exporter = exporter_from_config(app.config)
+        self.sample_rate = (float(app.config.get('TRACING_SAMPLE_RATE') or 0)
+                            if self.exporter is not None else 0.0)
+        app.extensions['tracer'] = self
+
+        @app.before_request
+        def start_request_span():
+            from flask import g, request
+
+            if request.endpoint == 'static':
+                return
+            name = 'HTTP {} {}'.format(request.method, request.url_rule or request.path)
+            g.tracing_span = self.span(name, kind='server')
+            g.tracing_span.__enter__()
+
+        @app.teardown_request
+        def finish_request_span(error=None):
+            from flask import g
+
+            span = g.pop('tracing_span', None)
+            if span is not None:
+                span.__exit__(None, error, None)
+
+    def span(self, name, kind='internal', root=True, **attributes):
+        """
+        Return a context manager running the block in a new span.
+
+        :param root: start a trace if there is no current span, otherwise the
+                     block is only traced as part of a trace
+        """
+        parent = _current.get()
+        if parent is _UNSAMPLED:
+            return _NOOP
+        if parent is None:
+            if not root or not self.sample_rate:
+                return _NOOP
+            if random.random() >= self.sample_rate:
+                return _Scope(_UNSAMPLED)
+        return Span(self, name, kind, parent, attributes)
+
+    def current(self):
+        """Return the current span, None if the block is not traced."""
+        span = _current.get()
+        return span if isinstance(span, Span) else None
+
+    def wrap(self, fn):
+        """Return `fn` run under the current span, for a block run by another thread."""
+        parent = _current.get()
+        if parent is None:
+            return fn
+
+        def traced(*args, **kwargs):
+            with _Scope(parent):
+                return fn(*args, **kwargs)
+
+        return traced
+
+    def flush(self, timeout=5.0):
+        """Wait for the queued spans to be exported."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _finish(self, span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # The exporter thread does not survive a fork, start a new one in the child process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._run, name='tracing', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(batch)
+            except Exception:
+                logger.exception('Export %d spans failed', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+tracer = Tracer()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    if isinstance(parent, Span):
+        context._tracing_span = Span(tracer, 'sql', 'client', parent,
+                                     {'db.statement': statement[:STATEMENT_LENGTH]})
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, '_tracing_span', None)
+    if span is not None:
+        context._tracing_span = None
+        span.set('db.rowcount', cursor.rowcount)
+        span.finish()
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    span = getattr(context, '_tracing_span', None)
+    if span is not None:
+        context._tracing_span = None
+        span.finish(exception_context.original_exception)